@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+"""
+Answer Grading - Grade typed flashcard answers locally, Gemini only for the unclear ones.
+
+This module provides functionality to:
+1. Normalize answers and expected answers: case, accents, punctuation,
+   articles, plural "s", and numbers ("twenty one", "1,000", "3rd" -> digits)
+2. Score a whole attempt in one vectorized rapidfuzz pass (WRatio of each
+   answer against its expected answer), weighted by how many of the expected
+   answer's words the student covered and how many of the student's words
+   belong to the expected answer, with mismatched numbers capped. An answer
+   covering too little of the expected one, or made up mostly of other words
+   (a list of guesses), cannot reach a passing band; one padded with some other
+   words cannot go above the ambiguous one
+3. Map score bands onto the self-ratings spaced repetition already uses:
+     score >= GRADE_EASY      -> easy
+     score >= GRADE_MEDIUM    -> medium
+     score >= GRADE_AMBIGUOUS -> hard, or Gemini's verdict (below)
+     lower, or no answer      -> dont_know
+4. Optionally (GRADING_LLM=1) send only the answers in the ambiguous band to
+   Gemini, all in one call; if it fails or is slow the band's rating stands
+
+Scores are 0-100.
+"""
+
+import json
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+import llm
+
+# Lower bounds of the score bands (0-100)
+GRADE_EASY = float(os.getenv("GRADE_EASY", "90"))
+GRADE_MEDIUM = float(os.getenv("GRADE_MEDIUM", "75"))
+GRADE_AMBIGUOUS = float(os.getenv("GRADE_AMBIGUOUS", "50"))
+
+# Ask Gemini about answers in the ambiguous band ("1" to enable), within this many seconds
+GRADING_LLM = os.getenv("GRADING_LLM", "0") == "1"
+GRADING_LLM_TIMEOUT_SECONDS = float(os.getenv("GRADING_LLM_TIMEOUT_SECONDS", "8"))
+
+FUZZY = "fuzzy"
+LLM = "llm"
+
+# Gemini's verdicts on ambiguous answers, as ratings
+_VERDICT_RATINGS = {"correct": "medium", "partial": "hard", "incorrect": "dont_know"}
+
+# Answers that say the student does not know
+_NO_ANSWER = {"", "idk", "i dont know", "dont know", "no idea", "not sure", "pass", "?"}
+
+_ARTICLES = {"a", "an", "the"}
+
+_UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+_TENS = {"twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90}
+_SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000, "billion": 1000000000}
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d{3}\b)")
+_ORDINAL = re.compile(r"\b(\d+)(?:st|nd|rd|th)\b")
+_NON_WORD = re.compile(r"[^\w\s.]|(?<!\d)\.|\.(?!\d)")
+
+# Expected words count as covered by an answer word this similar (typos)
+_WORD_MATCH = 85
+
+# Below this share of the expected words covered, an answer scores under GRADE_AMBIGUOUS
+_MIN_COVERAGE = 0.5
+
+# Below this share of the answer's words found in the expected answer, it scores under GRADE_MEDIUM;
+# below half of it (mostly other words, e.g. a list of guesses) under GRADE_AMBIGUOUS
+_MIN_PRECISION = 0.5
+
+# Score of an answer whose numbers contradict the expected ones
+_WRONG_NUMBER_SCORE = 30.0
+
+
+@dataclass(slots=True)
+class Grade:
+    """The grade of one answer: its score, the rating it maps to and what decided it."""
+
+    question_number: int
+    score: float
+    rating: str
+    graded_by: str = FUZZY
+
+
+def _number_words(tokens: List[str]) -> List[str]:
+    """
+    Replace runs of number words ("twenty one", "two hundred") with digits.
+
+    A unit or teen right after a unit or teen, or a tens word after a value
+    with no scale word in between, starts a new number ("one two three" is
+    1 2 3). Two two-digit numbers in a row are read as a year: "nineteen
+    forty five" is 1945.
+    """
+    out: List[str] = []
+    groups: List[int] = []  # numbers of the current run, joined as a year if they pair up
+    total = current = 0
+    last = None  # "unit", "tens" or "scale": the previous word of the number
+    in_number = False
+
+    def end_number():
+        nonlocal total, current, last, in_number
+        if in_number:
+            groups.append(total + current)
+        total = current = 0
+        last = None
+        in_number = False
+
+    def flush():
+        end_number()
+        if len(groups) == 2 and all(10 <= group <= 99 for group in groups):
+            out.append(str(groups[0] * 100 + groups[1]))  # 19|45 -> 1945, 17|89 -> 1789
+        else:
+            out.extend(str(group) for group in groups)
+        groups.clear()
+
+    for token in tokens:
+        if token in _UNITS:
+            # "one two", "nineteen five": a unit after a unit or teen (or after a tens word
+            # that already has one) starts another number
+            if last == "unit" or (last == "tens" and current % 10):
+                end_number()
+            current += _UNITS[token]
+            last = "unit"
+            in_number = True
+        elif token in _TENS:
+            # "nineteen forty": a tens word after a value with no scale word in between
+            if in_number and last != "scale" and (total + current):
+                end_number()
+            current += _TENS[token]
+            last = "tens"
+            in_number = True
+        elif token in _SCALES and in_number:
+            current = max(current, 1) * _SCALES[token]
+            if _SCALES[token] >= 1000:
+                total, current = total + current, 0
+            last = "scale"
+        elif token == "and" and in_number:
+            continue
+        else:
+            flush()
+            out.append(token)
+    flush()
+    return out
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase words without accents, punctuation or articles; numbers as plain digits."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = _ORDINAL.sub(r"\1", _THOUSANDS.sub("", text))
+    text = _NON_WORD.sub(" ", text.replace("'", ""))
+    tokens = []
+    for token in _number_words(text.split()):
+        if token in _ARTICLES:
+            continue
+        if _NUMBER.fullmatch(token):
+            token = token.rstrip("0").rstrip(".") if "." in token else token
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return " ".join(tokens)
+
+
+def _numbers(text: str) -> Set[str]:
+    return set(_NUMBER.findall(text))
+
+
+def _overlap(answers: List[str], expected: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per answer: the share of its expected answer's words it contains (coverage)
+    and the share of its own words found in the expected answer (precision),
+    allowing typos.
+    """
+    from rapidfuzz import fuzz, process
+
+    coverage, precision = np.ones(len(expected)), np.ones(len(expected))
+    for i, (answer, target) in enumerate(zip(answers, expected)):
+        target_words, answer_words = target.split(), answer.split()
+        if not target_words:
+            continue
+        if not answer_words:
+            coverage[i] = precision[i] = 0.0
+            continue
+        matches = process.cdist(target_words, answer_words, scorer=fuzz.ratio) >= _WORD_MATCH
+        coverage[i] = float(np.mean(matches.any(axis=1)))
+        precision[i] = float(np.mean(matches.any(axis=0)))
+    return coverage, precision
+
+
+def scores(answers: Iterable[Optional[str]], expected: Iterable[Optional[str]]) -> np.ndarray:
+    """Similarity (0-100) of each answer to its expected answer, for a whole attempt at once."""
+    from rapidfuzz import fuzz, process
+
+    answers = [normalize(a) for a in answers]
+    expected = [normalize(e) for e in expected]
+    if not answers:
+        return np.zeros(0)
+
+    similarity = np.asarray(process.cpdist(answers, expected, scorer=fuzz.WRatio), dtype=float)
+    coverage, precision = _overlap(answers, expected)
+    # Most of the weight on overall similarity (WRatio alone forgives both missing and extra words)
+    result = similarity * (0.6 + 0.25 * coverage + 0.15 * precision)
+    result = np.where(coverage < _MIN_COVERAGE, np.minimum(result, GRADE_AMBIGUOUS - 1), result)
+    result = np.where(precision < _MIN_PRECISION, np.minimum(result, GRADE_MEDIUM - 1), result)
+    result = np.where(precision < _MIN_PRECISION / 2, np.minimum(result, GRADE_AMBIGUOUS - 1), result)
+
+    for i, (answer, target) in enumerate(zip(answers, expected)):
+        if answer in _NO_ANSWER:
+            result[i] = 0.0
+            continue
+        wanted, given = _numbers(target), _numbers(answer)
+        if wanted and given and not wanted & given:
+            result[i] = min(result[i], _WRONG_NUMBER_SCORE)
+        elif wanted and not given:
+            result[i] = min(result[i], GRADE_MEDIUM - 1)  # the number is the point of the card
+    return np.round(result, 1)
+
+
+def rating_for(score: float) -> str:
+    if score >= GRADE_EASY:
+        return "easy"
+    if score >= GRADE_MEDIUM:
+        return "medium"
+    if score >= GRADE_AMBIGUOUS:
+        return "hard"
+    return "dont_know"
+
+
+def is_ambiguous(score: float) -> bool:
+    return GRADE_AMBIGUOUS <= score < GRADE_MEDIUM
+
+
+def grade_locally(questions: List[Optional[str]], expected: List[Optional[str]],
+                  answers: List[Optional[str]]) -> List[Grade]:
+    """Grades of an attempt's answers (question numbers from 1) by their band alone."""
+    return [
+        Grade(i + 1, float(score), rating_for(score))
+        for i, score in enumerate(scores(answers, expected))
+    ]
+
+
+def _llm_verdicts(items: List[tuple]) -> List[Optional[str]]:
+    """Gemini's verdict ("correct", "partial", "incorrect") on each ``(question, expected, answer)``."""
+    lines = [
+        f"{n}. Question: {question}\n   Expected answer: {expected}\n   Student answer: {answer}"
+        for n, (question, expected, answer) in enumerate(items, start=1)
+    ]
+    prompt = (
+        "Grade a student's answers to flashcards. For each numbered item decide whether the student's "
+        "answer means the same as the expected answer: \"correct\", \"partial\" or \"incorrect\". "
+        "Ignore spelling and wording. Return ONLY a JSON array of these words, one per item, in order.\n\n"
+        + "\n".join(lines)
+    )
+    genai_types = llm.types()
+    config = genai_types.GenerateContentConfig(
+        temperature=0.0,
+        http_options=genai_types.HttpOptions(timeout=int(GRADING_LLM_TIMEOUT_SECONDS * 1000)),
+    )
+    response = llm.generate_content(prompt, config=config)
+    text = llm.response_text(response).strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```[a-zA-Z]*\n|```$", "", text).strip()
+    verdicts = json.loads(text)
+    if not isinstance(verdicts, list):
+        raise ValueError(f"Expected a JSON array of verdicts, got {text[:100]}")
+    verdicts = [str(v).strip().lower() if v is not None else None for v in verdicts]
+    return (verdicts + [None] * len(items))[:len(items)]
+
+
+def grade(questions: List[Optional[str]], expected: List[Optional[str]], answers: List[Optional[str]],
+          use_llm: Optional[bool] = None) -> List[Grade]:
+    """
+    Grade an attempt (blocking): locally, then the ambiguous answers with Gemini
+    in one call if ``use_llm`` (default GRADING_LLM). Gemini failures keep the
+    local grades.
+    """
+    grades = grade_locally(questions, expected, answers)
+    if not (GRADING_LLM if use_llm is None else use_llm):
+        return grades
+
+    unclear = [g for g in grades if is_ambiguous(g.score)]
+    if not unclear:
+        return grades
+    items = [(questions[g.question_number - 1], expected[g.question_number - 1], answers[g.question_number - 1])
+             for g in unclear]
+    try:
+        verdicts = _llm_verdicts(items)
+    except Exception as e:
+        print(f"Gemini grading of {len(items)} unclear answers failed, keeping local grades: {e}")
+        return grades
+    for g, verdict in zip(unclear, verdicts):
+        if verdict in _VERDICT_RATINGS:
+            g.rating = _VERDICT_RATINGS[verdict]
+            g.graded_by = LLM
+    return grades
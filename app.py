@@ -7,6 +7,8 @@ from datetime import datetime
 from pymongo import MongoClient
 from urllib.parse import quote_plus
 import logging
+import threading
+from semantic_index import VectorIndex, DEDUP_THRESHOLD
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -26,6 +28,10 @@ if not os.path.exists(UPLOAD_FOLDER):
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# user -> index of their questions, kept across requests for the duplicate check
+_question_indexes = {}
+_question_indexes_lock = threading.Lock()
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -89,6 +95,18 @@ def upload_file():
 
 #database functions #
 
+def _user_question_index(collection, user):
+    """The cached index of a user's questions, rebuilt only if other writers changed how many there are."""
+    index = _question_indexes.get(user)
+    if index is None or len(index) != collection.count_documents({"user": user}):
+        index = VectorIndex()
+        index.add_many([
+            (str(doc["_id"]), doc.get("question", ""), {"kind": "question"})
+            for doc in collection.find({"user": user}, {"question": 1})
+        ])
+        _question_indexes[user] = index
+    return index
+
 #adding stuff to the databa
 @app.route('/add_question', methods=['POST'])
 def add_question():
@@ -108,16 +126,31 @@ def add_question():
             missing_fields = [key for key in ("user", "question", "answer", "difficulty") if key not in data]
             return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
 
-        item = {
-            "user": data["user"],
-            "question": data["question"],
-            "answer": data["answer"],
-            "difficulty": data["difficulty"]
-        }
-
-        logger.debug(f"Attempting to insert item: {item}")
-        result = collection.insert_one(item)
-        logger.debug(f"Successfully inserted item with ID: {result.inserted_id}")
+        # Reject questions the user already has in different wording. The check, the insert
+        # and the index update happen under one lock, so two requests with the same
+        # question cannot both pass the check
+        with _question_indexes_lock:
+            existing = _user_question_index(collection, data["user"])
+            match = existing.near_duplicates([data["question"]], DEDUP_THRESHOLD)[0] if len(existing) else None
+            if match:
+                logger.debug(f"Question is a near duplicate of {match['id']} (score {match['score']:.2f})")
+                return jsonify({
+                    "error": "Near-duplicate question",
+                    "duplicate_of": match["id"],
+                    "similarity": match["score"]
+                }), 409
+
+            item = {
+                "user": data["user"],
+                "question": data["question"],
+                "answer": data["answer"],
+                "difficulty": data["difficulty"]
+            }
+
+            logger.debug(f"Attempting to insert item: {item}")
+            result = collection.insert_one(item)
+            logger.debug(f"Successfully inserted item with ID: {result.inserted_id}")
+            existing.add(str(result.inserted_id), data["question"], {"kind": "question"})
         
         return jsonify({"message": "Item added", "id": str(result.inserted_id)}), 201
     except ValueError as e:
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+"""
+Attempt Buffer - Write-behind ingestion of quiz attempts.
+
+This module provides functionality to:
+1. Acknowledge a submitted attempt once it is appended to a local write-ahead
+   log: a SQLite file on disk (ATTEMPT_WAL_PATH, synchronous=FULL) shared by the
+   workers of one host, so an acknowledged attempt survives a crash
+2. Flush the log to `attempts` with insert_many in batches of up to
+   ATTEMPT_FLUSH_BATCH, at least every ATTEMPT_FLUSH_SECONDS, from a background
+   task in every worker (rows are claimed, so workers never flush the same one)
+3. Refresh the review digests of flushed attempts after they are stored
+4. Check quiz ids against a per-process cache of known quizzes instead of
+   reading the quiz on every submission
+5. Schedule the cards of new attempts in the flusher rather than while the
+   submission waits: card memory carries over from each user's previous attempt
+   at the quiz (one query per batch) and due dates are spread over their
+   upcoming load (one digest read per batch). A user's attempts at one quiz are
+   claimed in order, so each is scheduled after the one before is stored
+6. Report buffer depth and flush lag (`metrics`)
+
+Attempts get their ObjectId when appended, so the id in the response is the
+id they are stored under, and a flush retried after a crash only meets
+duplicate keys, which count as done. Set ATTEMPT_WRITE_BEHIND=0 to insert
+every attempt directly instead.
+"""
+
+import asyncio
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+
+import review_digest
+import shared_state
+from models import Attempt, CardResponse
+from spaced_repetition import schedule_reviews
+
+# Acknowledge attempts after the local append ("1") or after the insert into MongoDB ("0")
+ATTEMPT_WRITE_BEHIND = os.getenv("ATTEMPT_WRITE_BEHIND", "1") == "1"
+
+# Write-ahead log of pending attempts; on persistent disk (not tmpfs or a temp dir cleared at
+# boot), the same path for every worker of a host. Relative to the working directory by default
+ATTEMPT_WAL_PATH = os.getenv("ATTEMPT_WAL_PATH", os.path.join("data", "deepify-attempts.sqlite3"))
+
+# Most attempts per insert_many, and the longest an attempt waits for one
+ATTEMPT_FLUSH_BATCH = int(os.getenv("ATTEMPT_FLUSH_BATCH", "500"))
+ATTEMPT_FLUSH_SECONDS = float(os.getenv("ATTEMPT_FLUSH_SECONDS", "0.5"))
+
+# Claimed rows not flushed within this many seconds (the worker died) are flushed by another
+_CLAIM_TTL_SECONDS = 60.0
+
+# Version counter bumped when quizzes are deleted; known quiz ids are dropped when it changes
+_QUIZ_IDS_VERSION_KEY = "quiz_ids"
+
+# Digests refreshed at once after a flush
+_DIGEST_CONCURRENCY = 8
+
+_DUPLICATE_KEY = 11000
+
+
+@dataclass(slots=True)
+class _Pending:
+    id: str
+    doc: bytes
+    appended: float
+
+
+class AttemptLog:
+    """SQLite write-ahead log of attempts not yet in MongoDB."""
+
+    def __init__(self, path: str = ATTEMPT_WAL_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS attempts (id TEXT PRIMARY KEY, quiz_id TEXT, user_id TEXT, "
+                "doc BLOB, appended REAL, owner TEXT, claimed REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS attempts_by_user ON attempts (quiz_id, user_id, appended)")
+            conn.execute("CREATE INDEX IF NOT EXISTS attempts_by_age ON attempts (appended)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not cross threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")  # an acknowledged attempt is on disk
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def append(self, attempt_id: str, quiz_id: str, user_id: str, doc: bytes):
+        self._connection().execute(
+            "INSERT INTO attempts (id, quiz_id, user_id, doc, appended) VALUES (?, ?, ?, ?, ?)",
+            (attempt_id, quiz_id, user_id, doc, time.time()),
+        )
+
+    def claim(self, owner: str, limit: int, ttl: float = _CLAIM_TTL_SECONDS) -> List[_Pending]:
+        """
+        The oldest unclaimed (or abandoned) rows, up to ``limit``, now claimed by
+        ``owner``; none whose user has an earlier attempt at the quiz claimed by another.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, doc, appended FROM attempts AS a WHERE (owner IS NULL OR claimed < ?) "
+                "AND NOT EXISTS (SELECT 1 FROM attempts AS e WHERE e.quiz_id = a.quiz_id "
+                "AND e.user_id = a.user_id AND e.appended < a.appended AND e.owner IS NOT NULL AND e.claimed >= ?) "
+                "ORDER BY appended LIMIT ?",
+                (now - ttl, now - ttl, limit),
+            ).fetchall()
+            conn.executemany("UPDATE attempts SET owner = ?, claimed = ? WHERE id = ?",
+                             [(owner, now, row[0]) for row in rows])
+        return [_Pending(*row) for row in rows]
+
+    def release(self, ids: List[str], owner: str):
+        with self._transaction() as conn:
+            conn.executemany("UPDATE attempts SET owner = NULL WHERE id = ? AND owner = ?",
+                             [(attempt_id, owner) for attempt_id in ids])
+
+    def update(self, docs: List[Tuple[str, bytes]], owner: str):
+        """Replace the documents of rows claimed by ``owner``, given as ``(id, doc)``."""
+        with self._transaction() as conn:
+            conn.executemany("UPDATE attempts SET doc = ? WHERE id = ? AND owner = ?",
+                             [(doc, attempt_id, owner) for attempt_id, doc in docs])
+
+    def remove(self, ids: List[str]):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM attempts WHERE id = ?", [(attempt_id,) for attempt_id in ids])
+
+    def contains(self, attempt_id: str) -> bool:
+        return self._connection().execute("SELECT 1 FROM attempts WHERE id = ?", (attempt_id,)).fetchone() is not None
+
+    def depth(self) -> Tuple[int, Optional[float]]:
+        """Pending attempts and when the oldest was appended."""
+        count, oldest = self._connection().execute("SELECT COUNT(*), MIN(appended) FROM attempts").fetchone()
+        return count, oldest
+
+
+# ---------------------------------------------------------------------------
+# Per-process state
+# ---------------------------------------------------------------------------
+
+_log: Optional[AttemptLog] = None
+_log_pid: Optional[int] = None
+_log_lock = threading.Lock()
+
+# Quiz id -> course id of quizzes known to exist, valid for one shared version
+_quiz_ids: Dict[ObjectId, Any] = {}
+_quiz_ids_version = -1
+
+_wake: Optional[asyncio.Event] = None
+_appended_since_flush = 0
+
+_stats = {"appended": 0, "flushed": 0, "flushes": 0, "failures": 0, "last_flush_at": None,
+          "last_flush_lag_seconds": None, "max_flush_lag_seconds": 0.0, "last_error": None}
+
+
+def get_log() -> AttemptLog:
+    """This process's log, opened on first use (and again after a fork)."""
+    global _log, _log_pid
+    if _log is None or _log_pid != os.getpid():
+        with _log_lock:
+            if _log is None or _log_pid != os.getpid():
+                _log = AttemptLog()
+                _log_pid = os.getpid()
+    return _log
+
+
+def _reset_after_fork():
+    global _log, _log_pid, _log_lock, _wake, _appended_since_flush
+    _log, _log_pid, _log_lock = None, None, threading.Lock()
+    _wake, _appended_since_flush = None, 0
+    _quiz_ids.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ---------------------------------------------------------------------------
+# Known quizzes
+# ---------------------------------------------------------------------------
+
+async def known_quiz(db, quiz_id: ObjectId) -> Tuple[bool, Any]:
+    """``(exists, course_id)`` of a quiz, from this process's cache when it has it."""
+    global _quiz_ids_version
+    version = await asyncio.to_thread(shared_state.current_version, _QUIZ_IDS_VERSION_KEY)
+    if version != _quiz_ids_version:
+        _quiz_ids.clear()  # quizzes were deleted somewhere; forget them all
+        _quiz_ids_version = version
+    if quiz_id in _quiz_ids:
+        return True, _quiz_ids[quiz_id]
+
+    quiz = await db.quizzes.find_one({"_id": quiz_id}, {"course_id": 1})
+    if not quiz:
+        return False, None
+    _quiz_ids[quiz_id] = quiz.get("course_id")
+    return True, _quiz_ids[quiz_id]
+
+
+def forget_quizzes():
+    """Make every worker re-read quiz ids; call after deleting quizzes."""
+    shared_state.invalidate(_QUIZ_IDS_VERSION_KEY)
+
+
+# ---------------------------------------------------------------------------
+# Submitting
+# ---------------------------------------------------------------------------
+
+def _unscheduled(attempt: Attempt) -> bool:
+    # Attempts appended before scheduling moved to the flusher were scheduled when submitted
+    return bool(attempt.responses) and all(r.next_due_date is None for r in attempt.responses)
+
+
+async def _schedule(db, attempts: List[Attempt]):
+    """
+    Schedule the cards of new attempts (rated, not yet scheduled) in the given
+    order. Card memory carries over from the user's previous attempt at the quiz:
+    an earlier one of these or else the latest stored, read for all in one query.
+    Due dates go to the user's least loaded days, counting those already placed.
+    """
+    pairs = {(attempt.quiz_id, attempt.user_id) for attempt in attempts}
+    previous: Dict[Tuple[Any, str], List[CardResponse]] = {}
+    async for doc in db.attempts.aggregate([
+        {"$match": {"$or": [{"quiz_id": quiz_id, "user_id": user_id} for quiz_id, user_id in pairs],
+                    "_id": {"$nin": [attempt.id for attempt in attempts]}}},
+        {"$sort": {"taken_at": -1}},
+        {"$group": {"_id": {"quiz_id": "$quiz_id", "user_id": "$user_id"}, "responses": {"$first": "$responses"}}},
+    ]):
+        previous[(doc["_id"]["quiz_id"], doc["_id"]["user_id"])] = [
+            CardResponse.from_bson(r) for r in doc["responses"]
+        ]
+    loads = await review_digest.due_loads(db, (attempt.user_id for attempt in attempts))
+
+    for attempt in attempts:
+        key = (attempt.quiz_id, attempt.user_id)
+        states = {r.question_number: r.state() for r in previous.get(key, [])}
+        load = loads.get(attempt.user_id)
+        scheduled = schedule_reviews(
+            [states.get(r.question_number) for r in attempt.responses],
+            [r.user_rating for r in attempt.responses],
+            today=(attempt.taken_at or datetime.utcnow()).date(),
+            load=load,
+        )
+        for response, card in zip(attempt.responses, scheduled):
+            for name, value in card.items():
+                setattr(response, name, value)
+            if load is not None and card["interval"] < load.shape[0]:
+                load[card["interval"]] += 1
+        previous[key] = attempt.responses
+
+
+async def save(db, attempt: Attempt) -> ObjectId:
+    """
+    Store a rated attempt and return its id: appended to the log (write-behind;
+    scheduled when flushed) or scheduled, inserted and merged into the owner's
+    digest at once.
+    """
+    global _appended_since_flush
+    if attempt.id is None:
+        attempt.id = ObjectId()
+
+    if not ATTEMPT_WRITE_BEHIND:
+        if _unscheduled(attempt):
+            await _schedule(db, [attempt])
+        await db.attempts.insert_one(attempt.to_bson())
+        await _refresh_digest(db, attempt)
+        return attempt.id
+
+    doc = bson.encode(attempt.to_bson())
+    await asyncio.to_thread(get_log().append, str(attempt.id), str(attempt.quiz_id), attempt.user_id, doc)
+    _stats["appended"] += 1
+    _appended_since_flush += 1
+    if _wake is not None and _appended_since_flush >= ATTEMPT_FLUSH_BATCH:
+        _wake.set()
+    return attempt.id
+
+
+async def is_pending(attempt_id: ObjectId) -> bool:
+    """Whether an attempt is still only in the log."""
+    return ATTEMPT_WRITE_BEHIND and await asyncio.to_thread(get_log().contains, str(attempt_id))
+
+
+async def _refresh_digest(db, attempt: Attempt):
+    try:
+        await review_digest.refresh_for_attempt(db, attempt)
+    except Exception as e:
+        print(f"Failed to refresh review digest for user {attempt.user_id}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Flushing
+# ---------------------------------------------------------------------------
+
+def _only_duplicates(error: Exception) -> bool:
+    """Whether an insert_many error is only attempts stored by an earlier, interrupted flush."""
+    details = getattr(error, "details", None) or {}
+    write_errors = details.get("writeErrors") or []
+    return bool(write_errors) and all(e.get("code") == _DUPLICATE_KEY for e in write_errors) \
+        and not details.get("writeConcernErrors")
+
+
+async def flush(db) -> int:
+    """Move one batch from the log to `attempts`; returns how many attempts it stored."""
+    global _appended_since_flush
+    log = get_log()
+    owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    rows = await asyncio.to_thread(log.claim, owner, ATTEMPT_FLUSH_BATCH)
+    if not rows:
+        return 0
+    _appended_since_flush = 0
+    ids = [row.id for row in rows]
+    attempts = [Attempt.from_bson(bson.decode(row.doc)) for row in rows]
+    try:
+        unscheduled = [attempt for attempt in attempts if _unscheduled(attempt)]
+        if unscheduled:
+            await _schedule(db, unscheduled)
+            # Kept scheduled in the log, so a flush retried after a crash stores the same due dates
+            await asyncio.to_thread(log.update, [(str(a.id), bson.encode(a.to_bson())) for a in unscheduled], owner)
+        try:
+            await db.attempts.insert_many([attempt.to_bson() for attempt in attempts], ordered=False)
+        except Exception as e:
+            if not _only_duplicates(e):
+                raise
+    except Exception:
+        await asyncio.to_thread(log.release, ids, owner)
+        raise
+    await asyncio.to_thread(log.remove, ids)
+
+    now = time.time()
+    lag = now - min(row.appended for row in rows)
+    _stats["flushed"] += len(rows)
+    _stats["flushes"] += 1
+    _stats["last_flush_at"] = datetime.utcnow()
+    _stats["last_flush_lag_seconds"] = round(lag, 3)
+    _stats["max_flush_lag_seconds"] = round(max(_stats["max_flush_lag_seconds"], lag), 3)
+
+    # Digests after the attempts are stored: a digest rebuilt meanwhile reads them from `attempts`
+    by_user: Dict[str, List[Attempt]] = {}
+    for attempt in attempts:
+        by_user.setdefault(attempt.user_id, []).append(attempt)
+    semaphore = asyncio.Semaphore(_DIGEST_CONCURRENCY)
+
+    async def refresh(user_id: str, user_attempts: List[Attempt]):
+        async with semaphore:
+            try:
+                await review_digest.refresh_for_attempts(db, user_id, user_attempts)
+            except Exception as e:
+                print(f"Failed to refresh review digest for user {user_id}: {e}")
+
+    await asyncio.gather(*(refresh(user_id, user_attempts) for user_id, user_attempts in by_user.items()))
+    return len(rows)
+
+
+async def wait_until_stored(db, attempt_id: ObjectId, timeout: float = 10.0) -> bool:
+    """
+    Wait for a pending attempt to reach `attempts`, flushing it here unless
+    another worker already claimed it. Returns whether it got there within ``timeout``.
+    """
+    log = get_log()
+    deadline = time.monotonic() + timeout
+    while await asyncio.to_thread(log.contains, str(attempt_id)):
+        if time.monotonic() >= deadline:
+            return False
+        if not await flush(db):
+            await asyncio.sleep(0.05)  # claimed by another worker's flush; it removes the row once stored
+    return True
+
+
+async def drain(db, timeout: float = 10.0) -> int:
+    """Flush until the log is empty (e.g. at shutdown) or ``timeout`` passes."""
+    flushed = 0
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        count = await flush(db)
+        if not count:
+            break
+        flushed += count
+    return flushed
+
+
+async def run_flusher(get_db):
+    """
+    Background loop: flush a batch every ATTEMPT_FLUSH_SECONDS, or as soon as
+    ATTEMPT_FLUSH_BATCH attempts were appended.
+
+    Args:
+        get_db: Callable returning the current database handle
+    """
+    global _wake
+    _wake = asyncio.Event()
+    backoff = ATTEMPT_FLUSH_SECONDS
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=backoff)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            while await flush(get_db()) >= ATTEMPT_FLUSH_BATCH:
+                pass  # a full batch; there may be more
+            backoff = ATTEMPT_FLUSH_SECONDS
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["failures"] += 1
+            _stats["last_error"] = str(e) or type(e).__name__
+            backoff = min(backoff * 2, 30.0)
+            print(f"Flushing attempts failed, retrying in {backoff:.1f}s: {_stats['last_error']}")
+
+
+async def metrics() -> Dict[str, Any]:
+    """Depth of the log, age of its oldest attempt and this process's flush counters."""
+    if not ATTEMPT_WRITE_BEHIND:
+        return {"write_behind": False}
+    depth, oldest = await asyncio.to_thread(get_log().depth)
+    return {
+        "write_behind": True,
+        "depth": depth,
+        "oldest_pending_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+        "flush_batch": ATTEMPT_FLUSH_BATCH,
+        "flush_seconds": ATTEMPT_FLUSH_SECONDS,
+        **_stats,
+    }
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Import Time Benchmark - Cold-start cost of `import main`.
+
+This benchmark:
+1. Imports main.py in fresh interpreters with `python -X importtime`
+2. Reports the median / min / max cumulative import time over several runs
+3. Attributes import time to top-level packages (self time summed per package)
+4. Saves results as a JSON baseline and compares against an earlier baseline
+
+No network or database is touched: the Gemini client and Mongo connection are
+only created on first use / at startup, not at import time.
+
+Usage:
+  python benchmarks/bench_import_time.py --runs 7 --save benchmarks/baselines/import_time.json
+  python benchmarks/bench_import_time.py --compare benchmarks/baselines/import_time.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def import_once(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Import ``module`` in a fresh interpreter.
+
+    Returns:
+        (total_ms, {top-level package: self ms summed over all its modules})
+    """
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "benchmark")
+    env.setdefault("MONGO_URI", "mongodb://benchmark.invalid")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    packages: Dict[str, float] = defaultdict(float)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        name = name.strip()
+        # Self time is not double counted across nesting, so it can be summed per package
+        packages[name.split(".")[0]] += int(self_us) / 1000
+        if name == module:
+            total_us = int(cumulative)
+    return total_us / 1000, dict(packages)
+
+
+def benchmark(module: str, runs: int) -> Dict[str, Any]:
+    samples = [import_once(module) for _ in range(runs)]
+    totals = [total for total, _ in samples]
+    median_run = sorted(samples, key=lambda s: s[0])[len(samples) // 2]
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "module": module,
+            "runs": runs,
+        },
+        "results": {
+            "median_ms": round(statistics.median(totals), 1),
+            "min_ms": round(min(totals), 1),
+            "max_ms": round(max(totals), 1),
+            "top_packages_ms": {
+                name: round(ms, 1)
+                for name, ms in sorted(median_run[1].items(), key=lambda kv: -kv[1])[:15]
+            },
+        },
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return regression messages if the median cold start got slower than the baseline allows."""
+    now, base = current["results"]["median_ms"], baseline.get("results", {}).get("median_ms")
+    if base and now > base * (1 + tolerance):
+        return [f"median import time {now}ms vs baseline {base}ms"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--save", help="Write results to this JSON baseline file")
+    parser.add_argument("--compare", help="Compare against this JSON baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    report = benchmark(args.module, args.runs)
+    r = report["results"]
+    print(f"import {args.module}: median {r['median_ms']}ms (min {r['min_ms']}ms, max {r['max_ms']}ms, "
+          f"{args.runs} runs)\n")
+    print(f"{'package':<28}{'self ms':>14}")
+    for name, ms in r["top_packages_ms"].items():
+        print(f"{name:<28}{ms:>14}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for message in regressions:
+                print(f"  - {message}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Ingestion Benchmark - Native PDF (cached context) against local text extraction.
+
+This benchmark:
+1. Starts the local fake Gemini server (benchmarks/fake_gemini.py) and an
+   in-memory MongoDB (benchmarks/fake_mongo.py)
+2. Creates a course from each syllabus through the API (`POST /courses/`) and
+   generates the pre-quizzes of all its topics (`POST /courses/{id}/quizzes/pre`),
+   once per ingestion mode (SYLLABUS_INGESTION, see syllabus_context.py):
+   - extract: pdfplumber text (and schedule table) in the roadmap prompt
+   - native: the PDF cached once, referenced by the roadmap and every quiz call
+3. Reports median milliseconds of both requests, Gemini calls, uncached and
+   cached prompt tokens, output tokens and bytes sent to Gemini per mode
+
+Cached tokens are billed at a fraction of the input rate (CACHED_TOKEN_RATE);
+"input equiv" is uncached + cached at that rate. The fake server refuses to
+cache documents below --cache-min-tokens (Gemini has such a minimum too); the
+native mode then sends the PDF inline with the roadmap call only.
+
+Usage:
+  python benchmarks/bench_ingestion.py --files hist17.pdf --latency-ms 300 --tokens-per-second 200
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+# Price of a cached input token relative to an uncached one
+CACHED_TOKEN_RATE = 0.25
+
+
+async def run_once(app, path: str):
+    """Create a course from ``path`` on a fresh database, then generate all its pre-quizzes."""
+    import httpx
+    from fake_mongo import create_fake_database
+
+    app.mongo_client, app.db, app.fs = create_fake_database()
+    with open(path, "rb") as f:
+        data = f.read()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://bench", timeout=600) as client:
+        started = time.perf_counter()
+        response = await client.post("/courses/", params={"name": "bench"},
+                                     files={"syllabus": (os.path.basename(path), data, "application/pdf")})
+        created = time.perf_counter()
+        response.raise_for_status()
+        course = response.json()
+        response = await client.post(f"/courses/{course['_id']}/quizzes/pre")
+        response.raise_for_status()
+        finished = time.perf_counter()
+    quizzes = response.json()["quizzes"]
+    errors = [quiz["error"] for quiz in quizzes if "error" in quiz]
+    if errors:
+        raise RuntimeError(errors[0])
+    return (created - started) * 1000, (finished - created) * 1000, len(course["roadmap"])
+
+
+def measure(app, path, repeat, gemini):
+    """Median ms of course creation and pre-quizzes, and the Gemini usage of one run."""
+    create_times, quiz_times = [], []
+    for _ in range(repeat):
+        before = dict(gemini.stats)
+        with contextlib.redirect_stdout(io.StringIO()):  # the routes log whole Gemini responses
+            create_ms, quiz_ms, topics = asyncio.run(run_once(app, path))
+        create_times.append(create_ms)
+        quiz_times.append(quiz_ms)
+        used = {key: gemini.stats[key] - before[key] for key in before}
+    return statistics.median(create_times), statistics.median(quiz_times), topics, used
+
+
+def _resolve(name: str) -> str:
+    """A syllabus path as given, else from the repo root, else from uploads/ (where final.pdf lives)."""
+    if os.path.isabs(name):
+        return name
+    for directory in (ROOT, os.path.join(ROOT, "uploads")):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(ROOT, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", nargs="+", default=["hist17.pdf", "final.pdf"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--cache-min-tokens", type=int, default=0)
+    args = parser.parse_args()
+
+    from fake_gemini import start_fake_gemini
+
+    server, base_url, gemini = start_fake_gemini(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second,
+                                                 cache_min_tokens=args.cache_min_tokens)
+    os.environ["GEMINI_BASE_URL"] = base_url
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("MONGO_URI", "mongodb://benchmark.invalid")
+    os.environ.setdefault("SEMANTIC_INDEX_DIR", tempfile.mkdtemp(prefix="deepify-bench-index-"))
+    os.environ.setdefault("SHARED_STATE_PATH", os.path.join(tempfile.mkdtemp(prefix="deepify-bench-state-"), "state.sqlite3"))
+
+    import main as app
+    import syllabus_context
+
+    print(f"{'syllabus':<14}{'mode':<9}{'topics':>7}{'create ms':>11}{'quizzes ms':>12}{'calls':>7}"
+          f"{'prompt tok':>12}{'cached tok':>12}{'input equiv':>13}{'output tok':>12}{'sent KB':>9}")
+    try:
+        for name in args.files:
+            path = _resolve(name)
+            if not os.path.exists(path):
+                print(f"{name:<14}skipped: file not found")
+                continue
+
+            rows = []
+            for mode in (syllabus_context.EXTRACT, syllabus_context.NATIVE):
+                syllabus_context.SYLLABUS_INGESTION = mode
+                create_ms, quiz_ms, topics, used = measure(app, path, args.repeat, gemini)
+                if mode == syllabus_context.EXTRACT:
+                    # Gemini's own roadmap gets as many topics as the extracted one
+                    gemini.roadmap_topics = topics
+                uncached = used["prompt_tokens"] - used["cached_tokens"]
+                equivalent = uncached + used["cached_tokens"] * CACHED_TOKEN_RATE
+                rows.append((create_ms + quiz_ms, equivalent))
+                print(f"{name:<14}{mode:<9}{topics:>7}{create_ms:>11.1f}{quiz_ms:>12.1f}{used['requests'] + used['caches']:>7}"
+                      f"{uncached:>12}{used['cached_tokens']:>12}{equivalent:>13.0f}{used['output_tokens']:>12}"
+                      f"{used['request_bytes'] / 1024:>9.0f}")
+            (extract_ms, extract_tokens), (native_ms, native_tokens) = rows
+            print(f"{'':<14}{'native/extract: time':<29}{native_ms / extract_ms:>6.2f}x, input equiv "
+                  f"{native_tokens / max(extract_tokens, 1):.2f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Model Memory Benchmark - Retained memory of 100k review cards as dicts vs slotted models.
+
+This benchmark:
+1. Encodes a synthetic dataset of attempts (10 cards each) to BSON, as stored in MongoDB
+2. Decodes it into plain dicts, and into models.Attempt / CardResponse, one document at a time
+3. Measures retained memory (tracemalloc) and decode time for each
+4. Computes the due-today review items from each representation and times that too
+
+Usage:
+  python benchmarks/bench_model_memory.py --cards 100000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import bson
+from bson import ObjectId
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from models import Attempt, ReviewItem  # noqa: E402
+
+CARDS_PER_ATTEMPT = 10
+
+
+def make_dataset(cards: int):
+    """BSON-encoded attempt documents, as they would come off the wire."""
+    today = date.today()
+    raw = []
+    for a in range(cards // CARDS_PER_ATTEMPT):
+        raw.append(bson.encode({
+            "_id": ObjectId(),
+            "quiz_id": ObjectId(),
+            "course_id": ObjectId(),
+            "user_id": f"user-{a % 500}",
+            "topic_number": a % 12 + 1,
+            "responses": [{
+                "question_number": q + 1,
+                "question": f"What does concept {a}.{q} describe?",
+                "answer": f"It describes behaviour number {q}.",
+                "user_rating": ["dont_know", "hard", "medium", "easy"][(a + q) % 4],
+                "next_due_date": str(today + timedelta(days=(a + q) % 9 - 4)),
+                "ease": 2.5, "interval": (a + q) % 9, "stability": 1.5, "repetitions": 1, "lapses": 0,
+                "last_reviewed": str(today - timedelta(days=1)),
+            } for q in range(CARDS_PER_ATTEMPT)],
+            "taken_at": None,
+        }))
+    return raw
+
+
+def due_from_dicts(attempts, today):
+    return [{
+        "card_id": f"{a['_id']}:{r['question_number']}", "attempt_id": str(a["_id"]), "quiz_id": str(a["quiz_id"]),
+        "course_id": str(a["course_id"]), "topic_number": a["topic_number"], "question_number": r["question_number"],
+        "question": r["question"], "answer": r["answer"], "due_date": r["next_due_date"],
+    } for a in attempts for r in a["responses"] if r.get("next_due_date") and r["next_due_date"] <= today]
+
+
+def due_from_models(attempts, today):
+    return [ReviewItem(
+        f"{a.id}:{r.question_number}", str(a.id), str(a.quiz_id), str(a.course_id), a.topic_number,
+        r.question_number, r.question, r.answer, r.next_due_date,
+    ) for a in attempts for r in a.responses if r.is_due(today)]
+
+
+def measure(label, build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<34}{current / 2**20:>12.1f}{peak / 2**20:>12.1f}{elapsed * 1000:>12.0f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=100_000)
+    args = parser.parse_args()
+
+    raw = make_dataset(args.cards)
+    today = str(date.today())
+    print(f"{args.cards} cards in {len(raw)} attempts ({sum(map(len, raw)) / 2**20:.1f} MB of BSON)\n")
+    print(f"{'representation':<34}{'retained MB':>12}{'peak MB':>12}{'ms':>12}")
+
+    dicts = measure("attempts as dicts", lambda: [bson.decode(doc) for doc in raw])
+    due_dicts = measure("  due items as dicts", lambda: due_from_dicts(dicts, today))
+    del dicts
+
+    models = measure("attempts as slotted models", lambda: [Attempt.from_bson(bson.decode(doc)) for doc in raw])
+    due_models = measure("  due items as slotted models", lambda: due_from_models(models, today))
+
+    assert len(due_dicts) == len(due_models)
+    print(f"\n{len(due_models)} cards due today")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Review Load Simulation - Projects daily review volume for a deck of cards.
+
+This benchmark:
+1. Introduces a deck of cards (10k by default) at a fixed number of new cards per day
+2. Simulates a year of daily reviews, sampling recall from R(t) = 0.9 ** (t / stability)
+3. Schedules each day's reviews with one vectorized batch_reschedule call per scheduler
+4. Reports mean / p95 / peak daily reviews for the old fixed schedule and the SM-2 engine
+
+Usage:
+  python benchmarks/bench_review_load.py --cards 10000 --days 365 --json review_load.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from spaced_repetition import batch_reschedule, retrievability, RATING_CODES  # noqa: E402
+
+# The fixed schedule main.py used before the engine (rating code -> days)
+FIXED_DAYS = np.array([1, 1, 3, 7])
+
+# How a successful recall is self-rated: hard / medium / easy
+SUCCESS_RATINGS = np.array([RATING_CODES["hard"], RATING_CODES["medium"], RATING_CODES["easy"]])
+SUCCESS_WEIGHTS = np.array([0.2, 0.5, 0.3])
+
+
+def simulate(scheduler: str, cards: int, days: int, new_per_day: int, seed: int) -> dict:
+    """Run one simulation and return the daily review counts plus summary stats."""
+    rng = np.random.default_rng(seed)
+
+    introduced = np.arange(cards) // new_per_day  # day each card is first studied
+    due = introduced.copy()
+    last = np.zeros(cards, dtype=np.int64)
+    ease = np.full(cards, 2.5)
+    interval = np.zeros(cards)
+    stability = np.ones(cards)
+    repetitions = np.zeros(cards, dtype=np.int64)
+    lapses = np.zeros(cards, dtype=np.int64)
+
+    daily = np.zeros(days, dtype=np.int64)
+    schedule_seconds = 0.0
+
+    for day in range(days):
+        idx = np.flatnonzero(due == day)
+        daily[day] = idx.size
+        if idx.size == 0:
+            continue
+
+        is_new = repetitions[idx] + lapses[idx] == 0
+        recall = retrievability(day - last[idx], stability[idx])
+        recalled = (rng.random(idx.size) < recall) & ~is_new
+        ratings = np.where(
+            recalled | is_new,
+            rng.choice(SUCCESS_RATINGS, size=idx.size, p=SUCCESS_WEIGHTS),
+            RATING_CODES["dont_know"],
+        )
+
+        started = time.perf_counter()
+        if scheduler == "fixed":
+            days_until = FIXED_DAYS[ratings]
+            stability[idx] = days_until
+        else:
+            load = None
+            if scheduler == "engine+balance":
+                upcoming = due[due > day] - day
+                load = np.bincount(upcoming, minlength=2).astype(np.float64)
+            result = batch_reschedule(
+                ease[idx], interval[idx], repetitions[idx], lapses[idx], ratings,
+                rng=rng, load=load, fuzz=scheduler != "engine-nofuzz",
+            )
+            ease[idx] = result["ease"]
+            stability[idx] = result["stability"]
+            repetitions[idx] = result["repetitions"]
+            lapses[idx] = result["lapses"]
+            days_until = result["interval"]
+            interval[idx] = days_until
+        schedule_seconds += time.perf_counter() - started
+
+        last[idx] = day
+        due[idx] = day + days_until
+
+    # Ignore the ramp-up while new cards are still being introduced
+    steady = daily[min(days - 1, int(introduced.max()) + 1):]
+    return {
+        "scheduler": scheduler,
+        "total_reviews": int(daily.sum()),
+        "mean_daily": round(float(daily.mean()), 1),
+        "p95_daily": int(np.percentile(daily, 95)),
+        "peak_daily": int(daily.max()),
+        "steady_state_mean": round(float(steady.mean()), 1) if steady.size else None,
+        "steady_state_peak_to_mean": round(float(steady.max() / max(steady.mean(), 1)), 2) if steady.size else None,
+        "schedule_ms": round(schedule_seconds * 1000, 1),
+        "daily": daily.tolist(),
+    }
+
+
+def time_batch(cards: int, seed: int) -> float:
+    """Milliseconds to reschedule a whole deck in one vectorized call."""
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    batch_reschedule(
+        np.full(cards, 2.5), rng.integers(1, 60, cards).astype(np.float64),
+        rng.integers(0, 8, cards), np.zeros(cards, dtype=np.int64), rng.integers(0, 4, cards), rng=rng,
+    )
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--new-per-day", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write full results (including daily counts) to this file")
+    args = parser.parse_args()
+
+    results = [
+        simulate(scheduler, args.cards, args.days, args.new_per_day, args.seed)
+        for scheduler in ("fixed", "engine-nofuzz", "engine", "engine+balance")
+    ]
+
+    print(f"{args.cards} cards, {args.new_per_day} new/day, {args.days} days")
+    print(f"{'scheduler':<16}{'total':>9}{'mean':>8}{'p95':>7}{'peak':>7}{'steady peak/mean':>19}{'sched ms':>10}")
+    for r in results:
+        print(f"{r['scheduler']:<16}{r['total_reviews']:>9}{r['mean_daily']:>8}{r['p95_daily']:>7}"
+              f"{r['peak_daily']:>7}{str(r['steady_state_peak_to_mean']):>19}{r['schedule_ms']:>10}")
+    print(f"batch_reschedule of {args.cards} cards in one call: {time_batch(args.cards, args.seed):.2f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as out:
+            json.dump({"args": vars(args), "results": results}, out, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
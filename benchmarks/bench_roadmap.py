@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Roadmap Benchmark - Schedule-table roadmaps against whole-syllabus Gemini roadmaps.
+
+This benchmark:
+1. Starts the local fake Gemini server (benchmarks/fake_gemini.py)
+2. Builds the roadmap of each syllabus the old way: the whole text to Gemini
+   (generate_roadmap in main.py without a schedule)
+3. Builds it again from the syllabus's schedule table (syllabus_tables.py):
+   table detection on the candidate pages, then one batched preQuizPrompt call
+4. Reports median milliseconds, Gemini calls and prompt / output tokens per path
+
+The fake server answers the whole-syllabus prompt with as many topics as the
+table has, so both paths produce the same amount of output.
+
+Usage:
+  python benchmarks/bench_roadmap.py --files hist17.pdf final.pdf --latency-ms 300 --tokens-per-second 200
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+
+def measure(fn, repeat, gemini):
+    """Median ms of ``fn()`` and the Gemini calls / tokens of one run."""
+    times = []
+    for _ in range(repeat):
+        before = dict(gemini.stats)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # generate_roadmap logs whole responses
+            result = fn()
+        times.append((time.perf_counter() - started) * 1000)
+        used = {key: gemini.stats[key] - before[key] for key in before}
+    return statistics.median(times), used, result
+
+
+def _resolve(name: str) -> str:
+    """A syllabus path as given, else from the repo root, else from uploads/ (where final.pdf lives)."""
+    if os.path.isabs(name):
+        return name
+    for directory in (ROOT, os.path.join(ROOT, "uploads")):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(ROOT, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", nargs="+", default=["hist17.pdf", "final.pdf"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    args = parser.parse_args()
+
+    from fake_gemini import start_fake_gemini
+
+    server, base_url, gemini = start_fake_gemini(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second)
+    os.environ["GEMINI_BASE_URL"] = base_url
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("MONGO_URI", "mongodb://benchmark.invalid")
+    os.environ.setdefault("SEMANTIC_INDEX_DIR", tempfile.mkdtemp(prefix="deepify-bench-index-"))
+    os.environ.setdefault("SHARED_STATE_PATH", os.path.join(tempfile.mkdtemp(prefix="deepify-bench-state-"), "state.sqlite3"))
+
+    import main as app
+    import syllabus_tables
+    from document_extraction import extract_pdf_pages, extract_text_from_file
+
+    print(f"{'syllabus':<14}{'path':<16}{'topics':>7}{'median ms':>11}{'calls':>7}{'prompt tok':>12}{'output tok':>12}")
+    try:
+        for name in args.files:
+            path = _resolve(name)
+            if not os.path.exists(path):
+                print(f"{name:<14}skipped: file not found")
+                continue
+            suffix = os.path.splitext(path)[-1].lower()
+            text = extract_text_from_file(path, suffix)
+            pages = None
+            if suffix == ".pdf":
+                _, page_texts, _, _ = extract_pdf_pages(path)
+                pages = syllabus_tables.candidate_pages(page_texts)
+
+            def from_table():
+                rows = syllabus_tables.find_schedule(path, suffix, text, pages) if pages != [] else None
+                return syllabus_tables.roadmap_from_schedule(rows, text) if rows else None
+
+            table_ms, table_used, roadmap = measure(from_table, args.repeat, gemini)
+            if roadmap is None:
+                print(f"{name:<14}{'schedule table':<16}{'-':>7}{table_ms:>11.1f}  no schedule table found")
+            gemini.roadmap_topics = len(roadmap) if roadmap else 8
+
+            whole_ms, whole_used, whole = measure(lambda: app.generate_roadmap(text), args.repeat, gemini)
+            rows = [("whole text", whole_ms, whole_used, whole)]
+            if roadmap is not None:
+                rows.append(("schedule table", table_ms, table_used, roadmap))
+            for label, ms, used, result in rows:
+                print(f"{name:<14}{label:<16}{len(result):>7}{ms:>11.1f}{used['requests']:>7}"
+                      f"{used['prompt_tokens']:>12}{used['output_tokens']:>12}")
+            if roadmap is not None:
+                print(f"{'':<14}{'speedup':<16}{'':>7}{whole_ms / table_ms:>10.1f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Serialization Benchmark - Encoding cost of large quiz and schedule payloads.
+
+This benchmark:
+1. Builds an all-quizzes payload for a large synthetic course and a large review schedule
+2. Encodes each the old way (str() every ObjectId, then jsonable_encoder + json.dumps)
+3. Encodes each with serialization.py (orjson and MessagePack, ObjectIds left in place)
+4. Reports median milliseconds per encode and payload size
+
+Usage:
+  python benchmarks/bench_serialization.py --topics 40 --cards 5000
+"""
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from serialization import dumps_json, dumps_msgpack  # noqa: E402
+
+
+def quizzes_payload(topics: int):
+    course_id = ObjectId()
+    now = datetime.utcnow()
+    pre = [{
+        "_id": ObjectId(), "course_id": course_id, "topic": f"Topic {t}", "topic_number": t,
+        "quiz": [{"index": i + 1, "question": f"What is concept {t}.{i} about? " * 3,
+                  "answer": f"Concept {t}.{i} explains something important. " * 4} for i in range(10)],
+        "created_at": now, "quiz_type": "pre_lecture",
+    } for t in range(1, topics + 1)]
+    notes = [{
+        "_id": ObjectId(), "course_id": course_id, "topic_number": t, "title": f"Notes {t}",
+        "questions": [{"id": i + 1, "question": f"Which statement about {t}.{i} is true?",
+                       "options": [f"Option {c} for {t}.{i}" for c in "ABCD"], "correctAnswer": f"Option B for {t}.{i}"}
+                      for i in range(10)],
+        "created_at": now, "quiz_type": "notes",
+    } for t in range(1, topics + 1)]
+    return {"course_id": str(course_id), "pre_lecture_quizzes": pre, "notes_quizzes": notes,
+            "total_quizzes": len(pre) + len(notes)}
+
+
+def schedule_payload(cards: int):
+    today = datetime.utcnow()
+    return {"due_questions": [{
+        "card_id": f"{ObjectId()}:{i % 10}", "attempt_id": ObjectId(), "quiz_id": ObjectId(), "course_id": ObjectId(),
+        "topic_number": i % 40 + 1, "question": f"Recall prompt number {i}", "answer": f"Answer number {i}",
+        "user_rating": "medium", "next_due_date": today - timedelta(days=i % 5), "interval": 3, "ease": 2.5,
+    } for i in range(cards)], "counts": {"by_course": {}, "by_topic": {}}, "total": cards, "day": str(today.date())}
+
+
+def old_way(payload):
+    # What the routes did before: copy ids to strings per document, then FastAPI's default encoder
+    payload = copy.deepcopy(payload)
+    for key in ("pre_lecture_quizzes", "notes_quizzes", "due_questions"):
+        for doc in payload.get(key, []):
+            for field in ("_id", "course_id", "attempt_id", "quiz_id"):
+                if field in doc:
+                    doc[field] = str(doc[field])
+    return json.dumps(jsonable_encoder(payload)).encode("utf-8")
+
+
+def measure(fn, payload, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = fn(payload)
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--cards", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=15)
+    args = parser.parse_args()
+
+    payloads = {"all-quizzes": quizzes_payload(args.topics), "schedule": schedule_payload(args.cards)}
+    encoders = {"jsonable_encoder+json": old_way, "orjson": dumps_json, "msgpack": dumps_msgpack}
+
+    print(f"{'payload':<14}{'encoder':<24}{'median ms':>10}{'bytes':>11}{'speedup':>9}")
+    for name, payload in payloads.items():
+        baseline = None
+        for label, fn in encoders.items():
+            ms, size = measure(fn, payload, args.repeat)
+            baseline = baseline or ms
+            print(f"{name:<14}{label:<24}{ms:>10.2f}{size:>11}{baseline / ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
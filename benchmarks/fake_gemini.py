@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+"""
+Fake Gemini - Local stand-in for the Gemini REST API used in benchmarks.
+
+This module provides functionality to:
+1. Serve `POST /v1beta/models/{model}:generateContent` and
+   `POST /v1beta/cachedContents` (context caching) on localhost
+2. Answer roadmap, batched preQuizPrompt, flashcard, multiple-choice and
+   answer-grading prompts with well-formed JSON
+3. Simulate latency as a fixed delay plus output tokens / token rate
+4. Optionally fail a fraction of calls with HTTP 429 to exercise error paths,
+   and make a fraction of multiple-choice questions flawed (duplicate options,
+   the answer in the question, a repeated question, a letter as the answer)
+5. Count tokens roughly as Gemini does: text / 4, 258 per PDF page, and the
+   tokens of a referenced cached context as cachedContentTokenCount
+
+Point the app at it with GEMINI_BASE_URL=http://127.0.0.1:<port>.
+
+Usage:
+  python benchmarks/fake_gemini.py --port 8765 --latency-ms 300 --tokens-per-second 200
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Tuple
+
+WORDS = (
+    "mitochondria enzyme treaty empire revolution photosynthesis gradient vector matrix theorem "
+    "osmosis parliament tariff reform cathedral dynasty migration equilibrium entropy catalyst "
+    "isotope polymer genome protein neuron synapse hormone glacier delta plateau monsoon "
+    "sonnet allegory renaissance feudalism inflation recession monopoly algorithm compiler "
+    "recursion integral derivative probability variance hypothesis experiment telescope orbit"
+).split()
+
+
+class FakeGeminiConfig:
+    """Tunable behaviour shared by all request handlers of one server."""
+
+    def __init__(self, latency_ms: float = 300.0, tokens_per_second: float = 200.0,
+                 error_rate: float = 0.0, roadmap_topics: int = 8, cache_min_tokens: int = 0,
+                 flaw_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.roadmap_topics = roadmap_topics
+        self.cache_min_tokens = cache_min_tokens  # smaller cached contexts are refused, as by Gemini
+        self.flaw_rate = flaw_rate  # share of flawed multiple-choice questions
+        self.caches: Dict[str, int] = {}  # cached context name -> tokens
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "prompt_tokens": 0, "output_tokens": 0,
+                      "cached_tokens": 0, "caches": 0, "request_bytes": 0}
+
+
+def _phrase(rng: random.Random, n: int = 3) -> str:
+    return " ".join(rng.sample(WORDS, n))
+
+
+def _roadmap(rng: random.Random, topics: int) -> List[Dict[str, Any]]:
+    start = date.today()
+    return [
+        {
+            "date": str(start + timedelta(days=7 * i)),
+            "topic": f"Week {i + 1}: {_phrase(rng).title()}",
+            "preQuizPrompt": f"This topic covers {_phrase(rng)}. Students learn how {_phrase(rng)} relate.",
+            "assignment": f"Problem set {i + 1}" if i % 2 else None,
+        }
+        for i in range(topics)
+    ]
+
+
+def _flashcards(rng: random.Random) -> List[Dict[str, Any]]:
+    return [
+        {"question": f"What is the role of {_phrase(rng, 4)}?", "answer": _phrase(rng, 5)}
+        for _ in range(10)
+    ]
+
+
+def _multiple_choice(rng: random.Random, count: int = 10, flaw_rate: float = 0.0) -> List[Dict[str, Any]]:
+    questions = []
+    for i in range(count):
+        options = [_phrase(rng, 2) for _ in range(4)]
+        question = {
+            "id": i + 1,
+            "question": f"Which statement best describes {_phrase(rng, 4)}?",
+            "options": options,
+            "correctAnswer": rng.choice(options),
+        }
+        if rng.random() < flaw_rate:
+            flaw = rng.randrange(4)
+            if flaw == 0:
+                options[options.index(question["correctAnswer"]) - 1] = question["correctAnswer"].upper()
+            elif flaw == 1:
+                question["question"] = f"Why is {question['correctAnswer']} the answer?"
+            elif flaw == 2 and questions:
+                question["question"] = questions[-1]["question"]
+            else:
+                question["options"] = [f"{letter}) {option}" for letter, option in zip("ABCD", options)]
+                question["correctAnswer"] = "ABCD"[options.index(question["correctAnswer"])]
+        questions.append(question)
+    return questions
+
+
+def answer_for(prompt: str, config: FakeGeminiConfig) -> str:
+    """Pick a plausible response body for a prompt."""
+    rng = random.Random()
+    if "Grade a student's answers to flashcards" in prompt:
+        items = re.findall(r"^\d+\. Question:", prompt, re.MULTILINE)
+        return json.dumps([rng.choice(["correct", "partial", "incorrect"]) for _ in items])
+    if "numbered topics of a course schedule" in prompt:
+        topics = re.findall(r"^\d+\. (.+)$", prompt, re.MULTILINE)
+        return json.dumps([
+            f"This topic covers {_phrase(rng)}. Students learn how {_phrase(rng)} relate." for _ in topics
+        ])
+    if "syllabus" in prompt.lower() and "preQuizPrompt" in prompt:
+        return json.dumps(_roadmap(rng, config.roadmap_topics))
+    if "flashcard-style questions" in prompt:
+        return json.dumps(_flashcards(rng))
+    if "multiple-choice" in prompt.lower():
+        count = re.search(r"Create exactly (\d+) new multiple-choice", prompt)
+        questions = _multiple_choice(rng, int(count.group(1)) if count else 10, config.flaw_rate)
+        return "```json\n" + json.dumps(questions, indent=2) + "\n```"
+    return f"TRANSCRIPTION:\n{_phrase(rng, 12)}\n\nSUMMARY:\n{_phrase(rng, 6)}"
+
+
+# Gemini counts each PDF page as an image of 258 tokens
+TOKENS_PER_PDF_PAGE = 258
+
+
+def _inline_tokens(inline: Dict[str, Any]) -> int:
+    data = inline.get("data", "")
+    if (inline.get("mimeType") or inline.get("mime_type")) == "application/pdf":
+        pages = len(re.findall(rb"/Type\s*/Page(?!s)", base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))))
+        return max(pages, 1) * TOKENS_PER_PDF_PAGE
+    return len(data) * 3 // 4 // 4
+
+
+def _prompt_text(body: Dict[str, Any]) -> Tuple[str, int]:
+    """Return the concatenated text parts and the tokens of any inline data."""
+    texts, inline_tokens = [], 0
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+            inline = part.get("inlineData") or part.get("inline_data")
+            if inline:
+                inline_tokens += _inline_tokens(inline)
+    return "\n".join(texts), inline_tokens
+
+
+def make_handler(config: FakeGeminiConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload: Dict[str, Any]):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _create_cache(self, body: Dict[str, Any]):
+            text, inline_tokens = _prompt_text(body)
+            instruction, _ = _prompt_text({"contents": [body.get("systemInstruction") or {}]})
+            tokens = (len(text) + len(instruction)) // 4 + inline_tokens
+            if tokens < config.cache_min_tokens:
+                self._send(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT", "message":
+                                           f"Cached content is too small. total_token_count={tokens}, "
+                                           f"min_total_token_count={config.cache_min_tokens}"}})
+                return
+            name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+            ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+            now = datetime.now(timezone.utc)
+            with config.lock:
+                config.caches[name] = tokens
+                config.stats["caches"] += 1
+            time.sleep(config.latency_ms / 1000)
+            self._send(200, {
+                "name": name,
+                "model": body.get("model"),
+                "displayName": body.get("displayName"),
+                "createTime": now.isoformat(),
+                "updateTime": now.isoformat(),
+                "expireTime": (now + timedelta(seconds=ttl)).isoformat(),
+                "usageMetadata": {"totalTokenCount": tokens},
+            })
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            with config.lock:
+                config.stats["request_bytes"] += length
+
+            if re.search(r"/cachedContents$", self.path.split("?")[0]):
+                self._create_cache(body)
+                return
+            if not re.search(r"/models/[^/]+:generateContent$", self.path.split("?")[0]):
+                self._send(404, {"error": {"code": 404, "message": f"Unknown path {self.path}", "status": "NOT_FOUND"}})
+                return
+
+            with config.lock:
+                config.stats["requests"] += 1
+                fail = random.random() < config.error_rate
+                if fail:
+                    config.stats["errors"] += 1
+            if fail:
+                time.sleep(config.latency_ms / 1000 / 4)
+                self._send(429, {"error": {"code": 429, "message": "Resource has been exhausted",
+                                           "status": "RESOURCE_EXHAUSTED"}})
+                return
+
+            cached_tokens = 0
+            if body.get("cachedContent"):
+                cached_tokens = config.caches.get(body["cachedContent"])
+                if cached_tokens is None:
+                    self._send(404, {"error": {"code": 404, "status": "NOT_FOUND",
+                                               "message": f"CachedContent not found: {body['cachedContent']}"}})
+                    return
+
+            prompt, inline_tokens = _prompt_text(body)
+            text = answer_for(prompt, config)
+            prompt_tokens = len(prompt) // 4 + inline_tokens + cached_tokens
+            output_tokens = max(1, len(text) // 4)
+            time.sleep(config.latency_ms / 1000 + output_tokens / max(config.tokens_per_second, 1e-6))
+
+            with config.lock:
+                config.stats["prompt_tokens"] += prompt_tokens
+                config.stats["output_tokens"] += output_tokens
+                config.stats["cached_tokens"] += cached_tokens
+
+            self._send(200, {
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "STOP",
+                    "index": 0,
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": output_tokens,
+                    "totalTokenCount": prompt_tokens + output_tokens,
+                    **({"cachedContentTokenCount": cached_tokens} if cached_tokens else {}),
+                },
+                "modelVersion": "fake-gemini",
+            })
+
+    return Handler
+
+
+def start_fake_gemini(port: int = 0, **config_kwargs) -> Tuple[ThreadingHTTPServer, str, FakeGeminiConfig]:
+    """Start the server on a background thread. Returns ``(server, base_url, config)``."""
+    config = FakeGeminiConfig(**config_kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--roadmap-topics", type=int, default=8)
+    parser.add_argument("--flaw-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, base_url, config = start_fake_gemini(
+        args.port, latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate, roadmap_topics=args.roadmap_topics, flaw_rate=args.flaw_rate,
+    )
+    print(f"Fake Gemini listening on {base_url} (export GEMINI_BASE_URL={base_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(config.stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Fake Mongo - In-memory stand-in for MongoDB Atlas used in benchmarks.
+
+This module provides functionality to:
+1. Create an async, Motor-compatible database backed by mongomock (via mongomock-motor)
+2. Provide an in-memory GridFS bucket with the subset of AsyncIOMotorGridFSBucket main.py uses
+3. Resolve dotted sub-collections such as `db.fs.files` the way Motor does
+4. Run bulk_write one operation at a time (mongomock's own bulk builder does
+   not accept the operations of current pymongo versions)
+5. Refuse change streams the way a standalone server does, so code that
+   falls back to polling without a replica set takes that path
+
+Requires `pip install mongomock-motor` (benchmark-only dependency).
+"""
+
+import io
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+try:
+    from mongomock_motor import AsyncMongoMockClient, AsyncMongoMockDatabase, AsyncMongoMockCollection
+except ImportError as exc:  # pragma: no cover - benchmark-only dependency
+    raise ImportError("The benchmark store needs mongomock-motor: pip install mongomock-motor") from exc
+
+from gridfs.errors import NoFile
+
+CHUNK_SIZE = 255 * 1024
+
+
+class FakeCollection(AsyncMongoMockCollection):
+    """Collection whose unknown attributes are dotted sub-collections, as in Motor."""
+
+    def __getattr__(self, name: str) -> Any:
+        underlying = self.__dict__["_AsyncMongoMockCollection__collection"]
+        if name.startswith("_") or name in dir(underlying):
+            return getattr(underlying, name)
+        return self.database.get_collection(f"{underlying.name}.{name}")
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs):
+        from pymongo import DeleteOne, InsertOne, UpdateOne
+
+        matched = modified = inserted = deleted = 0
+        for request in requests:
+            if isinstance(request, UpdateOne):
+                result = await self.update_one(request._filter, request._doc, upsert=request._upsert)
+                matched += result.matched_count
+                modified += result.modified_count
+            elif isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+                inserted += 1
+            elif isinstance(request, DeleteOne):
+                deleted += (await self.delete_one(request._filter)).deleted_count
+            else:
+                raise NotImplementedError(f"bulk_write of {type(request).__name__} is not supported here")
+        return SimpleNamespace(matched_count=matched, modified_count=modified, inserted_count=inserted,
+                               deleted_count=deleted, upserted_count=0)
+
+
+class FakeDatabase(AsyncMongoMockDatabase):
+    def get_collection(self, *args, **kwargs) -> FakeCollection:
+        return FakeCollection(self, self.delegate.get_collection(*args, **kwargs))
+
+    def watch(self, *args, **kwargs):
+        from pymongo.errors import OperationFailure
+
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+
+
+class FakeGridOut:
+    """Download stream: supports ``await read()`` and ``async for chunk in ...``."""
+
+    def __init__(self, file_doc: Dict[str, Any], data: bytes):
+        self._id = file_doc["_id"]
+        self.filename = file_doc.get("filename")
+        self.metadata = file_doc.get("metadata")
+        self.length = len(data)
+        self._buffer = io.BytesIO(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+    async def readchunk(self) -> bytes:
+        return self._buffer.read(CHUNK_SIZE)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        chunk = self._buffer.read(CHUNK_SIZE)
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        pass
+
+
+class FakeGridIn:
+    """Upload stream returned by :meth:`FakeGridFSBucket.open_upload_stream`."""
+
+    def __init__(self, bucket: "FakeGridFSBucket", filename: str, metadata: Optional[Dict[str, Any]]):
+        self._bucket = bucket
+        self._id = ObjectId()
+        self.filename = filename
+        self.metadata = metadata
+        self._buffer = io.BytesIO()
+        self.closed = False
+
+    async def write(self, data: bytes):
+        self._buffer.write(data)
+
+    async def set(self, name: str, value: Any):
+        setattr(self, name, value)
+
+    async def close(self):
+        if not self.closed:
+            await self._bucket._store(self._id, self.filename, self._buffer.getvalue(), self.metadata)
+            self.closed = True
+
+    async def abort(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()
+
+
+class FakeGridFSBucket:
+    """In-memory GridFS bucket; file documents live in ``<bucket>.files`` like the real one."""
+
+    def __init__(self, db, bucket_name: str = "fs"):
+        self._db = db
+        self._files = db.get_collection(f"{bucket_name}.files")
+        self._data: Dict[ObjectId, bytes] = {}
+
+    async def _store(self, file_id, filename: str, data: bytes, metadata: Optional[Dict[str, Any]]):
+        self._data[file_id] = data
+        await self._files.insert_one({
+            "_id": file_id,
+            "filename": filename,
+            "length": len(data),
+            "chunkSize": CHUNK_SIZE,
+            "uploadDate": datetime.utcnow(),
+            "metadata": metadata,
+        })
+
+    async def upload_from_stream(self, filename: str, source, metadata: Optional[Dict[str, Any]] = None,
+                                 chunk_size_bytes: Optional[int] = None) -> ObjectId:
+        data = source if isinstance(source, (bytes, bytearray)) else source.read()
+        file_id = ObjectId()
+        await self._store(file_id, filename, bytes(data), metadata)
+        return file_id
+
+    def open_upload_stream(self, filename: str, metadata: Optional[Dict[str, Any]] = None,
+                           chunk_size_bytes: Optional[int] = None) -> FakeGridIn:
+        return FakeGridIn(self, filename, metadata)
+
+    async def open_download_stream(self, file_id) -> FakeGridOut:
+        file_doc = await self._files.find_one({"_id": file_id})
+        if not file_doc or file_id not in self._data:
+            raise NoFile(f"no file in gridfs collection with _id {file_id!r}")
+        return FakeGridOut(file_doc, self._data[file_id])
+
+    async def delete(self, file_id):
+        result = await self._files.delete_one({"_id": file_id})
+        self._data.pop(file_id, None)
+        if not result.deleted_count:
+            raise NoFile(f"no file could be deleted because none matched {file_id!r}")
+
+
+def create_fake_database(name: str = "deep_learner") -> Tuple[AsyncMongoMockClient, FakeDatabase, FakeGridFSBucket]:
+    """Return ``(client, db, fs)`` ready to be assigned to main.mongo_client / main.db / main.fs."""
+    client = AsyncMongoMockClient()
+    db = FakeDatabase(client, client.get_database(name).delegate)
+    return client, db, FakeGridFSBucket(db)
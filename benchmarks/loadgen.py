@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Load Generator - Throughput and latency benchmark for the key main.py routes.
+
+This benchmark:
+1. Starts the local fake Gemini server (benchmarks/fake_gemini.py) on a free port
+2. Runs main.app in-process against the in-memory store (benchmarks/fake_mongo.py)
+3. Seeds a course, quizzes, notes and attempts, then drives each scenario with
+   a fixed number of requests at a fixed concurrency over httpx.ASGITransport
+4. Reports p50 / p95 / p99 latency and requests per second per scenario
+5. Saves results as a JSON baseline and compares against an earlier baseline
+
+Scenarios: course_create, pre_quiz, notes_upload, notes_quiz, schedule, images, attempts
+
+Usage:
+  python benchmarks/loadgen.py --requests 40 --concurrency 8 --save benchmarks/baselines/local.json
+  python benchmarks/loadgen.py --compare benchmarks/baselines/local.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Callable, Awaitable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+SCENARIOS = ["course_create", "pre_quiz", "notes_upload", "notes_quiz", "schedule", "images", "attempts"]
+
+# 1x1 transparent PNG
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+async def run_scenario(name: str, request: Callable[[int], Awaitable[Any]], requests: int,
+                       concurrency: int) -> Dict[str, Any]:
+    """Fire ``requests`` calls with at most ``concurrency`` in flight and summarize them."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await request(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+    }
+
+
+async def benchmark(args) -> Dict[str, Any]:
+    from fake_gemini import start_fake_gemini
+
+    server, base_url, gemini = start_fake_gemini(
+        latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second, roadmap_topics=args.roadmap_topics,
+    )
+    os.environ["GEMINI_BASE_URL"] = base_url
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("MONGO_URI", "mongodb://benchmark.invalid")
+    os.environ.setdefault("SEMANTIC_INDEX_DIR", tempfile.mkdtemp(prefix="deepify-bench-index-"))
+    os.environ.setdefault("SHARED_STATE_PATH", os.path.join(tempfile.mkdtemp(prefix="deepify-bench-state-"), "state.sqlite3"))
+    os.environ.setdefault("ATTEMPT_WAL_PATH", os.path.join(tempfile.mkdtemp(prefix="deepify-bench-wal-"), "attempts.sqlite3"))
+
+    import httpx
+    import attempt_buffer
+    import main
+    from fake_mongo import create_fake_database
+
+    main.mongo_client, main.db, main.fs = create_fake_database()
+
+    with open(os.path.join(ROOT, "hist17.pdf"), "rb") as f:
+        syllabus = f.read()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # -- seed ------------------------------------------------------------
+        response = await client.post("/courses/", params={"name": "Seed"},
+                                     files={"syllabus": ("hist17.pdf", syllabus, "application/pdf")})
+        response.raise_for_status()
+        course_id = response.json()["_id"]
+        (await client.post(f"/courses/{course_id}/quizzes/pre")).raise_for_status()
+        quizzes = (await client.get(f"/courses/{course_id}/quizzes")).json()["quizzes"]
+        response = await client.post(
+            f"/courses/{course_id}/notes",
+            data={"title": "Seed notes", "content": "Photosynthesis converts light into chemical energy.",
+                  "topic_number": "1"},
+            files={"image": ("seed.png", TINY_PNG, "image/png")},
+        )
+        response.raise_for_status()
+        image_id = response.json()["image_id"]
+        for n, quiz in enumerate(quizzes):
+            await client.post(f"/quizzes/{quiz['_id']}/attempt", json={
+                "user_id": "bench-user",
+                "topic_number": quiz["topic_number"],
+                "responses": [{"question": q["question"], "answer": q["answer"],
+                               "user_rating": ["easy", "medium", "hard", "dont_know"][(n + i) % 4]}
+                              for i, q in enumerate(quiz["quiz"])],
+            })
+        await attempt_buffer.drain(main.db)  # the app's flusher only runs with its startup event
+
+        # -- scenarios -------------------------------------------------------
+        requests = {
+            "course_create": lambda i: client.post(
+                "/courses/", params={"name": f"Bench {i}"},
+                files={"syllabus": ("hist17.pdf", syllabus, "application/pdf")}),
+            "pre_quiz": lambda i: client.post(f"/courses/{course_id}/quizzes/pre"),
+            "notes_upload": lambda i: client.post(
+                f"/courses/{course_id}/notes",
+                data={"title": f"Notes {i}", "topic_number": str(i % args.roadmap_topics + 1)},
+                files={"file": (f"notes{i}.txt", b"Cellular respiration releases energy. " * 200, "text/plain")}),
+            "notes_quiz": lambda i: client.post(f"/courses/{course_id}/topics/{i % args.roadmap_topics + 1}/notes-quiz"),
+            "schedule": lambda i: client.get("/users/bench-user/schedule"),
+            "images": lambda i: client.get(f"/images/{image_id}"),
+            "attempts": lambda i: client.post(f"/quizzes/{quizzes[i % len(quizzes)]['_id']}/attempt", json={
+                "user_id": f"bench-user-{i % 50}",
+                "topic_number": quizzes[i % len(quizzes)]["topic_number"],
+                "responses": [{"question": q["question"], "answer": q["answer"], "user_rating": "medium"}
+                              for q in quizzes[i % len(quizzes)]["quiz"]],
+            }),
+        }
+
+        selected = SCENARIOS if args.scenarios == "all" else args.scenarios.split(",")
+        results = {}
+        for name in selected:
+            # LLM-bound scenarios are much slower; scale them down so a run stays short
+            count = args.requests if name in ("schedule", "images", "notes_upload", "attempts") else args.llm_requests
+            print(f"Running {name}: {count} requests, concurrency {args.concurrency}...", file=sys.stderr)
+            results[name] = await run_scenario(name, requests[name], count, args.concurrency)
+
+    server.shutdown()
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_gemini": {"latency_ms": args.latency_ms, "tokens_per_second": args.tokens_per_second,
+                            "roadmap_topics": args.roadmap_topics, **gemini.stats},
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return regression messages for scenarios slower or lower-throughput than the baseline."""
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['rps']} req/s vs baseline {base['rps']} req/s")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors vs baseline {base['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="all", help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per non-LLM scenario")
+    parser.add_argument("--llm-requests", type=int, default=20, help="Requests per LLM-bound scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Fake Gemini base latency")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Fake Gemini output token rate")
+    parser.add_argument("--roadmap-topics", type=int, default=4)
+    parser.add_argument("--save", help="Write results to this JSON baseline file")
+    parser.add_argument("--compare", help="Compare against this JSON baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own log output")
+    args = parser.parse_args()
+
+    # The app logs with print(); keep it out of the report unless asked for
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stderr if args.verbose else devnull):
+        report = asyncio.run(benchmark(args))
+
+    print(f"\n{'scenario':<15}{'reqs':>6}{'err':>5}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in report["results"].items():
+        print(f"{name:<15}{r['requests']:>6}{r['errors']:>5}{r['rps']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2)
+        print(f"\nBaseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for message in regressions:
+                print(f"  - {message}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
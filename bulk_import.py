@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+"""
+Bulk Import - Create many courses from a batch of syllabi in one request.
+
+This module provides functionality to:
+1. Accept a multipart batch of PDF / DOCX syllabi, or zip archives of them,
+   each file checked by its magic bytes and size cap (uploads.py) and zip
+   archives capped in what they expand to (BULK_MAX_EXPANDED_MB)
+2. Stream every file into GridFS under a resumable job document (`import_jobs`)
+3. Extract text in parallel across a process pool, reusing the page store
+   (page_extraction.py) for syllabi seen before
+4. Generate roadmaps with bounded concurrency, from the syllabus's schedule
+   table where it has one (syllabus_tables.py), and write courses (and their
+   roadmap_topics) with insert_many
+5. Stream per-file progress back as newline-delimited JSON events
+
+Each item gets its course `_id` assigned when the job is created, so a resumed
+job that hits a duplicate key knows that course was already written.
+"""
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+import page_extraction
+import roadmap_topics
+import syllabus_tables
+import uploads
+
+SUPPORTED_SUFFIXES = {".pdf", ".docx"}
+
+# Worker processes used for text extraction
+EXTRACT_WORKERS = int(os.getenv("BULK_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Roadmap (Gemini) calls in flight at once for a single job
+ROADMAP_CONCURRENCY = int(os.getenv("BULK_ROADMAP_CONCURRENCY", "4"))
+
+# Courses buffered before an insert_many
+INSERT_BATCH_SIZE = int(os.getenv("BULK_INSERT_BATCH_SIZE", "20"))
+
+# What the zip archives of one import may expand to in total
+MAX_EXPANDED_BYTES = int(float(os.getenv("BULK_MAX_EXPANDED_MB", "2000")) * uploads.MB)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all import jobs, created on first use."""
+    global _process_pool
+    if _process_pool is None:
+        # spawn, not fork: the server process already runs event loop and driver threads
+        _process_pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def _reset_after_fork():
+    # A forked worker must not reuse its parent's pool and its management threads
+    global _process_pool
+    _process_pool = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def _extract_zip(path: str, budget: int) -> Tuple[List[Tuple[str, Optional[str], Optional[str]]], int]:
+    """
+    Copy the PDF / DOCX members of a zip archive to temporary files, chunk by chunk.
+
+    A member larger than its kind's upload cap becomes an error instead of a
+    file; the archive is refused (UploadRejected) once its members together
+    expand beyond ``budget`` bytes. Sizes are counted as members are read, not
+    taken from the archive's headers, which a zip bomb can fake.
+
+    Returns:
+        ``([(name, temporary path or None, error or None)], bytes used)``; the caller removes the files
+    """
+    members: List[Tuple[str, Optional[str], Optional[str]]] = []
+    used = 0
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                    continue
+                suffix = os.path.splitext(name)[-1].lower()
+                if suffix not in SUPPORTED_SUFFIXES:
+                    continue
+                limit = uploads.MAX_BYTES[suffix.lstrip(".")]
+                if info.file_size > limit:
+                    members.append((name, None, f"Larger than the {limit / uploads.MB:g} MB limit for {suffix} files"))
+                    continue
+                if used + info.file_size > budget:
+                    raise uploads.UploadRejected(_expanded_error(), status_code=413)
+
+                size = 0
+                with archive.open(info) as member, \
+                        tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                    members.append((name, tmp.name, None))
+                    while chunk := member.read(uploads.CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > limit or used + size > budget:
+                            break
+                        tmp.write(chunk)
+                if size > limit:
+                    os.remove(tmp.name)
+                    members[-1] = (name, None, f"Larger than the {limit / uploads.MB:g} MB limit for {suffix} files")
+                    continue
+                if used + size > budget:
+                    raise uploads.UploadRejected(_expanded_error(), status_code=413)
+                used += size
+    except BaseException:
+        for _, member_path, _ in members:
+            if member_path and os.path.exists(member_path):
+                os.remove(member_path)
+        raise
+    return members, used
+
+
+def _expanded_error() -> str:
+    return f"Zip archives expand to more than the {MAX_EXPANDED_BYTES / uploads.MB:g} MB allowed per import"
+
+
+def _item(index: int, filename: str) -> Dict[str, Any]:
+    return {
+        "index": index,
+        "filename": filename,
+        "name": os.path.splitext(os.path.basename(filename))[0],
+        "course_id": ObjectId(),
+        "status": "pending",
+        "error": None,
+    }
+
+
+async def create_job(db, fs, files: List[Any]) -> Dict[str, Any]:
+    """
+    Stream uploaded files (UploadFile) into GridFS one chunk at a time and create the job document.
+
+    Every file is identified by its magic bytes and held to its kind's size
+    cap (uploads.py). Zip archives are expanded member by member under the
+    same caps; their PDF / DOCX members become items. Rejected files become
+    failed items. Raises UploadRejected if the archives expand too far.
+    """
+    job_id = ObjectId()
+    items: List[Dict[str, Any]] = []
+    metadata = {"import_job_id": str(job_id)}
+    budget = MAX_EXPANDED_BYTES
+
+    async def store(upload, filename: str):
+        item = _item(len(items), filename)
+        items.append(item)
+        try:
+            stored = await uploads.stream_to_gridfs(fs, upload, uploads.SYLLABUS_KINDS,
+                                                    metadata={**metadata, "filename": filename})
+        except uploads.UploadRejected as err:
+            item.update(status="failed", error=str(err))
+            return
+        item.update(file_id=stored.file_id, suffix=uploads.SUFFIXES[stored.kind])
+
+    try:
+        for upload in files:
+            filename = upload.filename or f"file-{len(items) + 1}"
+            if os.path.splitext(filename)[-1].lower() != ".zip":
+                await store(upload, filename)
+                continue
+
+            try:
+                archive = await uploads.stream_to_tempfile(upload, uploads.ARCHIVE_KINDS)
+            except uploads.UploadRejected as err:
+                item = _item(len(items), filename)
+                item.update(status="failed", error=str(err))
+                items.append(item)
+                continue
+            try:
+                members, used = await asyncio.to_thread(_extract_zip, archive.path, budget)
+            finally:
+                os.remove(archive.path)
+            budget -= used
+            for name, path, error in members:
+                if path is None:
+                    item = _item(len(items), name)
+                    item.update(status="failed", error=error)
+                    items.append(item)
+                    continue
+                member = uploads.LocalFile(path, name)
+                try:
+                    await store(member, name)
+                finally:
+                    member.close()
+                    os.remove(path)
+    except BaseException:
+        # Nothing refers to the files stored so far
+        for item in items:
+            if item.get("file_id") is not None:
+                try:
+                    await fs.delete(item["file_id"])
+                except Exception as e:
+                    print(f"Error deleting GridFS file {item['file_id']}: {e}")
+        raise
+
+    job = {
+        "_id": job_id,
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        "items": items,
+    }
+    await db.import_jobs.insert_one(job)
+    return job
+
+
+async def _set_item(db, job_id, index: int, **fields):
+    update = {f"items.{index}.{key}": value for key, value in fields.items()}
+    update["updated_at"] = datetime.utcnow()
+    await db.import_jobs.update_one({"_id": job_id}, {"$set": update})
+
+
+async def _read_file(fs, file_id) -> bytes:
+    grid_out = await fs.open_download_stream(file_id)
+    return await grid_out.read()
+
+
+def _event(kind: str, item: Optional[Dict[str, Any]] = None, **extra) -> Dict[str, Any]:
+    event = {"event": kind}
+    if item is not None:
+        event.update({"index": item["index"], "filename": item["filename"]})
+    event.update(extra)
+    return event
+
+
+async def run_job(
+    db,
+    fs,
+    job_id,
+    generate_roadmap: Callable[[str, Optional[List[Dict[str, Any]]]], Any],
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Process every unfinished item of a job, yielding progress events.
+
+    Args:
+        db: Motor database
+        fs: Motor GridFS bucket holding the uploaded files
+        job_id: The import job to run (or resume)
+        generate_roadmap: Blocking function turning syllabus text (and its
+            schedule table rows, if found) into a roadmap
+
+    Yields:
+        Dicts with an ``event`` of extracted / roadmap / stored / failed / done
+    """
+    job = await db.import_jobs.find_one({"_id": job_id})
+    if not job:
+        raise ValueError(f"Import job {job_id} not found")
+
+    await db.import_jobs.update_one({"_id": job_id}, {"$set": {"status": "running", "updated_at": datetime.utcnow()}})
+    # Failed items are retried on resume; unsupported files have nothing to retry
+    todo = [item for item in job["items"] if item["status"] != "done" and item.get("file_id")]
+    yield _event("started", job_id=str(job_id), total=len(job["items"]), remaining=len(todo))
+
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    semaphore = asyncio.Semaphore(ROADMAP_CONCURRENCY)
+    events: asyncio.Queue = asyncio.Queue()
+    ready: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+
+    async def process(item):
+        try:
+            data = await _read_file(fs, item["file_id"])
+            suffix = item.get("suffix") or os.path.splitext(item["filename"])[-1].lower()
+            doc_hash = hashlib.sha256(data).hexdigest()
+            text = await page_extraction.cached_text(db, doc_hash)
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                tmp.write(data)
+            try:
+                if text is None:
+                    text = await page_extraction.extract_document_text(
+                        db, tmp.name, suffix.lstrip("."), doc_hash, executor=pool,
+                        tables_on=syllabus_tables.is_schedule_page,
+                    )
+                schedule = await syllabus_tables.detect(
+                    db, tmp.name, suffix.lstrip("."), doc_hash, text, executor=pool
+                )
+            finally:
+                os.remove(tmp.name)
+            await events.put(_event("extracted", item, characters=len(text), schedule=bool(schedule)))
+
+            async with semaphore:
+                roadmap = await asyncio.to_thread(generate_roadmap, text, schedule)
+            await events.put(_event("roadmap", item, topics=len(roadmap)))
+
+            now = datetime.utcnow()
+            ready.append((item, {
+                "_id": item["course_id"],
+                "name": item["name"],
+                "created_at": now,
+                "updated_at": now,
+                "topic_count": len(roadmap),
+                "import_job_id": job_id,
+            }, roadmap))
+        except Exception as e:
+            await _set_item(db, job_id, item["index"], status="failed", error=str(e))
+            await events.put(_event("failed", item, error=str(e)))
+
+    async def flush():
+        batch = ready[:]
+        del ready[:len(batch)]
+        if not batch:
+            return
+        try:
+            await db.courses.insert_many([course for _, course, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys mean a previous run already wrote that course
+            fatal = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            failed_ids = {batch[err["index"]][1]["_id"] for err in fatal}
+            for item, course, _ in batch:
+                if course["_id"] in failed_ids:
+                    message = next(err["errmsg"] for err in fatal if batch[err["index"]][1]["_id"] == course["_id"])
+                    await _set_item(db, job_id, item["index"], status="failed", error=message)
+                    await events.put(_event("failed", item, error=message))
+            batch = [entry for entry in batch if entry[1]["_id"] not in failed_ids]
+        await roadmap_topics.store_many(db, [(course["_id"], roadmap) for _, course, roadmap in batch])
+        for item, course, _ in batch:
+            await _set_item(db, job_id, item["index"], status="done", error=None)
+            await events.put(_event("stored", item, course_id=str(course["_id"]), topics=course["topic_count"]))
+
+    tasks = [asyncio.create_task(process(item)) for item in todo]
+    pending = set(tasks)
+    try:
+        while pending or not events.empty():
+            if len(ready) >= INSERT_BATCH_SIZE or (not pending and ready):
+                await flush()
+            while not events.empty():
+                yield events.get_nowait()
+            if pending:
+                getter = asyncio.create_task(events.get())
+                done, _ = await asyncio.wait(pending | {getter}, return_when=asyncio.FIRST_COMPLETED)
+                pending -= done
+                if getter in done:
+                    yield getter.result()
+                else:
+                    getter.cancel()
+        await flush()
+        while not events.empty():
+            yield events.get_nowait()
+    finally:
+        # Client went away or the job failed: leave unfinished items pending for resume
+        for task in tasks:
+            task.cancel()
+
+    job = await db.import_jobs.find_one({"_id": job_id}, {"items.status": 1})
+    statuses = [item["status"] for item in job["items"]]
+    status = "completed" if all(s == "done" for s in statuses) else (
+        "completed_with_errors" if all(s in ("done", "failed") for s in statuses) else "partial")
+    await db.import_jobs.update_one({"_id": job_id}, {"$set": {"status": status, "updated_at": datetime.utcnow()}})
+    yield _event("done", job_id=str(job_id), status=status,
+                 succeeded=statuses.count("done"), failed=statuses.count("failed"))
+
+
+async def ndjson(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Encode events as newline-delimited JSON for a StreamingResponse."""
+    async for event in events:
+        yield (json.dumps(event, default=str) + "\n").encode("utf-8")
+
+
+def job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-safe view of a job document."""
+    return {
+        "job_id": str(job["_id"]),
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job.get("updated_at"),
+        "items": [
+            {
+                "index": item["index"],
+                "filename": item["filename"],
+                "status": item["status"],
+                "error": item.get("error"),
+                "course_id": str(item["course_id"]) if item["status"] == "done" else None,
+            }
+            for item in job["items"]
+        ],
+    }
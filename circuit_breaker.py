@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Circuit Breaker - Stop calling a failing service and switch to a fallback.
+
+This module provides functionality to:
+1. Count recent calls and failures in a sliding window (BREAKER_WINDOW_SECONDS)
+2. Open once the window holds at least BREAKER_MIN_CALLS calls and the share
+   of failures reaches BREAKER_ERROR_RATE: calls then fail at once with
+   CircuitOpen instead of waiting for the service to time out
+3. After BREAKER_COOLDOWN_SECONDS let one trial call through (half-open); it
+   closes the breaker when it succeeds and reopens it when it fails
+
+States are per process: every worker decides from the calls it made itself.
+Used by llm.py around every Gemini call.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Tuple
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Sliding window the error rate is computed over
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+
+# Calls the window must hold before the breaker may open
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+
+# Share of failed calls in the window that opens the breaker
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+
+# How long the breaker stays open before a trial call
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+
+class CircuitOpen(RuntimeError):
+    """The breaker is open: the call was not made."""
+
+
+class CircuitBreaker:
+    """Thread-safe breaker; call ``before_call`` first, then ``record`` the outcome."""
+
+    def __init__(self, name: str, window: float = BREAKER_WINDOW_SECONDS, min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self._calls: Deque[Tuple[float, bool]] = deque()  # (monotonic time, failed)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may be made now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._trial:
+                self._trial = True  # this call is the trial; others keep failing fast
+                return
+            left = max(self.cooldown - (time.monotonic() - self._opened_at), 0)
+            raise CircuitOpen(f"{self.name} is unavailable (circuit open, next try in {left:.0f}s)")
+
+    def record(self, failed: bool):
+        """Record the outcome of a call that ``before_call`` allowed."""
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    print(f"Circuit for {self.name} closed again")
+                return
+
+            self._calls.append((now, failed))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            failures = sum(1 for _, call_failed in self._calls if call_failed)
+            if (self._state == CLOSED and len(self._calls) >= self.min_calls
+                    and failures >= self.error_rate * len(self._calls)):
+                self._open(now)
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        print(f"Circuit for {self.name} opened; failing fast for {self.cooldown:.0f}s")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Deadlines - Per-request time budgets and cancellation when the client goes away.
+
+This module provides functionality to:
+1. Give a route a time budget (`@deadlines.budget(seconds)`) that everything it
+   calls inherits: Gemini calls get the remaining time as their HTTP timeout and
+   rate-limit wait (llm.py), MongoDB and GridFS operations through pymongo's
+   client-side operation timeout
+2. Answer 504 once the budget is spent instead of running on
+3. Cancel a request's handler as soon as its client disconnects (CancelOnDisconnect)
+4. Let work whose result is still worth keeping finish in the background (`park`)
+
+Parked work keeps the deadline of the request that started it, so nothing
+outlives its budget.
+"""
+
+import asyncio
+import functools
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Optional
+
+import pymongo
+from fastapi import HTTPException
+
+# Monotonic time by which the current request must be done; None outside a budget
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+# Parked tasks, referenced here so they are not garbage collected while running
+_parked = set()
+
+
+class DeadlineExceeded(TimeoutError):
+    """The current request's time budget ran out before a call could be made."""
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None if it has none."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(what: str = "call") -> Optional[float]:
+    """Raise DeadlineExceeded if the budget is spent; otherwise return ``remaining()``."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"No time left in the request budget for {what}")
+    return left
+
+
+def budget(seconds: float):
+    """
+    Decorate an async route so it runs within ``seconds``.
+
+    Place it below ``@app.post(...)``. A nested budget never extends an outer one.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            deadline = time.monotonic() + seconds
+            outer = _deadline.get()
+            if outer is not None:
+                deadline = min(deadline, outer)
+            token = _deadline.set(deadline)
+            try:
+                with pymongo.timeout(max(deadline - time.monotonic(), 0.001)):
+                    async with asyncio.timeout_at(_loop_time(deadline)):
+                        return await endpoint(*args, **kwargs)
+            except HTTPException as err:
+                if err.status_code < 500 or time.monotonic() < deadline:
+                    raise
+                raise HTTPException(status_code=504, detail=_too_slow(seconds)) from err
+            except Exception as err:
+                # Whatever failed once the budget is gone (Gemini, Mongo, asyncio) failed because of it
+                if time.monotonic() < deadline:
+                    raise
+                print(f"{endpoint.__name__} ran out of its {seconds:g}s budget: {err!r}")
+                raise HTTPException(status_code=504, detail=_too_slow(seconds)) from err
+            finally:
+                _deadline.reset(token)
+        return wrapper
+    return decorator
+
+
+def _loop_time(deadline: float) -> float:
+    # asyncio.timeout_at takes loop time, which need not be time.monotonic()
+    loop = asyncio.get_running_loop()
+    return loop.time() + (deadline - time.monotonic())
+
+
+def _too_slow(seconds: float) -> str:
+    return f"Request did not finish within its {seconds:g} second budget"
+
+
+def park(work: Awaitable, label: str) -> asyncio.Task:
+    """
+    Let ``work`` run to completion in the background, e.g. from a handler that
+    is being cancelled but has a Gemini response on the way that is worth storing.
+    """
+    task = asyncio.ensure_future(work)
+    _parked.add(task)
+
+    def done(task: asyncio.Task):
+        _parked.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            print(f"Parked work failed ({label}): {task.exception()!r}")
+        else:
+            print(f"Parked work finished ({label})")
+
+    task.add_done_callback(done)
+    return task
+
+
+class CancelOnDisconnect:
+    """
+    ASGI middleware that cancels a request's handler when the client disconnects.
+
+    It reads the request from the server itself and hands the body to the app
+    one message at a time (so uploads stay streamed), then keeps listening for
+    ``http.disconnect`` while the handler runs. A disconnect after the response
+    has been sent cancels nothing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        messages: asyncio.Queue = asyncio.Queue(maxsize=1)
+        disconnected = asyncio.Event()
+        response_sent = False
+
+        async def app_receive():
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def app_send(message):
+            nonlocal response_sent
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+            await send(message)
+
+        handler = asyncio.create_task(self.app(scope, app_receive, app_send))
+
+        async def watch():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    if not response_sent:
+                        handler.cancel()
+                    try:
+                        messages.put_nowait(message)
+                    except asyncio.QueueFull:
+                        pass
+                    return
+                await messages.put(message)
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if handler.cancelled() and disconnected.is_set() and not asyncio.current_task().cancelling():
+                print(f"Client disconnected from {scope['method']} {scope['path']}; cancelled its handler")
+                return
+            handler.cancel()
+            raise
+        finally:
+            watcher.cancel()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Delta Sync - Send returning clients only what changed since their last sync.
+
+This module provides functionality to:
+1. Take a high-water mark per collection (courses, roadmap, quizzes, review)
+   and return only the documents of the client's courses written after it,
+   found through (course_id, updated_at) indexes
+2. Report deletions: courses that no longer exist, and tombstones from
+   `tombstones` for documents deleted on their own (e.g. superseded quizzes).
+   Tombstones expire after TOMBSTONE_TTL_DAYS; a mark older than that gets
+   the collection in full with "reset": true
+3. Diff the user's review digest card by card, using the change times the
+   digest keeps for today (see review_digest.py); a mark from an earlier day
+   gets today's queue in full
+4. Hand out new marks taken from the server clock before reading. Marks are
+   moved back SYNC_SKEW_SECONDS when used, so a write that was in flight
+   during the previous sync is not missed; clients upsert by id, so the few
+   documents sent twice are harmless
+
+Marks are opaque to clients: send back what the last sync returned, or no
+mark for everything. The topics and quizzes of a deleted course are not
+listed one by one; they go with the course.
+
+Response:
+  {"marks": {"courses": ..., "roadmap": ..., "quizzes": ..., "review": ...},
+   "courses": {"changed": [{_id, name, created_at, topic_count}], "deleted": [ids], "reset": bool},
+   "roadmap": {"changed": [{course_id, topic_number, date, topic, ...}], "reset": bool},
+   "quizzes": {"changed": [quiz documents], "deleted": [ids], "reset": bool},
+   "review":  {"changed": [cards], "removed": [card ids], "reset": bool, "day", "total", "counts"}}
+
+Tombstones:
+  {kind: "quiz", key: "<deleted document's id>", course_id: "...", deleted_at}
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+import review_digest
+import roadmap_topics
+
+# Marks are moved back this far when used, to cover writes in flight at the previous sync
+SYNC_SKEW_SECONDS = float(os.getenv("SYNC_SKEW_SECONDS", "5"))
+
+# How long deletions are remembered; clients away longer resync in full
+TOMBSTONE_TTL_DAYS = int(os.getenv("TOMBSTONE_TTL_DAYS", "30"))
+
+COLLECTIONS = ("courses", "roadmap", "quizzes", "review")
+
+QUIZ = "quiz"
+
+# Course fields clients see (the stored syllabus is server-side only)
+_COURSE_FIELDS = {"name": 1, "created_at": 1, "topic_count": 1, "updated_at": 1}
+
+
+async def ensure_indexes(db):
+    await db.roadmap_topics.create_index([("course_id", ASCENDING), ("updated_at", ASCENDING)])
+    await db.quizzes.create_index([("course_id", ASCENDING), ("updated_at", ASCENDING)])
+    await db.tombstones.create_index([("course_id", ASCENDING), ("deleted_at", ASCENDING)])
+    await db.tombstones.create_index("deleted_at", expireAfterSeconds=TOMBSTONE_TTL_DAYS * 86400)
+
+
+async def record_deletions(db, kind: str, course_id: Any, keys: Iterable[Any]):
+    """Leave a tombstone for each deleted document of a course."""
+    now = datetime.utcnow()
+    docs = [{"kind": kind, "key": str(key), "course_id": str(course_id), "deleted_at": now} for key in keys]
+    if docs:
+        await db.tombstones.insert_many(docs)
+
+
+def parse_mark(value: Optional[str]) -> Optional[datetime]:
+    """The time a mark stands for; None for no mark. Raises ValueError for anything else."""
+    if value is None or value == "":
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid sync mark: {value!r}")
+
+
+def _since(mark: Optional[datetime], now: datetime) -> Optional[datetime]:
+    """Where to read from for a mark: None means everything (no mark, or older than the tombstones)."""
+    if mark is None or mark < now - timedelta(days=TOMBSTONE_TTL_DAYS):
+        return None
+    return mark - timedelta(seconds=SYNC_SKEW_SECONDS)
+
+
+def _written_after(since: Optional[datetime]) -> Dict[str, Any]:
+    return {} if since is None else {"updated_at": {"$gt": since}}
+
+
+async def _tombstones(db, kind: str, course_ids: List[str], since: Optional[datetime]) -> List[str]:
+    if since is None:
+        return []
+    cursor = db.tombstones.find(
+        {"course_id": {"$in": course_ids}, "deleted_at": {"$gt": since}, "kind": kind}, {"key": 1}
+    )
+    return [doc["key"] async for doc in cursor]
+
+
+async def _courses(db, course_ids: List[ObjectId], since: Optional[datetime]) -> Dict[str, Any]:
+    found = await db.courses.find({"_id": {"$in": course_ids}}, _COURSE_FIELDS).to_list(length=None)
+    existing = {doc["_id"] for doc in found}
+    changed = [doc for doc in found
+               if since is None or (doc.get("updated_at") or doc.get("created_at") or datetime.max) > since]
+    for doc in changed:
+        doc.pop("updated_at", None)
+    return {
+        "changed": changed,
+        "deleted": [str(course_id) for course_id in course_ids if course_id not in existing],
+        "reset": since is None,
+    }
+
+
+async def _roadmap(db, course_ids: List[ObjectId], since: Optional[datetime]) -> Dict[str, Any]:
+    projection = {field: 1 for field in roadmap_topics.ENTRY_FIELDS}
+    projection.update(course_id=1, topic_number=1)
+    docs = db.roadmap_topics.find({"course_id": {"$in": course_ids}, **_written_after(since)}, projection)
+    changed = [
+        {"course_id": str(doc["course_id"]), **roadmap_topics.entry(doc)}
+        async for doc in docs
+    ]
+    changed.sort(key=lambda topic: (topic["course_id"], topic["topic_number"]))
+    return {"changed": changed, "reset": since is None}
+
+
+async def _quizzes(db, course_ids: List[ObjectId], since: Optional[datetime]) -> Dict[str, Any]:
+    changed = await db.quizzes.find({"course_id": {"$in": course_ids}, **_written_after(since)}).to_list(length=None)
+    deleted = await _tombstones(db, QUIZ, [str(course_id) for course_id in course_ids], since)
+    return {"changed": changed, "deleted": deleted, "reset": since is None}
+
+
+async def _review(db, user_id: str, mark: Optional[datetime]) -> Dict[str, Any]:
+    digest = await review_digest.get_digest(db, user_id)
+    # A mark from an earlier day saw another queue; today's is sent in full
+    since = None
+    if mark is not None and str(mark.date()) == digest["day"]:
+        since = mark - timedelta(seconds=SYNC_SKEW_SECONDS)
+
+    stamps = digest.get("changed_at", {})
+    if since is None:
+        changed, removed = digest["cards"], []
+    else:
+        # Digests written before change times were kept have none; their cards count as changed
+        changed = [card for card in digest["cards"] if stamps.get(card["card_id"], digest["updated_at"]) > since]
+        removed = [key for key, at in digest.get("removed", {}).items() if at > since]
+    return {
+        "changed": changed,
+        "removed": removed,
+        "reset": since is None,
+        "day": digest["day"],
+        "total": digest["total"],
+        "counts": digest["counts"],
+    }
+
+
+async def changes(db, user_id: str, course_ids: Iterable[str], marks: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """
+    Everything of ``course_ids`` and ``user_id``'s review queue written after ``marks``.
+    Raises ValueError for an invalid course id, collection name or mark.
+    """
+    unknown = set(marks) - set(COLLECTIONS)
+    if unknown:
+        raise ValueError(f"Unknown collections: {sorted(unknown)}; expected some of {list(COLLECTIONS)}")
+    parsed = {name: parse_mark(marks.get(name)) for name in COLLECTIONS}
+    oids = []
+    for course_id in dict.fromkeys(course_ids):
+        try:
+            oids.append(ObjectId(course_id))
+        except Exception:
+            raise ValueError(f"Invalid course ID: {course_id!r}")
+
+    # Taken before reading, so anything written during this sync is in the next one
+    now = datetime.utcnow()
+    result: Dict[str, Any] = {"marks": {name: now.isoformat() for name in COLLECTIONS}}
+    result["courses"] = await _courses(db, oids, _since(parsed["courses"], now))
+    present = [oid for oid in oids if str(oid) not in result["courses"]["deleted"]]
+    result["roadmap"] = await _roadmap(db, present, _since(parsed["roadmap"], now))
+    result["quizzes"] = await _quizzes(db, present, _since(parsed["quizzes"], now))
+    result["review"] = await _review(db, user_id, parsed["review"])
+    return result
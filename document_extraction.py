@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Document Extraction - Plain-text extraction for syllabus and notes files.
+
+This module provides functionality to:
+1. Extract text from PDF files with pdfplumber, whole or page by page
+2. Extract text from DOCX files with python-docx, keeping headings ("# "),
+   list items ("- ") and tables (cells separated by " | ") in body order
+3. Render single PDF pages to PNG for vision transcription of scanned pages
+4. Extract the tables of PDF and DOCX files as rows of cell strings
+
+It has no dependency on the FastAPI app or its clients, so it can be imported
+cheaply by worker processes (see bulk_import.py). pdfplumber and python-docx
+are only imported the first time a file of that type is parsed.
+"""
+
+import io
+import os
+import tempfile
+from typing import IO, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+
+def _pdfplumber():
+    import pdfplumber
+    return pdfplumber
+
+
+def _docx():
+    try:
+        import docx  # type: ignore
+    except ImportError:
+        raise RuntimeError("python-docx not installed; cannot parse DOCX files")
+    return docx
+
+
+def extract_text_from_file(source: Union[str, IO[bytes]], suffix: str) -> str:
+    """Return plaintext from a PDF or DOCX file given as a path or binary stream."""
+
+    if suffix == ".pdf":
+        with _pdfplumber().open(source) as pdf:
+            return "\n".join(page.extract_text() or "" for page in pdf.pages)
+
+    if suffix == ".docx":
+        return "\n".join(_docx_lines(_docx().Document(source)))
+
+    raise ValueError("Unsupported file type")
+
+
+def _docx_lines(document) -> List[str]:
+    """The body of a DOCX document as lines, with its structure marked the way document_model.py reads it."""
+    lines = []
+    for item in document.iter_inner_content():
+        if hasattr(item, "rows"):  # a table
+            for row in item.rows:
+                cells = [cell.text.strip().replace("\n", " ") for cell in row.cells]
+                if any(cells):
+                    lines.append(" | ".join(cells))
+            lines.append("")
+            continue
+
+        text = item.text.strip()
+        style = (item.style.name if item.style is not None else "") or ""
+        p_pr = item._p.pPr
+        num_pr = p_pr.numPr if p_pr is not None else None
+        if not text:
+            lines.append("")
+        elif style == "Title":
+            lines.append(f"# {text}")
+        elif style.startswith("Heading ") and style[8:].isdigit():
+            lines.append(f"{'#' * min(int(style[8:]), 6)} {text}")
+        elif num_pr is not None or style.startswith("List"):
+            if num_pr is not None and num_pr.ilvl is not None:
+                level = num_pr.ilvl.val
+            else:
+                level = int(style[-1]) - 1 if style[-1:].isdigit() else 0  # "List Bullet 2"
+            lines.append(f"{'  ' * level}- {text}")
+        else:
+            lines.append(text)
+    return lines
+
+
+def extract_tables_from_file(
+    source: Union[str, IO[bytes]], suffix: str, pages: Optional[Iterable[int]] = None
+) -> List[List[List[str]]]:
+    """
+    Return the tables of a PDF or DOCX file, in document order.
+
+    Each table is a list of rows and each row a list of cell strings ("" for
+    empty cells). A PDF table that continues on the next page comes back as
+    two tables.
+
+    Args:
+        pages: 1-based PDF page numbers to look at (default all). Laying out a
+            page costs about as much as extracting its text, so callers that
+            know where the tables are should say so.
+    """
+
+    if suffix == ".pdf":
+        tables = []
+        with _pdfplumber().open(source) as pdf:
+            wanted = set(pages) if pages is not None else None
+            for number, page in enumerate(pdf.pages, start=1):
+                if wanted is not None and number not in wanted:
+                    continue
+                for table in page.extract_tables():
+                    tables.append([[cell or "" for cell in row] for row in table])
+                page.close()
+        return tables
+
+    if suffix == ".docx":
+        document = _docx().Document(source)
+        return [
+            [[cell.text for cell in row.cells] for row in table.rows]
+            for table in document.tables
+        ]
+
+    raise ValueError("Unsupported file type")
+
+
+def extract_text_from_bytes(data: bytes, suffix: str) -> str:
+    """Write ``data`` to a temporary file and extract its text."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(data)
+        tmp_path = tmp.name
+    try:
+        return extract_text_from_file(tmp_path, suffix)
+    finally:
+        os.remove(tmp_path)
+
+
+def extract_pdf_pages(
+    path: str,
+    skip: Iterable[int] = (),
+    min_chars: int = 20,
+    tables_on: Optional[Callable[[str], bool]] = None,
+) -> Tuple[int, Dict[int, str], List[int], Dict[int, List[List[List[str]]]]]:
+    """
+    Extract the text layer of each page of a PDF.
+
+    Args:
+        path: PDF file
+        skip: 1-based page numbers that are already known and need no work
+        min_chars: Pages with less text than this are treated as having no text layer
+        tables_on: Predicate on a page's text. The tables of the pages it holds
+            for, and of the page after each, are extracted in the same pass
+            (laying a page out is most of the cost of either)
+
+    Returns:
+        (page count, {page number: text} for pages with text, page numbers
+        without a text layer, {page number: tables} for the pages whose tables
+        were extracted)
+    """
+    skip = set(skip)
+    texts, blank, tables = {}, [], {}
+    previous_matched = False
+    with _pdfplumber().open(path) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            if number in skip:
+                previous_matched = False
+                continue
+            text = page.extract_text() or ""
+            if len(text.strip()) >= min_chars:
+                texts[number] = text
+            else:
+                blank.append(number)
+            if tables_on is not None:
+                matched = tables_on(text)
+                if matched or previous_matched:
+                    tables[number] = [[[cell or "" for cell in row] for row in table] for table in page.extract_tables()]
+                previous_matched = matched
+            page.close()
+        return len(pdf.pages), texts, blank, tables
+
+
+def render_pdf_page(path: str, page_number: int, resolution: int = 150) -> bytes:
+    """Render one 1-based PDF page to PNG bytes."""
+    with _pdfplumber().open(path) as pdf:
+        image = pdf.pages[page_number - 1].to_image(resolution=resolution).original
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""
+Document Model - Pages, headings, paragraphs and list items of extracted text.
+
+This module provides functionality to:
+1. Rebuild the structure of extracted text page by page (page_extraction.py):
+   headings ("# " lines from DOCX, short title-like lines in PDFs), list items,
+   and paragraphs re-joined from their wrapped lines
+2. Render it as clean text with a blank line between blocks, and record the
+   kind, level, page and character offsets of each block in that text
+3. Store those offsets compactly next to the text (`notes.structure`) without
+   repeating the text itself
+4. Split text into sections (a heading and what follows it) and cut it down to
+   a character budget section by section, for prompts and search chunks
+
+Stored structure:
+  {"v": 1, "pages": <page count>, "blocks": [[kind, level, page, start, end], ...]}
+
+kind is "h" (heading), "p" (paragraph) or "l" (list item); level is the heading
+level (1 = top) or list nesting depth; page 0 holds text typed in by the
+student rather than extracted from a file; start and end are offsets into the
+stored text.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import AbstractSet, Any, Dict, List, Optional
+
+STRUCTURE_VERSION = 1
+
+HEADING, PARAGRAPH, LIST_ITEM = "h", "p", "l"
+
+_MARKED_HEADING = re.compile(r"^(#{1,6})\s+(.+)$")
+_LIST_ITEM = re.compile(r"^(\s*)(?:[-*•●◦▪·–]|\d{1,2}[.)]|[a-zA-Z][.)])\s+(.+)$")
+_NUMBERED_HEADING = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+[A-Z]")
+_PAGE_NUMBER = re.compile(r"^(?:page\s+)?\d+(?:\s*(?:of|/)\s*\d+)?$", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"[.!?:]$")
+
+# Headings end without punctuation and are short
+_MAX_HEADING_CHARS = 80
+_MAX_HEADING_WORDS = 10
+
+# A wrapped line ending like this continues on the next line
+_CONTINUES = re.compile(r"(?:[,;(–-]|\b(?:and|or|of|the|a|an|to|in|on|for|with|from|by))$", re.IGNORECASE)
+
+# Small words that stay lowercase in a Title Case heading
+_MINOR_WORDS = {"a", "an", "and", "as", "at", "but", "by", "for", "in", "of", "on", "or", "the", "to", "vs", "with"}
+
+
+@dataclass(slots=True)
+class Block:
+    """One heading, paragraph or list item."""
+
+    kind: str
+    text: str
+    page: int = 1
+    level: int = 0
+    start: int = 0  # offsets of the rendered block in Document.text
+    end: int = 0
+
+
+@dataclass(slots=True)
+class Section:
+    """A heading (None before the first one) and the blocks up to the next heading."""
+
+    heading: Optional[Block]
+    blocks: List[Block] = field(default_factory=list)
+
+    @property
+    def all_blocks(self) -> List[Block]:
+        return ([self.heading] if self.heading else []) + self.blocks
+
+
+class Document:
+    """Extracted text as blocks, rendered once into ``text`` with each block's offsets."""
+
+    __slots__ = ("blocks", "pages", "text")
+
+    def __init__(self, blocks: List[Block], pages: int):
+        self.blocks = blocks
+        self.pages = pages
+        self.text = _render(blocks)
+
+    # -- building ------------------------------------------------------------
+
+    @classmethod
+    def from_pages(cls, pages: Dict[int, str]) -> "Document":
+        """Structure of extracted page texts, by page number (see page_extraction.page_texts)."""
+        running = _running_lines(pages)
+        blocks: List[Block] = []
+        for number in sorted(pages):
+            blocks.extend(_page_blocks(pages[number], number, running))
+        return cls(blocks, max(pages, default=0))
+
+    def with_typed_text(self, content: str) -> "Document":
+        """This document after the student's own typed text, which is kept exactly as typed."""
+        if not content:
+            return self
+        typed = Block(PARAGRAPH, content, page=0)
+        return Document([typed] + [_copy(block) for block in self.blocks], self.pages)
+
+    # -- storage -------------------------------------------------------------
+
+    def to_bson(self) -> Dict[str, Any]:
+        return {
+            "v": STRUCTURE_VERSION,
+            "pages": self.pages,
+            "blocks": [[b.kind, b.level, b.page, b.start, b.end] for b in self.blocks],
+        }
+
+    @classmethod
+    def from_bson(cls, structure: Dict[str, Any], text: str) -> "Document":
+        """The document of a stored text and its structure (offsets are taken as stored)."""
+        doc = cls.__new__(cls)
+        doc.pages = structure.get("pages", 0)
+        doc.text = text
+        doc.blocks = []
+        for kind, level, page, start, end in structure.get("blocks", []):
+            line = text[start:end]
+            if kind == LIST_ITEM:
+                line = line.lstrip()[2:]
+            doc.blocks.append(Block(kind, line, page, level, start, end))
+        return doc
+
+    # -- selection -----------------------------------------------------------
+
+    def sections(self) -> List[Section]:
+        sections = [Section(None)]
+        for block in self.blocks:
+            if block.kind == HEADING:
+                sections.append(Section(block))
+            else:
+                sections[-1].blocks.append(block)
+        return [section for section in sections if section.heading or section.blocks]
+
+    def section_texts(self) -> List[str]:
+        """The text of each section, heading included."""
+        return [
+            self.text[section.all_blocks[0].start:section.all_blocks[-1].end]
+            for section in self.sections()
+        ]
+
+    def excerpt(self, budget_chars: int) -> str:
+        """
+        The text cut down to about ``budget_chars``, keeping every section.
+
+        Headings are always kept; each section's body gets a share of the rest
+        in proportion to its length and keeps its leading blocks (where topic
+        sentences and definitions usually are), in whole blocks where possible.
+        """
+        if len(self.text) <= budget_chars:
+            return self.text
+
+        sections = self.sections()
+        headings = sum(len(s.heading.text) + 2 for s in sections if s.heading)
+        body = sum(len(b.text) + 2 for s in sections for b in s.blocks) or 1
+        available = max(budget_chars - headings, 0)
+
+        kept: List[Block] = []
+        for section in sections:
+            if section.heading:
+                kept.append(_copy(section.heading))
+            share = available * sum(len(b.text) + 2 for b in section.blocks) / body
+            used = 0
+            for block in section.blocks:
+                size = len(block.text) + 2
+                if used + size <= share:
+                    kept.append(_copy(block))
+                    used += size
+                    continue
+                if used == 0 and share >= 80:
+                    # Nothing of this section fits whole: keep the start of its first block
+                    cut = block.text[:int(share) - 1].rsplit(" ", 1)[0]
+                    kept.append(Block(block.kind, cut + "…", block.page, block.level))
+                break
+        return _render(kept)
+
+
+def _copy(block: Block) -> Block:
+    return Block(block.kind, block.text, block.page, block.level)
+
+
+def _render(blocks: List[Block]) -> str:
+    """Join blocks into text and set their offsets; list items of one list go on consecutive lines."""
+    parts: List[str] = []
+    position = 0
+    previous: Optional[Block] = None
+    for block in blocks:
+        if previous is not None:
+            separator = "\n" if block.kind == LIST_ITEM and previous.kind == LIST_ITEM else "\n\n"
+            parts.append(separator)
+            position += len(separator)
+        line = f"{'  ' * block.level}- {block.text}" if block.kind == LIST_ITEM else block.text
+        block.start, block.end = position, position + len(line)
+        parts.append(line)
+        position += len(line)
+        previous = block
+    return "".join(parts)
+
+
+def _typical_width(lines: List[str]) -> int:
+    """Length of a full line of running text on a page (90th percentile of line lengths)."""
+    lengths = sorted(len(line.strip()) for line in lines if line.strip())
+    return lengths[int(len(lengths) * 0.9)] if lengths else 0
+
+
+def _heading_level(line: str, after_break: bool) -> int:
+    """Level of a line that reads like a heading of a PDF page (0 if it does not)."""
+    words = line.split()
+    if (
+        not after_break
+        or len(line) > _MAX_HEADING_CHARS
+        or len(words) > _MAX_HEADING_WORDS
+        or re.search(r"[.,;:!?]$", line)
+        or not (line[0].isupper() or line[0].isdigit())
+    ):
+        return 0
+    numbered = _NUMBERED_HEADING.match(line)
+    if numbered:
+        return numbered.group(1).count(".") + 1
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 3 and all(c.isupper() for c in letters):
+        return 1
+    if all(word[:1].isupper() or word.lower() in _MINOR_WORDS or not word[:1].isalpha() for word in words):
+        return 2
+    return 0
+
+
+def _running_lines(pages: Dict[int, str]) -> AbstractSet[str]:
+    """Running headers and footers: first or last lines repeated on at least half the pages (and two)."""
+    if len(pages) < 2:
+        return set()
+    counts: Dict[str, int] = {}
+    for text in pages.values():
+        lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+        for line in set(lines[:1] + lines[-1:]):
+            counts[line] = counts.get(line, 0) + 1
+    return {line for line, count in counts.items() if count >= 2 and count * 2 >= len(pages)}
+
+
+def _page_blocks(text: str, page: int, running: AbstractSet[str] = frozenset()) -> List[Block]:
+    lines = [line for line in (text or "").splitlines() if line.strip() not in running]
+    width = _typical_width(lines)
+    blocks: List[Block] = []
+    paragraph: List[str] = []
+    after_break = True  # the previous line ended a block (or this is the top of the page)
+
+    def flush():
+        if paragraph:
+            blocks.append(Block(PARAGRAPH, " ".join(paragraph), page))
+            paragraph.clear()
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            flush()
+            after_break = True
+            continue
+        if _PAGE_NUMBER.match(line):
+            continue  # page numbers carry nothing
+
+        marked = _MARKED_HEADING.match(line)
+        if marked:
+            flush()
+            blocks.append(Block(HEADING, marked.group(2).strip(), page, len(marked.group(1))))
+            after_break = True
+            continue
+
+        item = _LIST_ITEM.match(raw.rstrip())
+        if item:
+            flush()
+            blocks.append(Block(LIST_ITEM, item.group(2).strip(), page, len(item.group(1).expandtabs(2)) // 2))
+            after_break = False
+            continue
+
+        level = _heading_level(line, after_break and not paragraph)
+        if level:
+            flush()
+            blocks.append(Block(HEADING, line, page, level))
+            after_break = True
+            continue
+
+        last = blocks[-1] if blocks else None
+        if not paragraph and last is not None and last.kind == LIST_ITEM and (
+            line[:1].islower() or _CONTINUES.search(last.text)
+        ):
+            last.text += " " + line  # a list item wrapped onto the next line
+            continue
+
+        paragraph.append(line)
+        after_break = bool(_SENTENCE_END.search(line))
+        # A short line that ends a sentence is the last line of its paragraph
+        if after_break and len(line) < 0.8 * width:
+            flush()
+    flush()
+    return blocks
+
+
+# ---------------------------------------------------------------------------
+# Stored notes
+# ---------------------------------------------------------------------------
+
+def load(text: str, structure: Optional[Dict[str, Any]]) -> Optional[Document]:
+    """The document of a stored text, or None if it has no (current) structure."""
+    if not structure or structure.get("v") != STRUCTURE_VERSION:
+        return None
+    return Document.from_bson(structure, text or "")
+
+
+def excerpt(text: str, structure: Optional[Dict[str, Any]], budget_chars: int) -> str:
+    """A stored text cut to ``budget_chars`` by section; unstructured text is returned whole."""
+    document = load(text, structure)
+    return document.excerpt(budget_chars) if document else (text or "")
+
+
+def section_texts(text: str, structure: Optional[Dict[str, Any]]) -> List[str]:
+    """The sections of a stored text, or the whole text as one section."""
+    document = load(text, structure)
+    return document.section_texts() if document else [text or ""]
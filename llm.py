@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+LLM - One shared, lazily created Gemini client for the whole backend.
+
+This module provides functionality to:
+1. Create the `google.genai` client on first use instead of at import time
+2. Defer importing `google.genai` itself (the heaviest import in the app) until then
+3. Offer small helpers for text and image (vision) prompts
+4. Keep all worker processes together under the Gemini quota (GEMINI_RPM)
+5. Bound every call by the remaining time of the request that made it (deadlines.py)
+6. Create cached contexts (documents uploaded once and referenced by later calls)
+7. Fail fast while Gemini keeps failing (circuit_breaker.py), so callers can
+   fall back to local generation (local_quiz.py)
+
+Set GOOGLE_API_KEY (required on first use) and optionally GEMINI_BASE_URL to
+point the client at another endpoint, e.g. benchmarks/fake_gemini.py.
+"""
+
+import os
+import threading
+from typing import Any, Optional
+
+import deadlines
+import shared_state
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# Requests per minute allowed across every worker process; 0 disables the limit
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "0"))
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "0")) or None
+GEMINI_RATE_WAIT_SECONDS = float(os.getenv("GEMINI_RATE_WAIT_SECONDS", "60"))
+
+_client = None
+_client_lock = threading.Lock()
+
+# Opens on a high share of unavailable / rate-limited responses (see circuit_breaker.py)
+breaker = CircuitBreaker("Gemini")
+
+
+def _reset_after_fork():
+    # The HTTP connection pool of a client created before a fork must not be shared
+    global _client, _client_lock
+    _client, _client_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client():
+    """Return the shared `genai.Client`, creating it on first call."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("GOOGLE_API_KEY")
+                if not api_key:
+                    raise RuntimeError("Set GOOGLE_API_KEY environment variable")
+                from google import genai
+
+                base_url = os.getenv("GEMINI_BASE_URL")
+                _client = genai.Client(
+                    api_key=api_key,
+                    http_options={"base_url": base_url} if base_url else None,
+                )
+    return _client
+
+
+def types():
+    """The `google.genai.types` module, imported on demand."""
+    from google.genai import types as genai_types
+    return genai_types
+
+
+def generate_content(contents: Any, model: str = DEFAULT_MODEL, config: Optional[Any] = None):
+    """
+    Blocking generate_content call on the shared client, within the shared rate limit.
+
+    Inside a route with a time budget, the rate-limit wait and the HTTP request
+    are limited to what is left of it, and no call starts once it is spent.
+    """
+    left = deadlines.check("a Gemini call")
+    breaker.before_call()  # raises CircuitOpen while Gemini is failing
+    try:
+        if GEMINI_RPM:
+            wait = GEMINI_RATE_WAIT_SECONDS if left is None else min(GEMINI_RATE_WAIT_SECONDS, left)
+            shared_state.wait_for_token("gemini", GEMINI_RPM, GEMINI_BURST, wait)
+        if left is not None:
+            config = _with_timeout(config, deadlines.check("a Gemini call"))
+        response = get_client().models.generate_content(model=model, contents=contents, config=config)
+    except deadlines.DeadlineExceeded:
+        breaker.record(failed=False)  # our budget ran out, Gemini did not fail
+        raise
+    except Exception as err:
+        breaker.record(failed=is_unavailable(err))
+        raise
+    breaker.record(failed=False)
+    return response
+
+
+def is_unavailable(err: BaseException) -> bool:
+    """
+    Whether ``err`` means Gemini could not answer: the breaker is open, the call
+    was rate limited (429, or the shared rate-limit wait ran out), the server
+    failed (5xx) or the connection failed or timed out. Other 4xx errors mean a
+    bad request, not an outage.
+    """
+    if isinstance(err, CircuitOpen):
+        return True
+    if isinstance(err, deadlines.DeadlineExceeded):
+        return False
+    code = getattr(err, "code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return True
+
+
+def create_cache(contents: Any, ttl_seconds: int, model: str = DEFAULT_MODEL,
+                 display_name: Optional[str] = None, system_instruction: Optional[str] = None):
+    """
+    Blocking creation of a cached context of ``contents`` that expires after ``ttl_seconds``.
+
+    Pass the returned cache's ``name`` as ``cached_content`` of a generate_content
+    config with the same ``model``. Bounded by the request's time budget as above.
+    """
+    genai_types = types()
+    left = deadlines.check("a Gemini cache upload")
+    http_options = genai_types.HttpOptions(timeout=max(int(left * 1000), 1)) if left is not None else None
+    config = genai_types.CreateCachedContentConfig(
+        contents=contents,
+        ttl=f"{int(ttl_seconds)}s",
+        display_name=display_name,
+        system_instruction=system_instruction,
+        http_options=http_options,
+    )
+    return get_client().caches.create(model=model, config=config)
+
+
+def _with_timeout(config: Optional[Any], seconds: float):
+    """Copy of ``config`` whose HTTP timeout (in ms) is at most ``seconds``."""
+    genai_types = types()
+    timeout_ms = max(int(seconds * 1000), 1)
+    if config is None:
+        return genai_types.GenerateContentConfig(http_options=genai_types.HttpOptions(timeout=timeout_ms))
+    http_options = config.http_options or genai_types.HttpOptions()
+    if http_options.timeout is not None:
+        timeout_ms = min(timeout_ms, http_options.timeout)
+    return config.model_copy(update={"http_options": http_options.model_copy(update={"timeout": timeout_ms})})
+
+
+def image_part(image_content: bytes, image_mime_type: str):
+    """Wrap raw image bytes as a content part for vision prompts."""
+    return types().Part.from_bytes(data=image_content, mime_type=image_mime_type)
+
+
+def response_text(response) -> str:
+    """Depending on library version, the text may be under `text` or `content`."""
+    return getattr(response, "text", None) or getattr(response, "content", "") or ""
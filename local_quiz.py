@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Local Quiz - CPU-only flashcards and multiple-choice questions for when Gemini is unavailable.
+
+This module provides functionality to:
+1. Split note and roadmap text into sentences (NLTK's punkt tokenizer when its
+   data is installed, a regular expression otherwise)
+2. Rank key terms by TF-IDF, with sentences as documents: single words and
+   the bigram collocations NLTK finds, without stopwords
+3. Build definition cards ("What is X?") from sentences that define a term,
+   and cloze-deletion cards (the sentence with its key term blanked out)
+4. Turn those cards into multiple-choice questions, other key terms of the
+   same text serving as distractors
+
+Everything generated here carries `"generator": "local"` so it can be
+regenerated with Gemini once it is reachable again (see prewarm.py).
+"""
+
+import math
+import random
+import re
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+from models import Flashcard, MultipleChoiceQuestion
+
+# Marks cards, questions and quizzes made here rather than by Gemini
+LOCAL = "local"
+
+BLANK = "_____"
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z'\-]*[A-Za-z]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_BLOCK_START = re.compile(r"#|[-*•]\s|\d{1,2}[.)]\s")
+
+# "<term> is / are / refers to ... <definition>"
+_DEFINITION = re.compile(
+    r"^(?P<term>[A-Za-z][\w\s\-'/()]{1,60}?)(?:,[^,]{1,80},)?\s+"
+    r"(?P<verb>is defined as|is known as|refers to|means|is|are)\s+"
+    r"(?P<definition>[^;]{15,240}?)[.;]?$"
+)
+
+# Sentences that make useful cards are neither fragments nor whole paragraphs
+_MIN_WORDS, _MAX_WORDS = 6, 45
+_MAX_TERM_WORDS = 6
+
+# Used when NLTK's stopword corpus is not installed
+_STOPWORDS = set("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each either etc few for from further had has
+have having he her here hers herself him himself his how however i if in into is it its itself just like
+may me might more most must my myself no nor not now of off on once one only or other our ours ourselves
+out over own same shall she should so some such than that the their theirs them themselves then there
+therefore these they this those through thus to too two under until up upon us use used using very was
+we were what when where which while who whom why will with within without would you your yours yourself
+""".split())
+
+_nltk_sentences: Optional[bool] = None  # whether punkt is installed; checked on first use
+
+
+def _blocks(text: str) -> List[str]:
+    """Paragraphs, headings and list items on one line each; none runs into the next."""
+    blocks: List[str] = []
+    current: List[str] = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if (not stripped or _BLOCK_START.match(stripped)) and current:
+            blocks.append(" ".join(current))
+            current = []
+        if stripped.startswith("#"):
+            blocks.append(stripped)
+        elif stripped:
+            current.append(stripped)
+    if current:
+        blocks.append(" ".join(current))
+    return blocks
+
+
+def _sentence_split(text: str) -> List[str]:
+    global _nltk_sentences
+    blocks = _blocks(text)
+    if _nltk_sentences is not False:
+        try:
+            from nltk.tokenize import sent_tokenize
+            sentences = [s for block in blocks for s in sent_tokenize(block)]
+            _nltk_sentences = True
+            return sentences
+        except (ImportError, LookupError):
+            _nltk_sentences = False
+    return [s for block in blocks for s in _SENTENCE_END.split(block)]
+
+
+def sentences(text: str) -> List[str]:
+    """The sentences of ``text`` on one line each, list markers and headings' "#" removed."""
+    result = []
+    for sentence in _sentence_split(text or ""):
+        sentence = re.sub(r"^\s*(?:#+|[-*•]|\d{1,2}[.)])\s+", "", sentence)
+        sentence = sentence.strip()
+        if sentence:
+            result.append(sentence)
+    return result
+
+
+def _stopwords() -> set:
+    try:
+        from nltk.corpus import stopwords
+        return _STOPWORDS | set(stopwords.words("english"))
+    except (ImportError, LookupError):
+        return _STOPWORDS
+
+
+def _words(sentence: str) -> List[str]:
+    return [word.lower() for word in _WORD.findall(sentence)]
+
+
+def _collocations(tokenized: List[List[str]], stop: set, limit: int = 30) -> List[Tuple[str, str]]:
+    """Bigrams that occur together more than once, by likelihood ratio (NLTK), most telling first."""
+    try:
+        from nltk.collocations import BigramAssocMeasures, BigramCollocationFinder
+    except ImportError:
+        return []
+    finder = BigramCollocationFinder.from_documents(tokenized)
+    finder.apply_freq_filter(2)
+    finder.apply_word_filter(lambda word: word in stop or len(word) < 3)
+    return finder.nbest(BigramAssocMeasures.likelihood_ratio, limit)
+
+
+def key_terms(sentence_list: List[str], limit: int = 40) -> List[Tuple[str, float]]:
+    """Terms of the text with their TF-IDF weight, best first (sentences are the documents)."""
+    stop = _stopwords()
+    tokenized = [_words(sentence) for sentence in sentence_list]
+    bigrams = {" ".join(pair) for pair in _collocations(tokenized, stop)}
+
+    term_freq: Counter = Counter()
+    doc_freq: Counter = Counter()
+    for words in tokenized:
+        terms = [word for word in words if word not in stop and len(word) > 2]
+        terms += [f"{a} {b}" for a, b in zip(words, words[1:]) if f"{a} {b}" in bigrams]
+        term_freq.update(terms)
+        doc_freq.update(set(terms))
+
+    count = len(tokenized)
+    weights = {
+        term: freq * (math.log((1 + count) / (1 + doc_freq[term])) + 1) * (1.5 if " " in term else 1.0)
+        for term, freq in term_freq.items()
+    }
+    # A bigram stands for its words: drop words that only occur inside a kept bigram
+    for bigram in bigrams:
+        for word in bigram.split():
+            if term_freq[word] <= term_freq[bigram]:
+                weights.pop(word, None)
+    return sorted(weights.items(), key=lambda item: -item[1])[:limit]
+
+
+def _definition(sentence: str, stop: set) -> Optional[Tuple[str, str, str]]:
+    """``(term, verb, definition)`` if the sentence defines a term."""
+    match = _DEFINITION.match(sentence)
+    if not match:
+        return None
+    term = re.sub(r"^(?:the|a|an)\s+", "", match.group("term").strip(), flags=re.IGNORECASE)
+    words = term.split()
+    if not words or len(words) > _MAX_TERM_WORDS or all(word.lower() in stop for word in words):
+        return None
+    if words[0].lower() in {"it", "this", "that", "there", "these", "those", "he", "she", "they", "which", "what"}:
+        return None
+    return term, match.group("verb"), match.group("definition").strip()
+
+
+def _cloze(sentence: str, term: str) -> Optional[str]:
+    pattern = re.compile(rf"\b{re.escape(term)}\b", re.IGNORECASE)
+    blanked, replaced = pattern.subn(BLANK, sentence, count=1)
+    return blanked if replaced else None
+
+
+def _cards(text: str, count: int) -> List[Tuple[str, str, str, str]]:
+    """
+    ``(question, answer, term, choice_question)`` of up to ``count`` cards:
+    definitions first, then clozes. ``choice_question`` asks for ``term`` itself.
+    """
+    sentence_list = [s for s in sentences(text) if _MIN_WORDS <= len(s.split()) <= _MAX_WORDS]
+    if not sentence_list:
+        return []
+    stop = _stopwords()
+    weights = dict(key_terms(sentence_list, limit=80))
+    if not weights:
+        return []
+
+    def sentence_weight(sentence: str) -> float:
+        words = _words(sentence)
+        terms = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+        return sum(weights.get(term, 0.0) for term in terms) / (1 + math.log(len(words)))
+
+    ranked = sorted(sentence_list, key=sentence_weight, reverse=True)
+    cards: List[Tuple[str, str, str, str]] = []
+    answers = set()
+    used = set()
+
+    # Definitions: at most half the cards, so the terms themselves get asked too
+    for sentence in ranked:
+        if len(cards) >= max(count // 2, 1):
+            break
+        found = _definition(sentence, stop)
+        if found and found[0].lower() not in answers:
+            term, verb, definition = found
+            plural = verb == "are"
+            question = f"What does {term} refer to?" if verb == "refers to" else \
+                f"What {'are' if plural else 'is'} {term}?"
+            choice = f"Which term {'are' if plural else 'is'} described as: {definition}?"
+            cards.append((question, definition, term, choice))
+            answers.add(term.lower())
+            used.add(sentence)
+
+    # Clozes: each sentence's best term not asked yet
+    for sentence in ranked:
+        if len(cards) >= count:
+            break
+        if sentence in used:
+            continue
+        words = _words(sentence)
+        present = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+        candidates = sorted((term for term in present if term in weights and term not in answers),
+                            key=lambda term: -weights[term])
+        for term in candidates:
+            blanked = _cloze(sentence, term)
+            if blanked and blanked.strip() != BLANK:
+                original = re.search(rf"\b{re.escape(term)}\b", sentence, re.IGNORECASE).group(0)
+                cards.append((f"Fill in the blank: {blanked}", original, original,
+                              f"Which term completes the statement: {blanked}"))
+                answers.add(term)
+                used.add(sentence)
+                break
+    return cards
+
+
+def flashcards(texts: Iterable[str], count: int = 10) -> List[Flashcard]:
+    """Up to ``count`` flashcards from ``texts`` (roadmap topic, its prompt, notes), numbered from 1."""
+    cards = _cards("\n\n".join(text for text in texts if text), count)
+    return [Flashcard(question, answer, i + 1, LOCAL) for i, (question, answer, _, _) in enumerate(cards)]
+
+
+def multiple_choice(text: str, count: int = 10) -> List[MultipleChoiceQuestion]:
+    """
+    Up to ``count`` four-option questions from ``text``.
+
+    Every question asks for a key term (definitions the other way round), and
+    other key terms of the text are the distractors.
+    """
+    sentence_list = [s for s in sentences(text) if _MIN_WORDS <= len(s.split()) <= _MAX_WORDS]
+    terms = [term for term, _ in key_terms(sentence_list, limit=60)]
+    questions: List[MultipleChoiceQuestion] = []
+    for _, _, term, question in _cards(text, count):
+        distractors = _distractors(term, question, terms)
+        if len(distractors) < 3:
+            continue
+        options = [term] + distractors
+        random.Random(question).shuffle(options)  # the same order for the same question
+        questions.append(MultipleChoiceQuestion(len(questions) + 1, question, options, term, LOCAL))
+    return questions
+
+
+def _distractors(answer: str, question: str, terms: List[str]) -> List[str]:
+    """Other key terms, of about the answer's length, that do not overlap it or appear in the question."""
+    answer_lower = answer.lower()
+    question_lower = question.lower()
+    length = len(answer.split())
+    picked: List[str] = []
+    for term in sorted(terms, key=lambda term: abs(len(term.split()) - length)):
+        if term in answer_lower or answer_lower in term or term in question_lower:
+            continue
+        if any(term in other or other in term for other in picked):
+            continue
+        picked.append(term[:1].upper() + term[1:] if answer[:1].isupper() else term)
+        if len(picked) == 3:
+            break
+    return picked
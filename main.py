@@ -15,76 +15,118 @@ Dependencies (requirements.txt):
   uvicorn[standard]
   motor                 # async MongoDB driver
   pydantic              # FastAPI uses it internally
-  google-generativeai   # Gemini client
+  google-genai          # Gemini client (imported lazily, see llm.py)
   pdfplumber            # PDF text extraction
   python-docx           # DOCX text extraction
+  numpy                 # semantic index / near-duplicate filter
+  orjson, msgpack       # fast JSON / MessagePack responses (serialization.py)
 """
 
 import os
 import json
 from dotenv import load_dotenv
-import tempfile
+load_dotenv()
 from datetime import datetime, date, timedelta
-from typing import List, Optional
+from typing import Dict, List, Optional
 import re
-import pdfplumber
-import io
-import docx
-# import google.generativeai as genai
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+import zipfile
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 from bson import ObjectId
-from google import genai
 from fastapi import Body
 from enum import Enum
-import gridfs
-from notes_quiz_generator import create_notes_quiz_endpoint
-load_dotenv()
-
-
-try:
-    import docx  # type: ignore
-except ImportError:
-    docx = None  # will raise later if user uploads DOCX without python-docx installed
+import notes_quiz
+import llm
+import shared_state
+import deadlines
+from serialization import negotiated_response
+import asyncio
+from spaced_repetition import schedule_reviews
+from models import Attempt, CardResponse
+import review_digest
+import bulk_import
+import uploads
+import page_extraction
+import document_model
+import syllabus_tables
+import syllabus_context
+import roadmap_topics
+import pre_quiz
+import answer_grading
+import quiz_quality
+import attempt_buffer
+import review_session
+import delta_sync
+import quiz_events
+from semantic_index import (
+    get_course_index,
+    save_course_index,
+    drop_course_index,
+    chunk_note,
+)
 
 # ---------------------------------------------------------------------------
 # Environment & third‑party setup
 # ---------------------------------------------------------------------------
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 # Use MongoDB Atlas
 MONGODB_URI = os.getenv("MONGO_URI")
 
-if not GOOGLE_API_KEY:
-    raise RuntimeError("Set GOOGLE_API_KEY environment variable")
-
-if not MONGODB_URI:
-    raise RuntimeError("Set MONGO_URI environment variable")
-
-# Create a single Gemini client instance (new style)
-GENAI_CLIENT = genai.Client(api_key=GOOGLE_API_KEY)
+# The Gemini client is created lazily on first use and shared app-wide (see llm.py);
+# GOOGLE_API_KEY is checked then rather than at import time.
 
 # Initialize MongoDB variables
 mongo_client = None
 db = None
 fs = None
+digest_task = None
+readiness_task = None
+prefetch_task = None
+flush_task = None
+events_task = None
+
+# Readiness state, refreshed by check_readiness()
+READINESS_TTL_SECONDS = 5
+readiness = {"ready": False, "checked_at": None, "error": "not checked yet", "indexes": False}
+
+# Time budgets (seconds) of the routes that call Gemini; see deadlines.py
+COURSE_DEADLINE = float(os.getenv("COURSE_DEADLINE_SECONDS", "120"))
+PRE_QUIZ_DEADLINE = float(os.getenv("PRE_QUIZ_DEADLINE_SECONDS", "180"))
+NOTES_DEADLINE = float(os.getenv("NOTES_DEADLINE_SECONDS", "120"))
+NOTES_QUIZ_DEADLINE = float(os.getenv("NOTES_QUIZ_DEADLINE_SECONDS", "90"))
+IMAGE_DEADLINE = float(os.getenv("IMAGE_DEADLINE_SECONDS", "60"))
 
 # ---------------------------------------------------------------------------
 # Pydantic models (for request / response bodies)
 # ---------------------------------------------------------------------------
 class RoadmapEntry(BaseModel):
+    topic_number: Optional[int] = None  # 1-based position in the roadmap
     date: Optional[str] = None  # ISO date or week number
     topic: str
     preQuizPrompt: Optional[str] = None
     assignment: Optional[str] = None
 
 
+class RoadmapEntryUpdate(BaseModel):
+    date: Optional[str] = None
+    topic: Optional[str] = None
+    preQuizPrompt: Optional[str] = None
+    assignment: Optional[str] = None
+
+
 class CourseCreateResponse(BaseModel):
     id: str = Field(..., alias="_id")
     roadmap: List[RoadmapEntry]
 
 
+class SyncRequest(BaseModel):
+    course_ids: List[str] = []
+    marks: Dict[str, Optional[str]] = {}  # per collection, as returned by the previous sync
+
+
 # ---------------------------------------------------------------------------
 # FastAPI app
 # ---------------------------------------------------------------------------
@@ -97,90 +139,153 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    """
+    Refuse oversized bodies before multipart parsing spools them to disk. Bulk
+    imports get their own, higher cap; their files are still capped one by one.
+    """
+    limit = uploads.MAX_BULK_REQUEST_BYTES if request.url.path.rstrip("/") == "/courses/bulk" \
+        else uploads.MAX_REQUEST_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        return JSONResponse(status_code=413, content={
+            "detail": f"Request body larger than {limit // uploads.MB} MB"
+        })
+    return await call_next(request)
+
+# Outermost, so a disconnect cancels the handler wherever it is
+app.add_middleware(deadlines.CancelOnDisconnect)
+
 class RatingEnum(str, Enum):
     easy = "easy"
     medium = "medium"
     hard = "hard"
     dont_know = "dont_know"
 
-rating_schedule = {
-    "easy": 7,
-    "medium": 3,
-    "hard": 1,
-    "dont_know": 1
-}
 
 # ---------------------------------------------------------------------------
 # Startup and shutdown events
 # ---------------------------------------------------------------------------
 @app.on_event("startup")
 async def startup_db_client():
-    global mongo_client, db, fs
-    
-    # Connect to MongoDB Atlas
-    try:
-        print(f"Attempting to connect to MongoDB Atlas at: {MONGODB_URI}")
-        # Disable SSL certificate verification for MongoDB Atlas
-        mongo_client = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=5000, tlsAllowInvalidCertificates=True)
-        # Test the connection
-        print("Testing MongoDB connection...")
-        server_info = await mongo_client.server_info()
-        print(f"MongoDB server info: {server_info}")
-        db = mongo_client["deep_learner"]
-        # Initialize AsyncIOMotorGridFSBucket instead of synchronous GridFSBucket
-        fs = AsyncIOMotorGridFSBucket(db)
-        print("Successfully connected to MongoDB Atlas")
-        
-        # Test database access by listing collections
-        collections = await db.list_collection_names()
-        print(f"Available collections: {collections}")
-    except Exception as e:
-        print(f"Failed to connect to MongoDB Atlas: {e}")
-        raise RuntimeError(f"Failed to connect to MongoDB Atlas: {e}")
+    global mongo_client, db, fs, digest_task, readiness_task, prefetch_task, flush_task, events_task
+
+    if not MONGODB_URI:
+        raise RuntimeError("Set MONGO_URI environment variable")
+
+    # Motor connects lazily, so creating the client does not wait on Atlas.
+    # Connectivity is checked in the background and reported by /health/ready.
+    # Disable SSL certificate verification for MongoDB Atlas
+    mongo_client = AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=5000, tlsAllowInvalidCertificates=True)
+    db = mongo_client["deep_learner"]
+    # Initialize AsyncIOMotorGridFSBucket instead of synchronous GridFSBucket
+    fs = AsyncIOMotorGridFSBucket(db)
+    readiness_task = asyncio.create_task(check_readiness())
+
+    # Precompute review digests at every UTC day rollover
+    digest_task = asyncio.create_task(review_digest.run_digest_scheduler(lambda: db))
+
+    # Generate quizzes of upcoming topics during off-peak hours
+    prefetch_task = asyncio.create_task(pre_quiz.run_prefetch_scheduler(lambda: db))
+
+    # Move buffered quiz attempts into `attempts`
+    if attempt_buffer.ATTEMPT_WRITE_BEHIND:
+        flush_task = asyncio.create_task(attempt_buffer.run_flusher(lambda: db))
+
+    # Push finished quizzes to subscribed clients (change streams, or polling without a replica set)
+    events_task = asyncio.create_task(quiz_events.hub.run(lambda: db))
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     global mongo_client
+    for task in (digest_task, readiness_task, prefetch_task, flush_task, events_task):
+        if task:
+            task.cancel()
+    if attempt_buffer.ATTEMPT_WRITE_BEHIND:
+        try:
+            await attempt_buffer.drain(db)
+        except Exception as e:
+            print(f"Could not flush buffered attempts at shutdown; they stay in the log: {e}")
+    bulk_import.shutdown_process_pool()
     if mongo_client:
         mongo_client.close()
 
+
+async def check_readiness(timeout: float = 5.0) -> dict:
+    """Ping MongoDB and, on the first success, create the indexes the app relies on."""
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=timeout)
+        if not readiness["indexes"]:
+            await review_digest.ensure_indexes(db)
+            await page_extraction.ensure_indexes(db)
+            await roadmap_topics.ensure_indexes(db)
+            await pre_quiz.ensure_indexes(db)
+            await delta_sync.ensure_indexes(db)
+            await quiz_events.ensure_indexes(db)
+            readiness["indexes"] = True
+            print("Connected to MongoDB Atlas and ensured indexes")
+        readiness.update(ready=True, error=None)
+    except Exception as e:
+        readiness.update(ready=False, error=str(e) or type(e).__name__)
+        print(f"MongoDB readiness check failed: {readiness['error']}")
+    readiness["checked_at"] = datetime.utcnow()
+    return readiness
+
+
+@app.get("/health/live", summary="Liveness probe")
+async def health_live():
+    """The process is up and serving requests. Never touches MongoDB or Gemini."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", summary="Readiness probe")
+async def health_ready():
+    """Whether MongoDB is reachable. Re-checks at most every few seconds with a short timeout."""
+    checked_at = readiness["checked_at"]
+    stale = checked_at is None or (datetime.utcnow() - checked_at).total_seconds() > READINESS_TTL_SECONDS
+    if stale and db is not None and (readiness_task is None or readiness_task.done()):
+        await check_readiness(timeout=1.0)
+
+    body = {
+        "status": "ready" if readiness["ready"] else "not_ready",
+        "checked_at": readiness["checked_at"],
+        "error": readiness["error"],
+    }
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content=jsonable_encoder(body))
+    return body
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def extract_text_from_file(path: str, suffix: str) -> str:
-    """Return plaintext from a PDF or DOCX syllabus file."""
-
-    if suffix == ".pdf":
-        with pdfplumber.open(path) as pdf:
-            return "\n".join(page.extract_text() or "" for page in pdf.pages)
-
-    if suffix == ".docx":
-        if docx is None:
-            raise RuntimeError("python-docx not installed; cannot parse DOCX files")
-        document = docx.Document(path)
-        return "\n".join(p.text for p in document.paragraphs)
-
-    raise ValueError("Unsupported file type")
-
-
-def generate_roadmap(syllabus_text: str):
-    """Call Gemini (gemini‑2.0‑flash) to convert raw syllabus into a JSON roadmap."""
-
-    
+def generate_roadmap(syllabus_text: Optional[str], schedule: Optional[List[dict]] = None,
+                     context: Optional[syllabus_context.SyllabusContext] = None):
+    """
+    Call Gemini (gemini‑2.0‑flash) to convert raw syllabus into a JSON roadmap.
+
+    With a ``schedule`` read from the syllabus's table (syllabus_tables.py) the
+    roadmap is built from its rows, and Gemini only writes the preQuizPrompts.
+    With a ``context`` (syllabus_context.py) Gemini reads the PDF itself, from
+    its cached context, instead of ``syllabus_text``.
+    """
+    if schedule:
+        print(f"Building roadmap from the schedule table ({len(schedule)} topics)")
+        return syllabus_tables.roadmap_from_schedule(schedule, syllabus_text)
+
+    source = "the attached semester syllabus" if context else "the following semester syllabus"
     prompt = (
-        "You are an expert academic planner. Given the following semester syllabus, "
+        f"You are an expert academic planner. Given {source}, "
         "produce a valid JSON array where each element has: `date` (YYYY-MM-DD), "
         "has element `topic` and `preQuizPrompt` which is detailed 2 sentence of what the topic is about and `assignment` due on that day if theres any pure json array please with no other info starts with { and ends with }"
-        f"\n\nSyllabus:\n{syllabus_text}"
         )
+    if context is None:
+        prompt += f"\n\nSyllabus:\n{syllabus_text}"
 
     try:
         print(f"Sending prompt to Gemini API: {prompt[:200]}...")
-        response = GENAI_CLIENT.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-        )
+        response = syllabus_context.generate(context, prompt) if context else llm.generate_content(prompt)
         
         # Log the full response
         print(f"Gemini API Response: {response}")
@@ -220,36 +325,52 @@ def generate_roadmap(syllabus_text: str):
 # Routes
 # ---------------------------------------------------------------------------
 @app.post("/courses/", response_model=CourseCreateResponse, summary="Create a course and upload syllabus")
+@deadlines.budget(COURSE_DEADLINE)
 async def create_course(name: str, syllabus: UploadFile = File(...)):
     """Accept a PDF or DOCX syllabus, extract text, generate roadmap, persist in MongoDB."""
 
-    suffix = os.path.splitext(syllabus.filename)[-1].lower()
-    if suffix not in {".pdf", ".docx"}:
-        raise HTTPException(status_code=400, detail="Only PDF or DOCX files are supported")
-
-    # Save to a temporary file to allow library parsing
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(await syllabus.read())
-        tmp_path = tmp.name
+    # Stream to a temporary file to allow library parsing; the type is checked
+    # by magic bytes and the size cap is enforced while reading
+    try:
+        upload = await uploads.stream_to_tempfile(syllabus, uploads.SYLLABUS_KINDS)
+    except uploads.UploadRejected as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
 
-    # 1️ Extract text
+    # 1️ Extract text, or in native mode hand the PDF to Gemini as a cached document
+    syllabus_text, schedule, context = None, None, None
     try:
-        syllabus_text = extract_text_from_file(tmp_path, suffix)
+        if syllabus_context.is_native(upload.kind):
+            data = await asyncio.to_thread(syllabus_context.read_upload, upload.path)
+            context = await syllabus_context.ensure(db, upload.sha256, data)
+        else:
+            # Pages seen before are reused; scanned pages are transcribed (see page_extraction.py)
+            syllabus_text = await page_extraction.extract_upload_text(
+                db, fs, upload, tables_on=syllabus_tables.is_schedule_page
+            )
+            # A schedule table, if there is one, gives the roadmap without asking Gemini for it
+            schedule = await syllabus_tables.detect(db, upload.path, upload.kind, upload.sha256, syllabus_text)
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Failed to parse syllabus: {err}")
+    finally:
+        os.remove(upload.path)
 
-    # 2️ Generate roadmap via Gemini
+    # 2️ Generate roadmap (via Gemini, or from the schedule table)
     try:
-        roadmap_json = generate_roadmap(syllabus_text)
+        roadmap_json = await asyncio.to_thread(generate_roadmap, syllabus_text, schedule, context)
     except ValueError as err:
         raise HTTPException(status_code=500, detail=str(err))
 
-    # 3️ Persist to MongoDB
+    # 3️ Persist to MongoDB; the roadmap goes to roadmap_topics, one document per topic
+    now = datetime.utcnow()
     course_doc = {
         "name": name,
-        "created_at": datetime.utcnow(),
-        "roadmap": roadmap_json,
+        "created_at": now,
+        "updated_at": now,
+        "topic_count": len(roadmap_json),
     }
+    if context is not None:
+        # Kept so the cached context can be recreated for later quiz calls
+        course_doc["syllabus"] = await syllabus_context.store(fs, upload, data)
     
     try:
         # Insert the document
@@ -257,6 +378,7 @@ async def create_course(name: str, syllabus: UploadFile = File(...)):
         result = await db.courses.insert_one(course_doc)
         course_id = str(result.inserted_id)
         print(f"Successfully inserted course with ID: {course_id}")
+        topics = await roadmap_topics.store(db, result.inserted_id, roadmap_json)
         
         # Verify the document was inserted
         inserted_doc = await db.courses.find_one({"_id": result.inserted_id})
@@ -271,123 +393,197 @@ async def create_course(name: str, syllabus: UploadFile = File(...)):
     # Create response with proper _id field
     response_data = {
         "_id": course_id,
-        "roadmap": roadmap_json
+        "roadmap": [roadmap_topics.entry(topic) for topic in topics]
     }
     
     return response_data
 
 
+@app.post("/courses/bulk", summary="Create many courses from a batch of syllabi (PDF, DOCX or zip)")
+async def bulk_create_courses(files: List[UploadFile] = File(...)):
+    """Start a bulk import job and stream per-file progress as newline-delimited JSON."""
+    try:
+        # Each file is streamed into GridFS as it is read, never held in memory whole
+        job = await bulk_import.create_job(db, fs, files)
+    except uploads.UploadRejected as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+    except zipfile.BadZipFile as err:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {err}")
+    except Exception as err:
+        print(f"Error creating bulk import job: {err}")
+        raise HTTPException(status_code=500, detail=f"Failed to create import job: {err}")
+
+    if not job["items"]:
+        raise HTTPException(status_code=400, detail="No PDF or DOCX syllabi found in the upload")
+
+    print(f"Created bulk import job {job['_id']} with {len(job['items'])} files")
+    return StreamingResponse(
+        bulk_import.ndjson(bulk_import.run_job(db, fs, job["_id"], generate_roadmap)),
+        media_type="application/x-ndjson",
+        headers={"X-Import-Job-Id": str(job["_id"])}
+    )
+
+
+@app.get("/courses/bulk/{job_id}", summary="Get the state of a bulk import job")
+async def get_bulk_import_job(job_id: str):
+    try:
+        obj_id = ObjectId(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid job ID format: {e}")
+
+    job = await db.import_jobs.find_one({"_id": obj_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return bulk_import.job_summary(job)
+
+
+@app.post("/courses/bulk/{job_id}/resume", summary="Resume the unfinished files of a bulk import job")
+async def resume_bulk_import_job(job_id: str):
+    try:
+        obj_id = ObjectId(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid job ID format: {e}")
+
+    job = await db.import_jobs.find_one({"_id": obj_id}, {"_id": 1})
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+
+    return StreamingResponse(
+        bulk_import.ndjson(bulk_import.run_job(db, fs, obj_id, generate_roadmap)),
+        media_type="application/x-ndjson",
+        headers={"X-Import-Job-Id": job_id}
+    )
+
+
 @app.get(
     "/courses/{course_id}/roadmap",
     response_model=List[RoadmapEntry],
     summary="Fetch roadmap for a course by ID",
 )
-async def get_roadmap(course_id: str):
+async def get_roadmap(
+    course_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    days: Optional[int] = None,
+):
+    """
+    All roadmap topics, or only those dated from `start` to `end` (inclusive).
+    `days=7` means today and the six days after. Topics dated by week number
+    rather than an ISO date are only returned without a window.
+    """
     try:
         obj_id = ObjectId(course_id)
-        course = await db.courses.find_one({"_id": obj_id}, {"_id": 0, "roadmap": 1})
-        if not course:
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid course ID")
+
+    if days is not None:
+        if days < 1:
+            raise HTTPException(status_code=400, detail="days must be at least 1")
+        start, end = date.today(), date.today() + timedelta(days=days - 1)
+
+    try:
+        topics = await roadmap_topics.load(db, obj_id, start=start, end=end)
+        if not topics and not await db.courses.find_one({"_id": obj_id}, {"_id": 1}):
             raise HTTPException(status_code=404, detail="Course not found")
-        return course["roadmap"]
+        return [roadmap_topics.entry(topic) for topic in topics]
+    except HTTPException:
+        raise
     except Exception as e:
-        if "Invalid course ID" in str(e):
-            raise HTTPException(status_code=400, detail="Invalid course ID")
         raise HTTPException(status_code=500, detail=f"Error retrieving roadmap: {str(e)}")
 
 
-@app.post("/courses/{course_id}/quizzes/pre", summary="Generate flashcard-style pre-lecture quiz for all roadmap topics")
-async def generate_pre_quiz(course_id: str):
+@app.patch(
+    "/courses/{course_id}/roadmap/{topic_number}",
+    response_model=RoadmapEntry,
+    summary="Update one roadmap topic",
+)
+async def update_roadmap_topic(course_id: str, topic_number: int, update: RoadmapEntryUpdate):
+    """Change some fields of a topic. A new topic or preQuizPrompt makes its pre-lecture quiz due for regeneration."""
     try:
         obj_id = ObjectId(course_id)
-        course = await db.courses.find_one({"_id": obj_id})
-        if not course:
-            raise HTTPException(status_code=404, detail="Course not found")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid course ID")
 
-        roadmap = course.get("roadmap", [])
-        if not roadmap:
-            raise HTTPException(status_code=404, detail="No roadmap entries found")
+    changes = update.model_dump(exclude_unset=True)
+    if "topic" in changes and not (changes["topic"] or "").strip():
+        raise HTTPException(status_code=400, detail="topic must not be empty")
 
-        all_quizzes = []
+    try:
+        topic = await roadmap_topics.patch(db, obj_id, topic_number, changes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating roadmap topic: {str(e)}")
+    if topic is None:
+        raise HTTPException(status_code=404, detail="Roadmap topic not found")
+    return roadmap_topics.entry(topic)
 
-        for entry in roadmap:
-            topic = entry.get("topic")
-            prompt = entry.get("preQuizPrompt")
 
-            if not topic or not prompt:
-                continue  # skip entries without quiz input data
+@app.post("/courses/{course_id}/quizzes/pre", summary="Generate flashcard-style pre-lecture quizzes for roadmap topics")
+@deadlines.budget(PRE_QUIZ_DEADLINE)
+async def generate_pre_quiz(
+    course_id: str,
+    topics: Optional[List[int]] = Query(None, description="Topic numbers; all topics if omitted"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    days: Optional[int] = None,
+    force: bool = False,
+):
+    """
+    Generate quizzes for the selected topics: `topics=1&topics=2`, a date window
+    (`start`/`end`, or `days=7` for today and the six days after), or both.
+    Topics whose quiz is up to date are returned as stored unless `force` is set.
+    """
+    try:
+        obj_id = ObjectId(course_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid course ID format: {e}")
 
-            quiz_prompt = f"""
-Create 10 flashcard-style questions to help a student study this topic:
+    if days is not None:
+        if days < 1:
+            raise HTTPException(status_code=400, detail="days must be at least 1")
+        start, end = date.today(), date.today() + timedelta(days=days - 1)
 
-Topic: {topic}
-Prompt: {prompt}
+    # Concurrent requests for the same course, on any worker, share one generation
+    while True:
+        async with shared_state.in_flight(f"pre_quiz:{course_id}") as leader:
+            if leader:
+                return await _generate_pre_quiz(obj_id, topics, start, end, force)
 
-Each question should be a simple question or recall prompt, and each should have a clear answer.
-Return ONLY valid JSON in this format:
-[
-  {{
-    "question": "...",
-    "answer": "..."
-  }},
-  ...
-]
-"""
+        # The other request may have covered other topics (or been the prefetch); take the
+        # claim again and generate what is still missing, the rest comes from the store
+        print(f"Pre-quizzes for course {course_id} were generated concurrently, checking for missing topics")
+        force = False
 
-            try:
-                response = GENAI_CLIENT.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=quiz_prompt,
-                )
-                raw_text = getattr(response, "text", None) or getattr(response, "content", "")
-                stripped = raw_text.strip()
-
-                if stripped.startswith("```"):
-                    stripped = re.sub(r"^```[a-zA-Z]*\n", "", stripped)
-                    stripped = re.sub(r"```$", "", stripped)
-                    stripped = stripped.strip()
-
-                quiz_data = json.loads(stripped)
-
-                # Add index from 1 to 10
-                for i, item in enumerate(quiz_data):
-                    item["index"] = i + 1
-
-                topic_number = len(all_quizzes) + 1
-                await db.quizzes.insert_one({
-                    "course_id": obj_id,
-                    "topic": topic,
-                    "topic_number": topic_number,
-                    "quiz": quiz_data,
-                    "created_at": datetime.utcnow()
-                })
-
-                all_quizzes.append({
-                    "topic_number": topic_number,
-                    "quiz": quiz_data
-                })
 
-            except Exception as e:
-                all_quizzes.append({
-                    "topic": topic,
-                    "error": f"Quiz generation failed: {e}"
-                })
+async def _generate_pre_quiz(obj_id: ObjectId, topics: Optional[List[int]], start: Optional[date],
+                             end: Optional[date], force: bool):
+    try:
+        course = await db.courses.find_one({"_id": obj_id}, {"_id": 1, "syllabus": 1})
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
 
-        return {"quizzes": all_quizzes}
+        entries = await pre_quiz.select_topics(db, obj_id, topics, start, end)
+        if not entries and not (topics or start or end):
+            raise HTTPException(status_code=404, detail="No roadmap entries found")
 
+        # Natively ingested syllabi ground every topic's questions through one cached context
+        context = None
+        if force or not all(roadmap_topics.quiz_is_current(entry) for entry in entries):
+            context = await syllabus_context.for_course(db, fs, course)
+
+        return {"quizzes": await pre_quiz.generate(db, obj_id, entries, force=force, context=context, fs=fs)}
+
+    except HTTPException:
+        raise
     except Exception as err:
         raise HTTPException(status_code=500, detail=f"Internal error: {err}")
 
 @app.get("/courses/{course_id}/quizzes", summary="Fetch all saved quizzes for a course")
-async def get_quizzes(course_id: str):
+async def get_quizzes(course_id: str, request: Request):
     try:
         obj_id = ObjectId(course_id)
-        quizzes_cursor = db.quizzes.find({"course_id": obj_id})
-        quizzes = []
-        async for quiz in quizzes_cursor:
-            quiz["_id"] = str(quiz["_id"])
-            quiz["course_id"] = str(quiz["course_id"])
-            quizzes.append(quiz)
-        return {"quizzes": quizzes}
+        # ObjectIds and datetimes are converted by the encoder (see serialization.py)
+        quizzes = await db.quizzes.find({"course_id": obj_id}).to_list(length=None)
+        return negotiated_response(request, {"quizzes": quizzes})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve quizzes: {e}")
 
@@ -401,70 +597,125 @@ async def submit_quiz_attempt(
 ):
     try:
         obj_id = ObjectId(quiz_id)
-        quiz = await db.quizzes.find_one({"_id": obj_id})
-        if not quiz:
+        exists, course_id = await attempt_buffer.known_quiz(db, obj_id)
+        if not exists:
             raise HTTPException(status_code=404, detail="Quiz not found")
 
-        enriched_responses = []
-        for i, r in enumerate(responses):
-            rating = r.get("user_rating")
-            delay_days = rating_schedule.get(rating, 1)
-            next_due_date = datetime.utcnow().date() + timedelta(days=delay_days)
-
-            enriched_responses.append({
-                "question_number": i + 1,
-                "question": r.get("question"),
-                "answer": r.get("answer"),
-                "user_rating": rating,
-                "next_due_date": str(next_due_date)
-            })
-
-        attempt_doc = {
-            "quiz_id": obj_id,
-            "user_id": user_id,
-            "topic_number": topic_number,
-            "responses": enriched_responses,
-            "taken_at": datetime.utcnow()
-        }
+        # Typed answers are graded against the stored cards; a self-rating, if given, still wins
+        grades = await _grade_typed_answers(obj_id, responses)
+        ratings = [
+            r.get("user_rating") or (grades[i].rating if i in grades else None)
+            for i, r in enumerate(responses)
+        ]
+
+        attempt = Attempt(
+            id=None,
+            quiz_id=obj_id,
+            user_id=user_id,
+            topic_number=topic_number,
+            responses=[
+                CardResponse(
+                    question_number=i + 1,
+                    question=r.get("question"),
+                    answer=r.get("answer"),
+                    user_rating=ratings[i],
+                    user_answer=r.get("user_answer"),
+                    score=grades[i].score if i in grades else None,
+                    graded_by=grades[i].graded_by if i in grades else None
+                )
+                for i, r in enumerate(responses)
+            ],
+            course_id=course_id,
+            taken_at=datetime.utcnow()
+        )
+
+        # Acknowledged once durably appended; scheduled from the previous attempt and stored
+        # in `attempts` by the flusher (attempt_buffer.py)
+        attempt_id = await attempt_buffer.save(db, attempt)
 
-        result = await db.attempts.insert_one(attempt_doc)
-        return {"status": "success", "attempt_id": str(result.inserted_id)}
+        response_data = {"status": "success", "attempt_id": str(attempt_id)}
+        if grades:
+            response_data["grades"] = [
+                {"question_number": g.question_number, "score": g.score,
+                 "rating": ratings[i], "graded_by": g.graded_by}
+                for i, g in sorted(grades.items())
+            ]
+        return response_data
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save attempt: {e}")
 
 
+async def _grade_typed_answers(quiz_id: ObjectId, responses: List[dict]) -> dict:
+    """Grades of the responses with a typed `user_answer`, by response index (see answer_grading.py)."""
+    typed = [i for i, r in enumerate(responses) if isinstance(r.get("user_answer"), str)]
+    if not typed:
+        return {}
+    quiz = await db.quizzes.find_one({"_id": quiz_id}, {"quiz": 1}) or {}
+    cards = quiz.get("quiz") or []
+
+    def expected(i: int) -> Optional[str]:
+        # The stored card is the reference; the client's copy only if the card is missing
+        return cards[i].get("answer") if i < len(cards) else responses[i].get("answer")
+
+    def question(i: int) -> Optional[str]:
+        return cards[i].get("question") if i < len(cards) else responses[i].get("question")
+
+    graded = await asyncio.to_thread(
+        answer_grading.grade,
+        [question(i) for i in typed],
+        [expected(i) for i in typed],
+        [responses[i]["user_answer"] for i in typed],
+    )
+    for g, i in zip(graded, typed):
+        g.question_number = i + 1
+    return dict(zip(typed, graded))
+
+
 # ────────────────────────────────────────────────────
 # Fetch Upcoming Due Questions for a User
 # ────────────────────────────────────────────────────
 
 @app.get("/users/{user_id}/schedule", summary="Get upcoming questions due for review")
-async def get_due_schedule(user_id: str):
+async def get_due_schedule(user_id: str, request: Request):
     try:
-        today = datetime.utcnow().date()
-        upcoming = []
-
-        cursor = db.attempts.find({"user_id": user_id})
-        async for attempt in cursor:
-            for resp in attempt.get("responses", []):
-                due_date = datetime.strptime(resp["next_due_date"], "%Y-%m-%d").date()
-                if due_date <= today:
-                    upcoming.append({
-                        "attempt_id": str(attempt["_id"]),
-                        "quiz_id": str(attempt["quiz_id"]),
-                        "topic_number": attempt["topic_number"],
-                        "question_number": resp.get("question_number"),
-                        "question": resp["question"],
-                        "answer": resp["answer"],
-                        "due_date": resp["next_due_date"]
-                    })
-
-        return {"due_questions": upcoming}
+        # Served from the precomputed digest; see review_digest.py
+        digest = await review_digest.get_digest(db, user_id)
+        return negotiated_response(request, {
+            "due_questions": digest["cards"],
+            "counts": digest["counts"],
+            "total": digest["total"],
+            "day": digest["day"]
+        })
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch schedule: {e}")
 
 
+@app.websocket("/users/{user_id}/review")
+async def review_session_socket(websocket: WebSocket, user_id: str):
+    """Stream due cards and take ratings over one connection (protocol in review_session.py)."""
+    await review_session.ReviewSession(db, websocket, user_id).run()
+
+
+@app.post("/users/{user_id}/sync", summary="Get what changed in a user's courses and review queue since the last sync")
+async def sync_changes(user_id: str, sync: SyncRequest, request: Request):
+    """
+    Courses, roadmap topics, quizzes and due cards written after the given
+    per-collection marks, with deletions, and the marks for the next sync
+    (see delta_sync.py). Send no marks for a full download.
+    """
+    try:
+        changes = await delta_sync.changes(db, user_id, sync.course_ids, sync.marks)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to sync: {e}")
+    return negotiated_response(request, changes)
+
+
 # ────────────────────────────────────────────────────
 # PATCH: Update user rating for a specific question in an attempt
 # ────────────────────────────────────────────────────
@@ -478,30 +729,48 @@ async def update_question_rating(
 ):
     try:
         obj_id = ObjectId(attempt_id)
-        attempt = await db.attempts.find_one({"_id": obj_id})
-        if not attempt:
+        doc = await db.attempts.find_one({"_id": obj_id})
+        if not doc and await attempt_buffer.is_pending(obj_id):
+            # Submitted moments ago and not flushed yet, here or by another worker
+            if not await attempt_buffer.wait_until_stored(db, obj_id):
+                raise HTTPException(status_code=503, detail="Attempt is still being stored; try again shortly")
+            doc = await db.attempts.find_one({"_id": obj_id})
+        if not doc:
             raise HTTPException(status_code=404, detail="Attempt not found")
 
-        updated = False
-        for response in attempt["responses"]:
-            if response.get("question_number") == question_number:
-                delay_days = rating_schedule.get(new_rating, 1)
-                next_due = datetime.utcnow().date() + timedelta(days=delay_days)
-                response["user_rating"] = new_rating
-                response["next_due_date"] = str(next_due)
-                updated = True
-                break
-
-        if not updated:
+        attempt = Attempt.from_bson(doc)
+        before = Attempt.from_bson(doc)
+        response = next((r for r in attempt.responses if r.question_number == question_number), None)
+        if response is None:
             raise HTTPException(status_code=404, detail="Question not found in this attempt")
 
-        await db.attempts.update_one({"_id": obj_id}, {"$set": {"responses": attempt["responses"]}})
-        return {"status": "updated", "question_number": question_number, "new_due": str(next_due)}
+        digest = await db.review_digests.find_one({"_id": attempt.user_id}, {"upcoming": 1})
+        card = schedule_reviews([response.state()], [new_rating.value],
+                                load=review_digest.load_of(digest))[0]
+        for name, value in card.items():
+            setattr(response, name, value)
+        response.user_rating = new_rating.value
+        next_due = response.next_due_date
+
+        await db.attempts.update_one(
+            {"_id": obj_id},
+            {"$set": {"responses": [r.to_bson() for r in attempt.responses]}}
+        )
+
+        try:
+            await review_digest.refresh_for_attempt(db, attempt, before)
+        except Exception as e:
+            print(f"Failed to refresh review digest for attempt {attempt_id}: {e}")
+
+        return {"status": "updated", "question_number": question_number, "new_due": next_due}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update rating: {e}")
 
 @app.post("/courses/{course_id}/notes", summary="Upload notes for a specific topic")
+@deadlines.budget(NOTES_DEADLINE)
 async def upload_notes(
     course_id: str,
     title: str = Form(...),
@@ -514,7 +783,7 @@ async def upload_notes(
         # Validate the course ID
         try:
             obj_id = ObjectId(course_id)
-            course = await db.courses.find_one({"_id": obj_id})
+            course = await db.courses.find_one({"_id": obj_id}, {"_id": 1})
             if not course:
                 raise HTTPException(status_code=404, detail="Course not found")
         except Exception as e:
@@ -540,101 +809,56 @@ async def upload_notes(
         extracted_text = ""
         file_id = None
         if file:
-            # Read file data
-            file_contents = await file.read()
-            file_type = file.content_type
-            
-            # Validate file type
-            if not file_type or not (file_type == "application/pdf" or 
-                                    file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or
-                                    file_type == "application/msword" or
-                                    file_type == "text/plain"):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid file type: {file_type}. Only PDF, DOCX, DOC, and TXT files are allowed."
-                )
-            
-            # Extract text from the file based on its type
-            if file_type == "application/pdf":
-                try:
-                    with io.BytesIO(file_contents) as pdf_file:
-                        with pdfplumber.open(pdf_file) as pdf:
-                            extracted_text = "\n".join([page.extract_text() or "" for page in pdf.pages])
-                            extracted_text = re.sub(r'\s+', ' ', extracted_text).strip()
-                except Exception as e:
-                    print(f"Error extracting text from PDF: {e}")
-                    raise HTTPException(status_code=400, detail=f"Failed to extract text from PDF: {e}")
-            
-            elif file_type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]:
-                try:
-                    with io.BytesIO(file_contents) as docx_file:
-                        doc = docx.Document(docx_file)
-                        extracted_text = "\n".join([para.text for para in doc.paragraphs])
-                        extracted_text = re.sub(r'\s+', ' ', extracted_text).strip()
-                except Exception as e:
-                    print(f"Error extracting text from DOCX: {e}")
-                    raise HTTPException(status_code=400, detail=f"Failed to extract text from DOCX: {e}")
-            
-            elif file_type == "text/plain":
-                extracted_text = file_contents.decode('utf-8', errors='ignore')
-                extracted_text = re.sub(r'\s+', ' ', extracted_text).strip()
-            
-            # Save file to GridFS for reference
+            # Stream the file into GridFS; the type is checked by magic bytes
+            # (PDF, DOCX or plain text) and the size cap is enforced while reading
             metadata = {
-                "content_type": file_type,
                 "filename": file.filename,
                 "course_id": str(obj_id),
                 "topic_number": topic_number
             }
+            try:
+                stored = await uploads.stream_to_gridfs(fs, file, uploads.DOCUMENT_KINDS, metadata=metadata)
+            except uploads.UploadRejected as err:
+                raise HTTPException(status_code=err.status_code, detail=str(err))
+            file_id = stored.file_id
             
-            # Use the async upload_from_stream method
-            file_id = await fs.upload_from_stream(
-                file.filename,
-                file_contents,
-                metadata=metadata
-            )
+            # Extract the text of the stored file with its pages, headings, paragraphs and lists
+            try:
+                pages = await page_extraction.extract_upload_pages(db, fs, stored)
+                document = document_model.Document.from_pages(pages)
+                extracted_text = document.text
+            except Exception as e:
+                print(f"Error extracting text from {stored.kind.upper()}: {e}")
+                await fs.delete(file_id)
+                raise HTTPException(status_code=400, detail=f"Failed to extract text from {stored.kind.upper()}: {e}")
             
             # Add file reference to note
             note["file_id"] = str(file_id)
             
-            # If extracted text is available, append it to content or use it as content
+            # If extracted text is available, append it to content or use it as content;
+            # the structure records where each page, heading and paragraph is in it
             if extracted_text:
-                if content:
-                    note["content"] = content + "\n\n" + extracted_text
-                else:
-                    note["content"] = extracted_text
+                document = document.with_typed_text(content)
+                note["content"] = document.text
+                note["structure"] = document.to_bson()
                 print(f"Extracted {len(extracted_text)} characters from file {file.filename}")
         
         # Handle image upload if provided
         if image:
-            # Read image data
-            contents = await image.read()
-            
-            # Get content type and validate it's an image
-            content_type = image.content_type
-            if not content_type or not content_type.startswith('image/'):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid file type: {content_type}. Only images are allowed."
-                )
-            
-            # Save to GridFS using the async fs bucket
+            # Stream the image into GridFS; only real images (by magic bytes) are accepted
             metadata = {
-                "content_type": content_type,
                 "filename": image.filename,
                 "course_id": str(obj_id),
                 "topic_number": topic_number
             }
-            
-            # Use the async upload_from_stream method
-            image_id = await fs.upload_from_stream(
-                image.filename,
-                contents,
-                metadata=metadata
-            )
+            try:
+                stored_image = await uploads.stream_to_gridfs(fs, image, uploads.IMAGE_KINDS, metadata=metadata)
+            except uploads.UploadRejected as err:
+                raise HTTPException(status_code=err.status_code, detail=str(err))
+            content_type = stored_image.media_type
             
             # Add image reference to note
-            note["image_id"] = str(image_id)
+            note["image_id"] = str(stored_image.file_id)
             
             # If no content provided but image is present, set a placeholder message
             if not content and not extracted_text:
@@ -655,6 +879,17 @@ async def upload_notes(
         
         # Save note to database
         result = await db.notes.insert_one(note)
+
+        # Make the note searchable
+        try:
+            index = await get_course_index(db, obj_id)
+            index.add_many([
+                (f"note:{result.inserted_id}:{n}", chunk, {"kind": "note", "topic_number": topic_number, "title": title})
+                for n, chunk in enumerate(chunk_note(note["content"], note.get("structure")))
+            ])
+            await save_course_index(obj_id, index)
+        except Exception as e:
+            print(f"Failed to index note {result.inserted_id}: {e}")
         
         return {
             "status": "success",
@@ -671,171 +906,60 @@ async def upload_notes(
         raise HTTPException(status_code=500, detail=f"Failed to upload notes: {e}")
 
 @app.post("/courses/{course_id}/topics/{topic_number}/notes-quiz", summary="Generate multiple-choice quiz from notes")
+@deadlines.budget(NOTES_QUIZ_DEADLINE)
 async def generate_notes_quiz(course_id: str, topic_number: int):
+    # Concurrent requests for the same topic, on any worker, share one generation
+    async with shared_state.in_flight(f"notes_quiz:{course_id}:{topic_number}") as leader:
+        if leader:
+            return await _generate_notes_quiz(course_id, topic_number)
+
+    print(f"Notes quiz for course {course_id}, topic {topic_number} was generated concurrently, returning it")
+    return await get_notes_quiz(course_id, topic_number)
+
+
+async def _generate_notes_quiz(course_id: str, topic_number: int):
     try:
         print(f"Generating notes quiz for course_id: {course_id}, topic: {topic_number}")
         
         try:
             obj_id = ObjectId(course_id)
-            print(f"Converted to ObjectId: {obj_id}")
         except Exception as e:
             print(f"Error converting course_id to ObjectId: {e}")
             raise HTTPException(status_code=400, detail=f"Invalid course ID format: {e}")
             
-        course = await db.courses.find_one({"_id": obj_id})
+        course = await db.courses.find_one({"_id": obj_id}, {"_id": 1})
         if not course:
             print(f"Course not found: {course_id}")
             raise HTTPException(status_code=404, detail="Course not found")
 
-        # Find the notes for this topic
-        print(f"Searching for notes for topic_number: {topic_number}")
-        notes_cursor = db.notes.find({
-            "course_id": obj_id,
-            "topic_number": topic_number
-        }).sort("created_at", -1)  # Get most recent first
-        
-        notes = await notes_cursor.to_list(length=1)
-        if not notes:
-            print(f"No notes found for topic: {topic_number}")
-            raise HTTPException(status_code=404, detail="No notes found for this topic")
-            
-        latest_note = notes[0]
-        note_title = latest_note.get("title", f"Topic {topic_number} Notes")
-        note_content = latest_note.get("content", "")
-        print(f"Found notes: title='{note_title}', content_length={len(note_content)}")
-        
-        # Check if there's an image associated with the notes
-        image_id = latest_note.get("image_id")
-        image_data = None
-        image_mime_type = None
-        is_handwritten = False
-        
-        if image_id:
-            print(f"Notes have image_id: {image_id}")
-            # Check if it might be handwritten notes
-            note_content_lower = note_content.lower()
-            if "handwritten" in note_content_lower or "scan" in note_content_lower:
-                is_handwritten = True
-                print("Image likely contains handwritten content based on note description")
-                
-            # Find the image using the async GridFS
-            try:
-                # Convert string ID to ObjectId if needed
-                if isinstance(image_id, str):
-                    image_id = ObjectId(image_id)
-                
-                # Use the async GridFS to download the image
-                print(f"Attempting to download image with id: {image_id}")
-                
-                # First check metadata
-                image_info = await db.fs.files.find_one({"_id": image_id})
-                if not image_info:
-                    print(f"Image not found in GridFS: {image_id}")
-                else:
-                    # Get content type from metadata
-                    if "metadata" in image_info and "content_type" in image_info["metadata"]:
-                        image_mime_type = image_info["metadata"]["content_type"]
-                        print(f"Image mime type from metadata: {image_mime_type}")
-                        
-                        # Check filename for more hints about handwritten content
-                        if "metadata" in image_info and "filename" in image_info["metadata"]:
-                            filename = image_info["metadata"]["filename"].lower()
-                            if any(kw in filename for kw in ["note", "handwritten", "scan", "hw"]):
-                                is_handwritten = True
-                                print(f"Image likely contains handwritten content based on filename: {filename}")
-                    else:
-                        image_mime_type = "image/jpeg"  # Default if not specified
-                        print(f"Using default image mime type: {image_mime_type}")
-                    
-                    # Get a download stream from GridFSBucket
-                    grid_out = await fs.open_download_stream(image_id)
-                    
-                    # Read the content
-                    chunks = []
-                    async for chunk in grid_out:
-                        chunks.append(chunk)
-                    
-                    # Combine all chunks
-                    image_data = b''.join(chunks)
-                    image_data_size = len(image_data) if image_data else 0
-                    print(f"Retrieved image data, size: {image_data_size} bytes")
-                    
-                    if is_handwritten:
-                        print("Will use enhanced handwritten note processing for quiz generation")
-                
-            except Exception as e:
-                print(f"Error retrieving image: {e}")
-                import traceback
-                traceback.print_exc()
-                # Continue without the image
-                print("Continuing quiz generation without the image")
-        
-        # Check if we already have a quiz for this topic
-        existing_quiz = await db.notes_quizzes.find_one({
-            "course_id": obj_id,
-            "topic_number": topic_number
-        })
-        
-        if existing_quiz:
-            print(f"Found existing quiz, will replace it. ID: {existing_quiz['_id']}")
-            # Update existing quiz
-            await db.notes_quizzes.delete_one({"_id": existing_quiz["_id"]})
-        
-        print("Calling notes_quiz_generator.create_notes_quiz_endpoint...")
-        # Generate new quiz
-        try:
-            quiz_data = create_notes_quiz_endpoint(
-                str(obj_id),  # Pass as string as expected by the function
-                topic_number,
-                note_title,
-                note_content,
-                image_data,
-                image_mime_type
-            )
-            print(f"Quiz generation complete. Generated {len(quiz_data.get('questions', []))} questions")
-            
-        except Exception as e:
-            print(f"Error in quiz generation: {e}")
-            import traceback
-            traceback.print_exc()
-            raise HTTPException(status_code=500, detail=f"Quiz generation failed: {e}")
-        
-        # Check for errors in quiz generation
-        if "error" in quiz_data:
-            print(f"Quiz generation returned error: {quiz_data['error']}")
-            raise HTTPException(status_code=500, detail=quiz_data["error"])
-        
-        # Convert the course_id back to ObjectId for MongoDB storage
-        quiz_data["course_id"] = obj_id
-        print(f"Converted course_id string back to ObjectId for storage: {quiz_data['course_id']}")
-        
-        # Add image_id if available
-        if image_id:
-            quiz_data["image_id"] = str(image_id)
-            print(f"Added image_id to quiz: {quiz_data['image_id']}")
-        
-        # Set creation timestamp
-        quiz_data["created_at"] = datetime.utcnow()
-        
-        # Store in database
-        print("Saving quiz to database...")
-        result = await db.notes_quizzes.insert_one(quiz_data)
-        quiz_data["_id"] = str(result.inserted_id)
-        print(f"Quiz saved with ID: {quiz_data['_id']}")
-        
-        # Convert ObjectId to string for JSON response
-        quiz_data["course_id"] = str(quiz_data["course_id"])
-        
-        return quiz_data
+        return await notes_quiz.generate_for_topic(db, fs, obj_id, topic_number)
     
     except HTTPException:
         raise
+    except notes_quiz.NotesQuizError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
     except Exception as err:
         print(f"Error generating notes quiz: {err}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to generate quiz: {err}")
 
+@app.get("/courses/{course_id}/quiz-events", summary="Stream notifications of finished quizzes (server-sent events)")
+async def stream_quiz_events(course_id: str, topic_number: Optional[int] = None):
+    """
+    An event each time a pre-lecture or notes quiz of the course (or of one
+    topic) is stored, so clients need not poll for it (see quiz_events.py).
+    """
+    try:
+        ObjectId(course_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid course ID")
+    return StreamingResponse(
+        quiz_events.stream(course_id, topic_number),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/courses/{course_id}/topics/{topic_number}/notes-quiz", summary="Get the latest notes quiz for a topic")
 async def get_notes_quiz(course_id: str, topic_number: int):
     try:
@@ -851,13 +975,6 @@ async def get_notes_quiz(course_id: str, topic_number: int):
         # Find the latest quiz for this topic
         print(f"Querying db.notes_quizzes for course_id: {obj_id}, topic_number: {topic_number}")
         
-        # Check if collection exists
-        collections = await db.list_collection_names()
-        print(f"Available collections: {collections}")
-        if "notes_quizzes" not in collections:
-            print("notes_quizzes collection does not exist yet")
-            raise HTTPException(status_code=404, detail="Notes quizzes collection not found")
-            
         quiz = await db.notes_quizzes.find_one({
             "course_id": obj_id,
             "topic_number": topic_number
@@ -886,6 +1003,26 @@ async def get_notes_quiz(course_id: str, topic_number: int):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to retrieve quiz: {err}")
 
+@app.get("/metrics/attempts", summary="Depth and flush lag of the quiz attempt buffer")
+async def get_attempt_metrics():
+    try:
+        return await attempt_buffer.metrics()
+    except Exception as err:
+        print(f"Error reading attempt buffer metrics: {err}")
+        raise HTTPException(status_code=500, detail=f"Failed to read attempt buffer metrics: {err}")
+
+@app.get("/metrics/quiz-events", summary="Source and subscribers of quiz notifications")
+async def get_quiz_event_metrics():
+    return quiz_events.metrics()
+
+@app.get("/quiz-quality", summary="Acceptance rate of generated quiz questions per model and prompt version")
+async def get_quiz_quality():
+    try:
+        return {"quality": await quiz_quality.metrics(db)}
+    except Exception as err:
+        print(f"Error retrieving quiz quality: {err}")
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve quiz quality: {err}")
+
 @app.get("/images/{image_id}", summary="Get an image from GridFS")
 async def get_image(image_id: str):
     try:
@@ -945,7 +1082,7 @@ async def get_image(image_id: str):
         raise HTTPException(status_code=500, detail=f"Internal server error: {err}")
 
 @app.get("/courses/{course_id}/all-quizzes", summary="List all quizzes for a course")
-async def list_all_quizzes(course_id: str):
+async def list_all_quizzes(course_id: str, request: Request):
     try:
         print(f"Listing all quizzes for course: {course_id}")
         
@@ -955,29 +1092,23 @@ async def list_all_quizzes(course_id: str):
             raise HTTPException(status_code=400, detail=f"Invalid course ID format: {e}")
             
         # First check the course exists
-        course = await db.courses.find_one({"_id": obj_id})
+        course = await db.courses.find_one({"_id": obj_id}, {"_id": 1})
         if not course:
             raise HTTPException(status_code=404, detail="Course not found")
             
         # Query all types of quizzes
         
-        # 1. Pre-lecture quizzes from the quizzes collection
-        pre_lecture_cursor = db.quizzes.find({"course_id": obj_id})
-        pre_lecture_quizzes = []
-        async for quiz in pre_lecture_cursor:
-            quiz["_id"] = str(quiz["_id"])
-            quiz["course_id"] = str(quiz["course_id"])
-            quiz["quiz_type"] = "pre_lecture"
-            pre_lecture_quizzes.append(quiz)
+        # 1. Pre-lecture quizzes from the quizzes collection; quiz_type is added by the query
+        pre_lecture_quizzes = await db.quizzes.aggregate([
+            {"$match": {"course_id": obj_id}},
+            {"$addFields": {"quiz_type": "pre_lecture"}},
+        ]).to_list(length=None)
             
         # 2. Notes quizzes from the notes_quizzes collection
-        notes_quizzes_cursor = db.notes_quizzes.find({"course_id": obj_id})
-        notes_quizzes = []
-        async for quiz in notes_quizzes_cursor:
-            quiz["_id"] = str(quiz["_id"])
-            quiz["course_id"] = str(quiz["course_id"])
-            quiz["quiz_type"] = "notes"
-            notes_quizzes.append(quiz)
+        notes_quizzes = await db.notes_quizzes.aggregate([
+            {"$match": {"course_id": obj_id}},
+            {"$addFields": {"quiz_type": "notes"}},
+        ]).to_list(length=None)
             
         # Combine all quizzes
         all_quizzes = {
@@ -988,16 +1119,13 @@ async def list_all_quizzes(course_id: str):
         }
         
         # Also retrieve information about topics from the roadmap
-        if "roadmap" in course:
-            topic_info = []
-            for i, entry in enumerate(course["roadmap"]):
-                topic_info.append({
-                    "topic_number": i + 1,
-                    "topic": entry.get("topic", f"Topic {i+1}")
-                })
-            all_quizzes["topics"] = topic_info
+        topics = await roadmap_topics.load(db, obj_id, projection={"_id": 0, "topic": 1})
+        if topics:
+            all_quizzes["topics"] = [
+                {"topic_number": entry["topic_number"], "topic": entry["topic"]} for entry in topics
+            ]
             
-        return all_quizzes
+        return negotiated_response(request, all_quizzes)
         
     except HTTPException:
         raise
@@ -1007,6 +1135,32 @@ async def list_all_quizzes(course_id: str):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to list quizzes: {err}")
 
+@app.get("/courses/{course_id}/search", summary="Semantic search over a course's notes and questions")
+async def search_course(course_id: str, q: str, k: int = 10, kind: Optional[str] = None):
+    """Search notes and quiz questions with the local vector index. `kind` is note, pre_quiz or notes_quiz."""
+    try:
+        try:
+            obj_id = ObjectId(course_id)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid course ID format: {e}")
+
+        course = await db.courses.find_one({"_id": obj_id}, {"_id": 1})
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
+
+        if not q.strip():
+            raise HTTPException(status_code=400, detail="Query must not be empty")
+
+        index = await get_course_index(db, obj_id)
+        results = index.search(q, k=max(1, min(k, 50)), kinds=[kind] if kind else None)
+        return {"course_id": course_id, "query": q, "results": results}
+
+    except HTTPException:
+        raise
+    except Exception as err:
+        print(f"Error searching course: {err}")
+        raise HTTPException(status_code=500, detail=f"Failed to search course: {err}")
+
 @app.delete("/courses/{course_id}", summary="Delete a course and all associated data")
 async def delete_course(course_id: str):
     """Delete a course and all its associated data including quizzes, notes, and images."""
@@ -1018,12 +1172,14 @@ async def delete_course(course_id: str):
             raise HTTPException(status_code=400, detail="Invalid course ID format")
         
         # Check if course exists
-        course = await db.courses.find_one({"_id": course_oid})
+        course = await db.courses.find_one({"_id": course_oid}, {"_id": 1, "syllabus": 1})
         if not course:
             raise HTTPException(status_code=404, detail="Course not found")
         
         # Delete all associated quizzes
-        delete_quizzes_result = await db.quizzes.delete_many({"course_id": course_id})
+        # Pre-lecture quizzes store the course id as an ObjectId; older ones as a string
+        delete_quizzes_result = await db.quizzes.delete_many({"course_id": {"$in": [course_id, course_oid]}})
+        attempt_buffer.forget_quizzes()
         
         # Delete all associated notes
         notes_cursor = db.notes.find({"course_id": course_id})
@@ -1032,9 +1188,11 @@ async def delete_course(course_id: str):
         
         async for note in notes_cursor:
             notes_to_delete.append(note["_id"])
-            # Collect image IDs to delete from GridFS
+            # Collect image and document file IDs to delete from GridFS
             if "image_id" in note and note["image_id"]:
                 image_ids_to_delete.append(ObjectId(note["image_id"]))
+            if note.get("file_id"):
+                image_ids_to_delete.append(ObjectId(note["file_id"]))
         
         # Delete collected notes
         if notes_to_delete:
@@ -1045,13 +1203,21 @@ async def delete_course(course_id: str):
             try:
                 await fs.delete(image_id)
             except Exception as e:
-                print(f"Error deleting image {image_id}: {e}")
+                print(f"Error deleting GridFS file {image_id}: {e}")
         
         # Delete notes quizzes
         await db.notes_quizzes.delete_many({"course_id": course_id})
+
+        # Delete the syllabus kept for native ingestion
+        try:
+            await syllabus_context.delete_course(fs, course)
+        except Exception as e:
+            print(f"Error deleting syllabus of course {course_id}: {e}")
         
         # Delete the course itself
         delete_result = await db.courses.delete_one({"_id": course_oid})
+        await roadmap_topics.delete_course(db, course_oid)
+        await asyncio.to_thread(drop_course_index, course_oid)
         
         if delete_result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Course not found or already deleted")
@@ -1120,19 +1286,16 @@ async def test_quiz_generation():
         return {"status": "error", "message": str(e)}
 
 @app.post("/test/analyze-handwriting", summary="Test analyzing handwritten notes with Gemini Vision")
+@deadlines.budget(IMAGE_DEADLINE)
 async def test_analyze_handwriting(
     image: UploadFile = File(...)
 ):
     try:
-        # Read image data
-        image_content = await image.read()
-        image_mime_type = image.content_type
-        
-        if not image_mime_type or not image_mime_type.startswith('image/'):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file type: {image_mime_type}. Only images are allowed."
-            )
+        # Read image data; only real images (by magic bytes) within the size cap
+        try:
+            image_content, image_mime_type = await uploads.read_limited(image, uploads.IMAGE_KINDS)
+        except uploads.UploadRejected as err:
+            raise HTTPException(status_code=err.status_code, detail=str(err))
         
         print(f"Analyzing handwritten image: {image.filename}, size: {len(image_content)} bytes")
         
@@ -1153,21 +1316,13 @@ SUMMARY:
 """
         
         try:
-            # Import necessary libraries
-            import io
-            from PIL import Image
-            
-            # Convert bytes to PIL Image
-            img = Image.open(io.BytesIO(image_content))
-            
-            # Create a Gemini model instance for vision
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            
-            # Generate content with the image and prompt
-            response = model.generate_content([prompt, img])
+            # Send the image bytes and prompt to the shared Gemini client
+            response = await asyncio.to_thread(
+                llm.generate_content, [prompt, llm.image_part(image_content, image_mime_type)]
+            )
             
             # Get the response text
-            result = response.text
+            result = llm.response_text(response)
             print("Analysis complete")
             
             return {
@@ -1187,39 +1342,28 @@ SUMMARY:
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
 
 @app.post("/process-image/", summary="Process image and extract text plus questions")
+@deadlines.budget(IMAGE_DEADLINE)
 async def process_image(file: UploadFile = File(...)):
     try:
-        # Read the uploaded image file
-        contents = await file.read()
-        content_type = file.content_type
-        
-        if not content_type or not content_type.startswith('image/'):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file type: {content_type}. Only images are allowed."
-            )
+        # Read the uploaded image file; only real images (by magic bytes) within the size cap
+        try:
+            contents, content_type = await uploads.read_limited(file, uploads.IMAGE_KINDS)
+        except uploads.UploadRejected as err:
+            raise HTTPException(status_code=err.status_code, detail=str(err))
         
         print(f"Processing image: {file.filename}, size: {len(contents)} bytes")
         
-        # Import necessary libraries
-        import io
-        from PIL import Image
-        
-        # Open the image with PIL
-        img = Image.open(io.BytesIO(contents))
-        
-        # Create a Gemini model instance for vision
-        model = google.generativeai.GenerativeModel('gemini-2.0-flash')
-        
         # Prepare the prompt for the model
         extract_prompt = "Extract the handwritten text from this image. Be thorough and capture all content."
         
         # Send the image and prompt to the model
         print("Extracting text from image...")
-        extraction_response = model.generate_content([extract_prompt, img])
+        extraction_response = await asyncio.to_thread(
+            llm.generate_content, [extract_prompt, llm.image_part(contents, content_type)]
+        )
         
         # Get the extracted text from the response
-        extracted_text = extraction_response.text
+        extracted_text = llm.response_text(extraction_response)
         print(f"Extracted text length: {len(extracted_text)} characters")
         
         # Generate 10 example questions based on the extracted text
@@ -1244,13 +1388,10 @@ Format each question as a JSON object with these fields:
 Return ONLY a valid JSON array with these 10 questions. No explanation or other text.
 """
         
-        # Create a text model instance for quiz generation
-        text_model = genai.GenerativeModel('gemini-1.5-flash')
-        
         # Generate quiz questions
         print("Generating quiz questions...")
-        quiz_response = text_model.generate_content(quiz_prompt)
-        quiz_text = quiz_response.text
+        quiz_response = await asyncio.to_thread(llm.generate_content, quiz_prompt)
+        quiz_text = llm.response_text(quiz_response)
         
         # Clean up any markdown code block formatting
         cleaned_quiz = quiz_text.strip()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Models - Compact in-memory types for quiz, attempt and review documents.
+
+This module provides functionality to:
+1. Represent flashcards, multiple-choice questions, attempt responses, attempts
+   and digest review items as slotted dataclasses (no per-instance __dict__)
+2. Decode MongoDB documents into them (`from_bson`) and encode them back (`to_bson`)
+   with the field names already stored in the database
+3. Validate and number Gemini output in one place (`parse_many`)
+
+Documents keep their existing shape in MongoDB and in API responses; the models
+only replace the loose nested dicts that were passed around and mutated in place.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from spaced_repetition import CARD_FIELDS, DEFAULT_EASE
+
+
+def _text(value: Any) -> str:
+    return value.strip() if isinstance(value, str) else ""
+
+
+@dataclass(slots=True)
+class Flashcard:
+    """One pre-lecture quiz question (`quizzes.quiz[]`)."""
+
+    question: str
+    answer: str
+    index: int = 0
+    generator: Optional[str] = None  # "local" if not made by Gemini (local_quiz.py)
+
+    @classmethod
+    def from_bson(cls, doc: Dict[str, Any]) -> "Flashcard":
+        return cls(doc.get("question", ""), doc.get("answer", ""), doc.get("index", 0), doc.get("generator"))
+
+    def to_bson(self) -> Dict[str, Any]:
+        doc = {"question": self.question, "answer": self.answer, "index": self.index}
+        if self.generator:
+            doc["generator"] = self.generator
+        return doc
+
+    @classmethod
+    def parse_many(cls, items: Iterable[Any]) -> List["Flashcard"]:
+        """Keep the well-formed items of a Gemini response and number them from 1."""
+        cards = []
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            question, answer = _text(item.get("question")), _text(item.get("answer"))
+            if question and answer:
+                cards.append(cls(question, answer, len(cards) + 1))
+        return cards
+
+
+@dataclass(slots=True)
+class MultipleChoiceQuestion:
+    """One notes quiz question (`notes_quizzes.questions[]`)."""
+
+    id: int
+    question: str
+    options: List[str]
+    correct_answer: str
+    generator: Optional[str] = None  # "local" if not made by Gemini (local_quiz.py)
+
+    @classmethod
+    def from_bson(cls, doc: Dict[str, Any]) -> "MultipleChoiceQuestion":
+        return cls(doc.get("id", 0), doc.get("question", ""), list(doc.get("options", [])),
+                   doc.get("correctAnswer", ""), doc.get("generator"))
+
+    def to_bson(self) -> Dict[str, Any]:
+        doc = {"id": self.id, "question": self.question, "options": self.options, "correctAnswer": self.correct_answer}
+        if self.generator:
+            doc["generator"] = self.generator
+        return doc
+
+    @classmethod
+    def parse(cls, item: Any) -> "MultipleChoiceQuestion":
+        """Validate one question from a Gemini response. Raises ValueError saying what is wrong."""
+        if not isinstance(item, dict):
+            raise ValueError(f"not an object: {item!r}")
+        missing = [key for key in ("id", "question", "options", "correctAnswer") if key not in item]
+        if missing:
+            raise ValueError(f"missing required fields {missing}: {item}")
+        if not isinstance(item["options"], list) or item["correctAnswer"] not in item["options"]:
+            raise ValueError(f"correctAnswer not in options: {item}")
+        return cls.from_bson(item)
+
+
+@dataclass(slots=True)
+class CardResponse:
+    """One rated question of an attempt (`attempts.responses[]`) with its memory state."""
+
+    question_number: int
+    question: Optional[str]
+    answer: Optional[str]
+    user_rating: Optional[str]
+    next_due_date: Optional[str] = None
+    ease: float = DEFAULT_EASE
+    interval: int = 0
+    stability: float = 0.0
+    repetitions: int = 0
+    lapses: int = 0
+    last_reviewed: Optional[str] = None
+    # Typed answer and its grade (answer_grading.py), if the student typed one
+    user_answer: Optional[str] = None
+    score: Optional[float] = None
+    graded_by: Optional[str] = None
+
+    @classmethod
+    def from_bson(cls, doc: Dict[str, Any]) -> "CardResponse":
+        return cls(
+            doc.get("question_number"), doc.get("question"), doc.get("answer"), doc.get("user_rating"),
+            doc.get("next_due_date"), doc.get("ease", DEFAULT_EASE), doc.get("interval", 0),
+            doc.get("stability", 0.0), doc.get("repetitions", 0), doc.get("lapses", 0), doc.get("last_reviewed"),
+            doc.get("user_answer"), doc.get("score"), doc.get("graded_by"),
+        )
+
+    def to_bson(self) -> Dict[str, Any]:
+        doc = {
+            "question_number": self.question_number,
+            "question": self.question,
+            "answer": self.answer,
+            "user_rating": self.user_rating,
+            "next_due_date": self.next_due_date,
+            "ease": self.ease,
+            "interval": self.interval,
+            "stability": self.stability,
+            "repetitions": self.repetitions,
+            "lapses": self.lapses,
+            "last_reviewed": self.last_reviewed,
+        }
+        if self.user_answer is not None:
+            doc.update(user_answer=self.user_answer, score=self.score, graded_by=self.graded_by)
+        return doc
+
+    def state(self) -> Dict[str, Any]:
+        """Memory state in the form spaced_repetition.schedule_reviews takes."""
+        return {name: getattr(self, name) for name in CARD_FIELDS}
+
+    def is_due(self, today: str) -> bool:
+        # ISO dates compare correctly as strings
+        return bool(self.next_due_date) and self.next_due_date <= today
+
+
+@dataclass(slots=True)
+class Attempt:
+    """A quiz attempt (`attempts`)."""
+
+    id: Any
+    quiz_id: Any
+    user_id: Optional[str]
+    topic_number: Optional[int]
+    responses: List[CardResponse] = field(default_factory=list)
+    course_id: Any = None
+    taken_at: Any = None
+
+    @classmethod
+    def from_bson(cls, doc: Dict[str, Any]) -> "Attempt":
+        return cls(
+            doc.get("_id"), doc.get("quiz_id"), doc.get("user_id"), doc.get("topic_number"),
+            [CardResponse.from_bson(r) for r in doc.get("responses", [])],
+            doc.get("course_id"), doc.get("taken_at"),
+        )
+
+    def to_bson(self) -> Dict[str, Any]:
+        doc = {
+            "quiz_id": self.quiz_id,
+            "course_id": self.course_id,
+            "user_id": self.user_id,
+            "topic_number": self.topic_number,
+            "responses": [r.to_bson() for r in self.responses],
+            "taken_at": self.taken_at,
+        }
+        if self.id is not None:
+            doc["_id"] = self.id
+        return doc
+
+
+@dataclass(slots=True)
+class ReviewItem:
+    """A card due for review in a user's digest (`review_digests.cards[]`)."""
+
+    card_id: str
+    attempt_id: str
+    quiz_id: str
+    course_id: Optional[str]
+    topic_number: Optional[int]
+    question_number: Optional[int]
+    question: Optional[str]
+    answer: Optional[str]
+    due_date: str
+
+    @classmethod
+    def from_bson(cls, doc: Dict[str, Any]) -> "ReviewItem":
+        return cls(
+            doc["card_id"], doc["attempt_id"], doc["quiz_id"], doc.get("course_id"), doc.get("topic_number"),
+            doc.get("question_number"), doc.get("question"), doc.get("answer"), doc["due_date"],
+        )
+
+    def to_bson(self) -> Dict[str, Any]:
+        return {
+            "card_id": self.card_id,
+            "attempt_id": self.attempt_id,
+            "quiz_id": self.quiz_id,
+            "course_id": self.course_id,
+            "topic_number": self.topic_number,
+            "question_number": self.question_number,
+            "question": self.question,
+            "answer": self.answer,
+            "due_date": self.due_date,
+        }
+
+    def sort_key(self):
+        return (self.due_date, self.course_id or "", self.topic_number or 0, self.question_number or 0)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Notes Quiz - Generate and store the multiple-choice quiz of a topic's notes.
+
+This module provides functionality to:
+1. Load the most recent notes of a topic, with their image from GridFS if any
+2. Cut long notes down to NOTES_PROMPT_CHARS section by section, using the
+   structure stored with notes extracted from files (document_model.py)
+3. Generate the quiz with notes_quiz_generator (which validates it, see
+   quiz_quality.py) and drop near-duplicate questions
+4. Replace the topic's previous quiz in `notes_quizzes` and in the semantic index
+5. Fall back to multiple-choice questions made locally from the notes text
+   (local_quiz.py) when Gemini fails; such a quiz is not current, so the
+   prewarm worker replaces it once Gemini answers again
+
+Shared by the notes-quiz route in main.py and the prewarm worker (prewarm.py).
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+
+import document_model
+import local_quiz
+import quiz_quality
+from notes_quiz_generator import create_notes_quiz_endpoint
+from semantic_index import filter_near_duplicates, get_course_index, notes_quiz_items, save_course_index
+
+# Notes longer than this are cut down section by section before they go into the prompt
+NOTES_PROMPT_CHARS = int(os.getenv("NOTES_PROMPT_CHARS", "16000"))
+
+
+class NotesQuizError(ValueError):
+    """Quiz generation failed. ``status_code`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def latest_note(db, course_id: ObjectId, topic_number: int) -> Optional[Dict[str, Any]]:
+    notes = await db.notes.find(
+        {"course_id": course_id, "topic_number": topic_number}
+    ).sort("created_at", -1).to_list(length=1)
+    return notes[0] if notes else None
+
+
+async def is_current(db, course_id: ObjectId, topic_number: int) -> bool:
+    """Whether the topic's notes quiz is newer than its most recent notes (or there are no notes) and not local."""
+    note = await db.notes.find_one(
+        {"course_id": course_id, "topic_number": topic_number}, {"created_at": 1}, sort=[("created_at", -1)]
+    )
+    if note is None:
+        return True
+    quiz = await db.notes_quizzes.find_one(
+        {"course_id": course_id, "topic_number": topic_number}, {"created_at": 1, "generator": 1}, sort=[("created_at", -1)]
+    )
+    if quiz and quiz.get("generator") == local_quiz.LOCAL:
+        return False
+    return bool(quiz and quiz.get("created_at") and note.get("created_at") and quiz["created_at"] >= note["created_at"])
+
+
+async def _load_image(db, fs, image_id, note_content: str):
+    """The note's image as ``(data, mime_type, is_handwritten)``; no data if it cannot be read."""
+    is_handwritten = "handwritten" in note_content.lower() or "scan" in note_content.lower()
+    if is_handwritten:
+        print("Image likely contains handwritten content based on note description")
+    try:
+        if isinstance(image_id, str):
+            image_id = ObjectId(image_id)
+
+        image_info = await db.fs.files.find_one({"_id": image_id})
+        if not image_info:
+            print(f"Image not found in GridFS: {image_id}")
+            return None, None, is_handwritten
+
+        metadata = image_info.get("metadata") or {}
+        image_mime_type = metadata.get("content_type", "image/jpeg")
+        filename = (metadata.get("filename") or "").lower()
+        if any(kw in filename for kw in ["note", "handwritten", "scan", "hw"]):
+            is_handwritten = True
+            print(f"Image likely contains handwritten content based on filename: {filename}")
+
+        grid_out = await fs.open_download_stream(image_id)
+        chunks = []
+        async for chunk in grid_out:
+            chunks.append(chunk)
+        image_data = b"".join(chunks)
+        print(f"Retrieved image data, size: {len(image_data)} bytes")
+        return image_data, image_mime_type, is_handwritten
+    except Exception as e:
+        print(f"Error retrieving image: {e}")
+        print("Continuing quiz generation without the image")
+        return None, None, is_handwritten
+
+
+async def generate_for_topic(db, fs, course_id: ObjectId, topic_number: int, fallback: bool = True) -> Dict[str, Any]:
+    """
+    Generate the quiz of a topic's most recent notes and store it in place of the previous one.
+
+    Returns the stored quiz with string ids. Raises NotesQuizError (404 when
+    the topic has no notes). With ``fallback`` a Gemini failure gives a local
+    quiz (`"generator": "local"`) instead, if the notes have text to make one from.
+    """
+    note = await latest_note(db, course_id, topic_number)
+    if not note:
+        print(f"No notes found for topic: {topic_number}")
+        raise NotesQuizError("No notes found for this topic", status_code=404)
+
+    note_title = note.get("title", f"Topic {topic_number} Notes")
+    note_content = note.get("content", "")
+    print(f"Found notes: title='{note_title}', content_length={len(note_content)}")
+    if len(note_content) > NOTES_PROMPT_CHARS and note.get("structure"):
+        note_content = document_model.excerpt(note_content, note["structure"], NOTES_PROMPT_CHARS)
+        print(f"Cut notes to {len(note_content)} characters for the prompt")
+
+    image_id = note.get("image_id")
+    image_data = image_mime_type = None
+    if image_id:
+        image_data, image_mime_type, is_handwritten = await _load_image(db, fs, image_id, note_content)
+        if image_data and is_handwritten:
+            print("Will use enhanced handwritten note processing for quiz generation")
+
+    try:
+        quiz_data = await asyncio.to_thread(
+            create_notes_quiz_endpoint,
+            str(course_id),  # Pass as string as expected by the function
+            topic_number,
+            note_title,
+            note_content,
+            image_data,
+            image_mime_type
+        )
+        print(f"Quiz generation complete. Generated {len(quiz_data.get('questions', []))} questions")
+    except Exception as e:
+        print(f"Error in quiz generation: {e}")
+        quiz_data = {"error": f"Quiz generation failed: {e}"}
+
+    if "error" in quiz_data:
+        print(f"Quiz generation returned error: {quiz_data['error']}")
+        local = await asyncio.to_thread(_local_quiz, topic_number, note_title, note_content) if fallback else None
+        if not local:
+            raise NotesQuizError(quiz_data["error"])
+        print(f"Made {len(local['questions'])} questions locally instead")
+        quiz_data = local
+
+    # Drop questions that repeat ones already asked elsewhere in the course.
+    # The quiz being replaced for this topic is not counted as a duplicate source.
+    index = await get_course_index(db, course_id)
+    topic_prefix = f"notes_quiz:{topic_number}:"
+    kept, duplicates = filter_near_duplicates(quiz_data["questions"], index, exclude_prefix=topic_prefix)
+    if duplicates:
+        print(f"Dropped {len(duplicates)} near-duplicate questions from notes quiz")
+        if kept:
+            for i, question in enumerate(kept):
+                question["id"] = i + 1
+            quiz_data["questions"] = kept
+        else:
+            print("Every question was a near duplicate; keeping the generated quiz as is")
+    quiz_data["duplicates_removed"] = len(duplicates) if kept else 0
+
+    quiz_data["course_id"] = course_id
+    if image_id:
+        quiz_data["image_id"] = str(image_id)
+    quiz_data["created_at"] = datetime.utcnow()
+
+    # Replace the topic's previous quiz
+    await db.notes_quizzes.delete_many({"course_id": course_id, "topic_number": topic_number})
+    result = await db.notes_quizzes.insert_one(quiz_data)
+    quiz_data["_id"] = str(result.inserted_id)
+    print(f"Quiz saved with ID: {quiz_data['_id']}")
+    await quiz_quality.record(db, quiz_data.get("quality"))
+
+    index.remove_prefix(topic_prefix)
+    index.add_many(notes_quiz_items(result.inserted_id, topic_number, quiz_data["questions"]))
+    await save_course_index(course_id, index)
+
+    quiz_data["course_id"] = str(course_id)
+    return quiz_data
+
+
+def _local_quiz(topic_number: int, note_title: str, note_content: str) -> Optional[Dict[str, Any]]:
+    """A quiz in the shape of notes_quiz_generator's, made by local_quiz; None without enough text."""
+    questions = local_quiz.multiple_choice(f"# {note_title}\n\n{note_content}")
+    if not questions:
+        return None
+    return {
+        "topic_number": topic_number,
+        "title": f"Quiz: {note_title}",
+        "description": f"Test your knowledge from your notes on {note_title}",
+        "source": "Your uploaded notes",
+        "generator": local_quiz.LOCAL,
+        "questions": [question.to_bson() for question in questions],
+    }
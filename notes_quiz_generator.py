@@ -6,29 +6,39 @@ This module provides functionality to:
 1. Extract key information from student notes
 2. Generate challenging multiple-choice questions using Gemini
 3. Structure the questions with 4 options and identify the correct answer
+4. Repair or reject bad questions (quiz_quality.py) and ask Gemini again for
+   the rejected slots only
 
 To be integrated with the main FastAPI application.
 """
 
 import json
 import re
-import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
-from google import genai
-import google.generativeai as genair
+
+import llm
+import quiz_quality
+from models import MultipleChoiceQuestion
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini client
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set.")
+# Questions per quiz
+QUIZ_QUESTIONS = 10
+
+# Versions of the prompts below; change them with the prompts so their quality is counted apart
+TEXT_PROMPT_VERSION = "notes-text-1"
+IMAGE_PROMPT_VERSION = "notes-image-1"
+
+_QUESTION_FORMAT = """Format each question as a JSON object with these fields:
+- id: question number
+- question: the full question text
+- options: array of 4 possible answers
+- correctAnswer: the correct answer (must be one of the options)
+
+Return ONLY a valid JSON array of these questions. No explanation or other text."""
 
-# Create a new client with the API key
-genai_client = genai.Client(api_key=GOOGLE_API_KEY)
-# No need to get a model instance explicitly - we'll use the model name directly
 
 def generate_multiple_choice_quiz(
     notes_text: str, 
@@ -48,6 +58,19 @@ def generate_multiple_choice_quiz(
     Returns:
         A list of quiz questions with options and correct answers
     """
+    return generate_validated_quiz(notes_text, note_title, image_content, image_mime_type)[0]
+
+
+def generate_validated_quiz(
+    notes_text: str,
+    note_title: str,
+    image_content: Optional[bytes] = None,
+    image_mime_type: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Like generate_multiple_choice_quiz, also returning the quality counts of
+    the generation (quiz_quality.summary), or None when it failed.
+    """
     print(f"Generating quiz for: {note_title}")
     print(f"Notes length: {len(notes_text)} characters")
     if image_content:
@@ -127,117 +150,125 @@ The structure should be exactly like this:
 
     try:
         # Configure generation parameters
-        if not hasattr(genai_client, 'config'):
-            print("Note: This version of the Gemini SDK doesn't have a config attribute. Using default settings.")
-        else:
-            # Set generation parameters globally
-            genai_client.config.temperature = 0.2
-            genai_client.config.top_p = 0.95
-            genai_client.config.max_output_tokens = 4096
+        config = llm.types().GenerateContentConfig(temperature=0.2, top_p=0.95, max_output_tokens=4096)
         
-        # Use the format compatible with SDK version 0.8.4
         if image_content and image_mime_type:
             print("Including image in the Gemini prompt")
-            # Import necessary components for image handling
-            import base64
-            import io
-            from PIL import Image
-                        
-            # Create a generative model instance for vision
-            print("Creating GenerativeModel for vision")
-            model = genair.GenerativeModel('gemini-2.0-flash')
-            
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_content))
-            
-            # Call the model with the image and prompt
-            print(f"Calling Gemini API with vision model and image...")
-            try:
-                # Use the generate_content method of the model instance
-                response = model.generate_content([prompt, image])
-                print("Gemini API call successful")
-            except Exception as api_error:
-                print(f"Gemini API call failed: {api_error}")
-                import traceback
-                traceback.print_exc()
-                raise ValueError(f"Gemini API call failed: {api_error}")
+            contents = [prompt, llm.image_part(image_content, image_mime_type)]
         else:
             print("Using text-only Gemini prompt")
-            # Create a generative model instance for text
-            model = genair.GenerativeModel('gemini-2.0-flash') 
-            
-            # Call the API with just the text prompt
-            print(f"Calling Gemini API with text model...")
-            try:
-                # Use the generate_content method of the model instance
-                response = model.generate_content(prompt)
-                print("Gemini API call successful")
-            except Exception as api_error:
-                print(f"Gemini API call failed: {api_error}")
-                import traceback
-                traceback.print_exc()
-                raise ValueError(f"Gemini API call failed: {api_error}")
+            contents = prompt
+        
+        print("Calling Gemini API...")
+        try:
+            response = llm.generate_content(contents, config=config)
+            print("Gemini API call successful")
+        except Exception as api_error:
+            print(f"Gemini API call failed: {api_error}")
+            import traceback
+            traceback.print_exc()
+            raise ValueError(f"Gemini API call failed: {api_error}")
         
         # Extract and clean the response text
         print("Processing Gemini response...")
-        raw_text = response.text
+        raw_text = llm.response_text(response)
         print(f"Response length: {len(raw_text)} characters")
         print(f"Response preview: {raw_text[:100]}...")
-        
-        # Clean up any markdown code block formatting
-        stripped = raw_text.strip()
-        if stripped.startswith("```"):
-            print("Detected markdown code block, removing formatting")
-            stripped = re.sub(r"^```[a-zA-Z]*\n", "", stripped)
-            stripped = re.sub(r"```$", "", stripped)
-            stripped = stripped.strip()
-            
-        # Parse the JSON response
-        print("Parsing JSON response...")
-        try:
-            quiz_data = json.loads(stripped)
-            print(f"JSON parsed successfully, got {len(quiz_data)} items")
-        except json.JSONDecodeError as json_err:
-            print(f"JSON parsing failed: {json_err}")
-            print(f"Failed content: {stripped[:500]}...")
-            raise ValueError(f"Failed to parse JSON from Gemini response: {json_err}")
-        
-        # Validate the quiz data structure
-        print("Validating quiz data structure...")
-        if not isinstance(quiz_data, list) or len(quiz_data) == 0:
-            print(f"Unexpected data format: {type(quiz_data)}")
-            raise ValueError("Unexpected quiz data format")
-            
-        valid_questions = []
-        for i, question in enumerate(quiz_data):
+        quiz_data = _parse_questions(raw_text)
+
+        # Repair or reject bad questions, then ask again for the rejected slots only
+        print("Validating quiz questions...")
+        prompt_version = IMAGE_PROMPT_VERSION if image_content and image_mime_type else TEXT_PROMPT_VERSION
+        report = quiz_quality.validate(quiz_data)
+        wanted = min(len(quiz_data), QUIZ_QUESTIONS)
+        replacement_calls = 0
+        for _ in range(quiz_quality.QUIZ_REPLACEMENT_ROUNDS):
+            missing = wanted - len(report.kept)
+            if missing <= 0:
+                break
+            print(f"Requesting {missing} replacement questions for rejected ones: {report.reasons()}")
+            replacement_calls += 1
             try:
-                # Ensure all required fields are present
-                if not all(key in question for key in ["id", "question", "options", "correctAnswer"]):
-                    print(f"Question {i+1} missing required fields: {question}")
-                    continue
-                
-                # Ensure correctAnswer is one of the options
-                if question["correctAnswer"] not in question["options"]:
-                    print(f"Question {i+1} has correctAnswer not in options: {question}")
-                    continue
-                
-                valid_questions.append(question)
-            except Exception as q_err:
-                print(f"Error validating question {i+1}: {q_err}")
-                
-        print(f"Validation complete, {len(valid_questions)} valid questions out of {len(quiz_data)}")
-        
-        if not valid_questions:
+                more = _replacements(note_title, notes_text, image_content, image_mime_type, missing, report.kept)
+            except Exception as replacement_error:
+                print(f"Replacement request failed, keeping {len(report.kept)} questions: {replacement_error}")
+                break
+            report = quiz_quality.merge(report, more)
+
+        print(f"Validation complete, {len(report.kept)} valid questions out of {report.generated} "
+              f"({report.repaired} repaired)")
+
+        if not report.kept:
             raise ValueError("No valid questions found in Gemini response")
-            
-        return valid_questions
+
+        quality = quiz_quality.summary(report, llm.DEFAULT_MODEL, prompt_version, replacement_calls)
+        return [question.to_bson() for question in report.kept], quality
         
     except Exception as e:
         print(f"Error generating quiz: {e}")
         import traceback
         traceback.print_exc()
         # Return a simplified error structure
-        return [{"error": f"Failed to generate quiz: {str(e)}"}]
+        return [{"error": f"Failed to generate quiz: {str(e)}"}], None
+
+
+def _parse_questions(raw_text: str) -> List[Any]:
+    """The JSON array of questions in a Gemini response. Raises ValueError."""
+    # Clean up any markdown code block formatting
+    stripped = raw_text.strip()
+    if stripped.startswith("```"):
+        print("Detected markdown code block, removing formatting")
+        stripped = re.sub(r"^```[a-zA-Z]*\n", "", stripped)
+        stripped = re.sub(r"```$", "", stripped)
+        stripped = stripped.strip()
+
+    # Parse the JSON response
+    print("Parsing JSON response...")
+    try:
+        quiz_data = json.loads(stripped)
+        print(f"JSON parsed successfully, got {len(quiz_data)} items")
+    except json.JSONDecodeError as json_err:
+        print(f"JSON parsing failed: {json_err}")
+        print(f"Failed content: {stripped[:500]}...")
+        raise ValueError(f"Failed to parse JSON from Gemini response: {json_err}")
+
+    if not isinstance(quiz_data, list) or len(quiz_data) == 0:
+        print(f"Unexpected data format: {type(quiz_data)}")
+        raise ValueError("Unexpected quiz data format")
+    return quiz_data
+
+
+def _replacements(
+    note_title: str,
+    notes_text: str,
+    image_content: Optional[bytes],
+    image_mime_type: Optional[str],
+    count: int,
+    kept: List[MultipleChoiceQuestion]
+) -> quiz_quality.Report:
+    """``count`` more questions on the same notes, validated against the ``kept`` ones."""
+    existing = "\n".join(f"- {question.question}" for question in kept) or "- (none)"
+    source = ("the notes in the image" if image_content and image_mime_type
+              else f"these notes:\n\nNOTES TITLE: {note_title}\n\nNOTES CONTENT:\n{notes_text}")
+    prompt = f"""
+You are an expert educator writing multiple-choice quiz questions on {source}
+
+The quiz already has these questions. Do not repeat or rephrase them:
+{existing}
+
+Create exactly {count} new multiple-choice questions. Each question should:
+1. Test key concepts not already asked about
+2. Have 4 clearly different answer choices
+3. Have exactly one correct answer, which the question text must not give away
+4. Be challenging but fair
+
+{_QUESTION_FORMAT}
+"""
+    contents = [prompt, llm.image_part(image_content, image_mime_type)] if image_content and image_mime_type else prompt
+    config = llm.types().GenerateContentConfig(temperature=0.4, top_p=0.95, max_output_tokens=2048)
+    response = llm.generate_content(contents, config=config)
+    return quiz_quality.validate(_parse_questions(llm.response_text(response))[:count],
+                                 avoid=[question.question for question in kept])
 
 def create_notes_quiz_endpoint(
     course_id: str,
@@ -264,7 +295,7 @@ def create_notes_quiz_endpoint(
     print(f"Creating notes quiz endpoint for course {course_id}, topic {topic_number}")
     
     # Generate the quiz questions
-    questions = generate_multiple_choice_quiz(
+    questions, quality = generate_validated_quiz(
         note_content, 
         note_title, 
         image_data, 
@@ -289,6 +320,7 @@ def create_notes_quiz_endpoint(
         "description": f"Test your knowledge from your notes on {note_title}",
         "source": "Your uploaded notes",
         "questions": questions,
+        "quality": quality,
         "created_at": None  # Will be set by the database
     }
     
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Page Extraction - Page-level text store with a vision lane for scanned pages.
+
+This module provides functionality to:
+1. Store extracted text per page in `page_texts`, keyed by document SHA-256 and page number
+2. Reuse those pages whenever the same file is uploaded again, as a syllabus
+   (`courses`, single or bulk) or as notes
+3. Send only the pages without a text layer (scanned pages) to Gemini vision for
+   transcription, through a lane with its own concurrency limit (OCR_CONCURRENCY)
+4. Optionally keep the tables of selected pages next to their text, extracted in
+   the same pass (syllabus schedules, see syllabus_tables.py)
+
+`extracted_documents` records the page count of every fully processed document,
+so a repeat upload is served from the store without opening the file at all.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+import llm
+import uploads
+from document_extraction import extract_pdf_pages, extract_tables_from_file, extract_text_from_file, render_pdf_page
+
+# Vision transcriptions in flight at once in this process (on top of GEMINI_RPM)
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "2"))
+
+# Pages with fewer characters than this in their text layer are transcribed
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "20"))
+
+# DPI pages are rendered at for transcription
+OCR_RESOLUTION = int(os.getenv("OCR_RESOLUTION", "150"))
+
+OCR_PROMPT = (
+    "This is one page of a scanned course document (a syllabus or lecture notes). "
+    "Transcribe all of its text exactly, in reading order, including tables as plain lines "
+    "and any handwriting. Return only the transcribed text, with no commentary."
+)
+
+_ocr_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _ocr_lane() -> asyncio.Semaphore:
+    global _ocr_semaphore
+    if _ocr_semaphore is None:
+        _ocr_semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+    return _ocr_semaphore
+
+
+async def ensure_indexes(db):
+    await db.page_texts.create_index([("doc_hash", 1), ("page", 1)], unique=True)
+
+
+async def _cached_pages(db, doc_hash: str) -> Tuple[Optional[Dict[str, Any]], Dict[int, str]]:
+    document = await db.extracted_documents.find_one({"_id": doc_hash})
+    pages = {}
+    async for page in db.page_texts.find({"doc_hash": doc_hash}, {"page": 1, "text": 1}):
+        pages[page["page"]] = page["text"]
+    return document, pages
+
+
+def _joined(pages: Dict[int, str]) -> str:
+    return "\n".join(pages[number] for number in sorted(pages))
+
+
+async def cached_text(db, doc_hash: str) -> Optional[str]:
+    """The full text of a document if every page of it is already stored, else None."""
+    document, pages = await _cached_pages(db, doc_hash)
+    if document and len(pages) >= document["pages"]:
+        return _joined(pages)
+    return None
+
+
+async def page_texts(db, doc_hash: str) -> Dict[int, str]:
+    """The stored text of each page of a document, by page number (only the pages stored so far)."""
+    _, pages = await _cached_pages(db, doc_hash)
+    return pages
+
+
+async def _transcribe_page(path: str, page_number: int, executor=None) -> Optional[str]:
+    """Render one page and transcribe it with Gemini vision. None if that fails."""
+    loop = asyncio.get_running_loop()
+    async with _ocr_lane():
+        try:
+            image = await loop.run_in_executor(executor, render_pdf_page, path, page_number, OCR_RESOLUTION)
+            response = await asyncio.to_thread(llm.generate_content, [OCR_PROMPT, llm.image_part(image, "image/png")])
+            return llm.response_text(response).strip()
+        except Exception as e:
+            print(f"Transcription of page {page_number} failed: {e}")
+            return None
+
+
+async def stored_tables(db, doc_hash: str) -> Optional[List[List[List[str]]]]:
+    """
+    The tables stored with a document's pages, in page order, or None if its
+    pages were extracted without looking for tables.
+    """
+    document = await db.extracted_documents.find_one({"_id": doc_hash}, {"tables_scanned": 1})
+    if not document or not document.get("tables_scanned"):
+        return None
+    tables = []
+    cursor = db.page_texts.find({"doc_hash": doc_hash, "tables": {"$exists": True}}, {"tables": 1}).sort("page", 1)
+    async for page in cursor:
+        tables.extend(page["tables"])
+    return tables
+
+
+async def _store_pages(db, doc_hash: str, pages: Dict[int, Tuple[str, str]], tables: Optional[Dict[int, Any]] = None):
+    if not pages:
+        return
+    tables = tables or {}
+    docs = [
+        {"_id": f"{doc_hash}:{number}", "doc_hash": doc_hash, "page": number, "text": text,
+         "method": method, "created_at": datetime.utcnow(),
+         **({"tables": tables[number]} if number in tables else {})}
+        for number, (text, method) in pages.items()
+    ]
+    try:
+        await db.page_texts.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Another request stored the same pages first
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+async def extract_document_text(
+    db, path: str, kind: str, doc_hash: str, executor=None, tables_on: Optional[Callable[[str], bool]] = None
+) -> str:
+    """
+    Text of a PDF or DOCX file, reusing and filling the page store.
+
+    Args:
+        db: Motor database
+        path: The file on local disk
+        kind: "pdf" or "docx" (see uploads.sniff)
+        doc_hash: SHA-256 of the file
+        executor: Where CPU-bound parsing runs (default thread pool, or a process pool)
+        tables_on: Also store the tables of PDF pages whose text this holds for
+            (see document_extraction.extract_pdf_pages), and all DOCX tables.
+            Must be picklable for a process pool executor.
+    """
+    loop = asyncio.get_running_loop()
+    document, cached = await _cached_pages(db, doc_hash)
+    if document and len(cached) >= document["pages"]:
+        return _joined(cached)
+
+    new_pages: Dict[int, Tuple[str, str]] = {}
+    tables: Dict[int, Any] = {}
+    ocr_pages = 0
+    if kind == "docx":
+        # No pages in DOCX; the whole document is stored as page 1
+        page_count = 1
+        new_pages[1] = (await loop.run_in_executor(executor, extract_text_from_file, path, ".docx"), "text_layer")
+        if tables_on is not None:
+            tables[1] = await loop.run_in_executor(executor, extract_tables_from_file, path, ".docx")
+    elif kind == "pdf":
+        page_count, texts, blank, tables = await loop.run_in_executor(
+            executor, extract_pdf_pages, path, sorted(cached), OCR_MIN_PAGE_CHARS, tables_on
+        )
+        new_pages.update({number: (text, "text_layer") for number, text in texts.items()})
+        if blank:
+            print(f"Transcribing {len(blank)} page(s) without a text layer: {blank}")
+        transcribed = await asyncio.gather(*(_transcribe_page(path, number, executor) for number in blank))
+        for number, text in zip(blank, transcribed):
+            if text is not None:
+                new_pages[number] = (text, "ocr")
+                ocr_pages += 1
+    else:
+        raise ValueError(f"Unsupported document kind: {kind}")
+
+    await _store_pages(db, doc_hash, new_pages, tables)
+    pages = {**cached, **{number: text for number, (text, _) in new_pages.items()}}
+    if len(pages) >= page_count:
+        # Only complete documents are recorded; failed transcriptions are retried next time
+        fields = {"pages": page_count, "kind": kind, "updated_at": datetime.utcnow()}
+        if tables_on is not None and not cached:
+            fields["tables_scanned"] = True
+        await db.extracted_documents.update_one(
+            {"_id": doc_hash},
+            {"$set": fields, "$inc": {"ocr_pages": ocr_pages}},
+            upsert=True,
+        )
+    return _joined(pages)
+
+
+async def extract_upload_pages(db, fs, stored: "uploads.StoredUpload", executor=None) -> Dict[int, str]:
+    """
+    Text of an upload page by page (see :func:`extract_upload_text`); a DOCX
+    file or plain text upload is a single page 1.
+    """
+    text = await extract_upload_text(db, fs, stored, executor)
+    if stored.kind == "text":
+        return {1: text}
+    pages = await page_texts(db, stored.sha256)
+    return pages if pages else {1: text}
+
+
+async def extract_upload_text(
+    db, fs, stored: "uploads.StoredUpload", executor=None, tables_on: Optional[Callable[[str], bool]] = None
+) -> str:
+    """
+    Text of an upload from uploads.py, stored on disk (``path``) or in GridFS (``file_id``).
+
+    A GridFS file is only downloaded if some of its pages are not in the store
+    yet. ``tables_on`` is passed on to :func:`extract_document_text`.
+    """
+    if stored.kind == "text":
+        return await uploads.extract_stored_text(fs, stored)
+
+    text = await cached_text(db, stored.sha256)
+    if text is not None:
+        print(f"Reusing stored pages of {stored.filename} ({stored.sha256[:12]})")
+        return text
+
+    if stored.path:
+        return await extract_document_text(db, stored.path, stored.kind, stored.sha256, executor, tables_on)
+
+    path = await uploads.gridfs_to_tempfile(fs, stored.file_id, uploads.SUFFIXES[stored.kind])
+    try:
+        return await extract_document_text(db, path, stored.kind, stored.sha256, executor, tables_on)
+    finally:
+        os.remove(path)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+"""
+Pre Quiz - Flashcard-style pre-lecture quizzes, one per roadmap topic.
+
+This module provides functionality to:
+1. Select roadmap topics to generate quizzes for, by topic number and/or date window
+2. Skip topics whose stored quiz was generated from their current text
+   (see `revision` in roadmap_topics.py) unless regeneration is forced
+3. Upsert a single `quizzes` document per (course_id, topic_number) instead of
+   inserting a new one on every call
+4. Prefetch the quizzes of topics coming up in the next PREFETCH_DAYS in the
+   background, during off-peak hours only (PREFETCH_HOURS, UTC) and for at
+   most PREFETCH_MAX_RUN_SECONDS per run
+5. Ground the questions in the course's syllabus when it is a cached Gemini
+   context (native ingestion, see syllabus_context.py)
+6. Fall back to flashcards made locally from the topic and its notes
+   (local_quiz.py) when Gemini fails; those are stored as not current, so the
+   next request or the prewarm worker replaces them with Gemini's
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+
+import deadlines
+import delta_sync
+import document_model
+import llm
+import local_quiz
+import roadmap_topics
+import shared_state
+import syllabus_context
+from models import Flashcard
+from semantic_index import filter_near_duplicates, get_course_index, pre_quiz_items, save_course_index
+
+# Prefetch topics starting within this many days
+PREFETCH_DAYS = int(os.getenv("PREFETCH_DAYS", "14"))
+
+# Off-peak window as "start-end" UTC hours, end exclusive ("22-5" wraps midnight); empty disables prefetch
+PREFETCH_HOURS = os.getenv("PREFETCH_HOURS", "1-6")
+
+# How often the prefetch loop wakes up to check the clock and the roadmap
+PREFETCH_INTERVAL_SECONDS = float(os.getenv("PREFETCH_INTERVAL_SECONDS", "900"))
+
+# Topics generated per prefetch run at most, to leave Gemini quota for the morning
+PREFETCH_MAX_TOPICS = int(os.getenv("PREFETCH_MAX_TOPICS", "200"))
+
+# Seconds a prefetch run may take; no course is started after that, the rest waits for the next run
+PREFETCH_MAX_RUN_SECONDS = float(os.getenv("PREFETCH_MAX_RUN_SECONDS", "1800"))
+
+# Notes text per note the local fallback reads at most
+LOCAL_NOTES_CHARS = int(os.getenv("LOCAL_NOTES_CHARS", "20000"))
+
+# Appended to the flashcard prompt when the course's syllabus is a cached context
+_GROUNDING = "\nBase the questions on what the attached syllabus says about this topic (readings, key terms, dates)."
+
+
+async def ensure_indexes(db):
+    """Merge duplicate quizzes left by earlier versions, then make (course_id, topic_number) unique."""
+    duplicates = db.quizzes.aggregate([
+        {"$sort": {"created_at": -1}},
+        {"$group": {"_id": {"course_id": "$course_id", "topic_number": "$topic_number"},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+    removed = 0
+    async for group in duplicates:
+        stale = group["ids"][1:]  # keep the most recent quiz of the topic
+        # Attempts from before attempts carried course_id find their course through the quiz
+        await db.attempts.update_many(
+            {"quiz_id": {"$in": stale}, "course_id": None},
+            {"$set": {"course_id": group["_id"]["course_id"]}},
+        )
+        result = await db.quizzes.delete_many({"_id": {"$in": stale}})
+        removed += result.deleted_count
+        await delta_sync.record_deletions(db, delta_sync.QUIZ, group["_id"]["course_id"], stale)
+    if removed:
+        print(f"Removed {removed} superseded pre-lecture quizzes")
+    await db.quizzes.create_index([("course_id", ASCENDING), ("topic_number", ASCENDING)], unique=True)
+
+
+async def select_topics(
+    db,
+    course_id: ObjectId,
+    topic_numbers: Optional[Iterable[int]] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> List[Dict[str, Any]]:
+    """Roadmap topic documents matching both the topic numbers and the date window (if given)."""
+    entries = await roadmap_topics.load(db, course_id, start=start, end=end)
+    if topic_numbers:
+        wanted = set(topic_numbers)
+        entries = [entry for entry in entries if entry["topic_number"] in wanted]
+    return entries
+
+
+async def stored_quizzes(db, course_id: ObjectId, topic_numbers: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """The stored quiz of each of ``topic_numbers`` that has one, by topic number."""
+    topic_numbers = list(topic_numbers)
+    if not topic_numbers:
+        return {}
+    cursor = db.quizzes.find({"course_id": course_id, "topic_number": {"$in": topic_numbers}}, {"quiz": 1, "topic_number": 1})
+    return {quiz["topic_number"]: quiz async for quiz in cursor}
+
+
+def _stored_result(topic_number: int, quiz: Dict[str, Any]) -> Dict[str, Any]:
+    return {"topic_number": topic_number, "quiz": quiz["quiz"], "duplicates_removed": 0, "regenerated": False}
+
+
+async def generate(db, course_id: ObjectId, entries: List[Dict[str, Any]], force: bool = False,
+                   context: Optional[syllabus_context.SyllabusContext] = None,
+                   fallback: bool = True, fs=None) -> List[Dict[str, Any]]:
+    """
+    Make sure each topic in ``entries`` has an up-to-date quiz.
+
+    Topics whose quiz is current are returned from the store; the others are
+    generated with Gemini one after another. A failed topic is reported in the
+    results rather than raised. With a cached syllabus ``context`` (see
+    syllabus_context.for_course) every topic's call refers to the same cache;
+    given the GridFS bucket ``fs``, one about to expire is renewed between
+    topics. With ``fallback`` a topic Gemini fails on gets local flashcards
+    instead of an error; background jobs pass False and retry later.
+    """
+    current = [] if force else [entry["topic_number"] for entry in entries if roadmap_topics.quiz_is_current(entry)]
+    stored = await stored_quizzes(db, course_id, current)
+
+    results = []
+    index = await get_course_index(db, course_id)
+    try:
+        for entry in entries:
+            topic = entry.get("topic")
+            prompt = entry.get("preQuizPrompt")
+
+            if not topic or not prompt:
+                continue  # skip entries without quiz input data
+
+            topic_number = entry["topic_number"]
+            if topic_number in stored:
+                results.append(_stored_result(topic_number, stored[topic_number]))
+                continue
+
+            if fs is not None:
+                context = await syllabus_context.renew(db, fs, context)
+
+            # Shielded: if the client disconnects or time runs out mid-topic, the Gemini
+            # call is already paid for, so the topic is parked and still stored
+            work = asyncio.ensure_future(_generate_topic(db, course_id, entry, index, context, fallback))
+            try:
+                results.append(await asyncio.shield(work))
+            except asyncio.CancelledError:
+                if not work.done():
+                    deadlines.park(_save_parked_topic(work, course_id, index),
+                                   f"pre-quiz topic {topic_number} of course {course_id}")
+                raise
+            except deadlines.DeadlineExceeded:
+                raise
+            except Exception as e:
+                results.append({
+                    "topic_number": topic_number,
+                    "topic": topic,
+                    "error": f"Quiz generation failed: {e}"
+                })
+    finally:
+        # Keep the topics finished so far, also when the request is cut short
+        await save_course_index(course_id, index)
+
+    return results
+
+
+async def _generate_topic(db, course_id: ObjectId, entry: Dict[str, Any], index,
+                          context: Optional[syllabus_context.SyllabusContext] = None,
+                          fallback: bool = False) -> Dict[str, Any]:
+    """Generate, de-duplicate and store the flashcards of one roadmap topic (a roadmap_topics document)."""
+    topic, prompt, topic_number = entry["topic"], entry["preQuizPrompt"], entry["topic_number"]
+    quiz_prompt = f"""
+Create 10 flashcard-style questions to help a student study this topic:
+
+Topic: {topic}
+Prompt: {prompt}
+
+Each question should be a simple question or recall prompt, and each should have a clear answer.{_GROUNDING if context else ""}
+Return ONLY valid JSON in this format:
+[
+  {{
+    "question": "...",
+    "answer": "..."
+  }},
+  ...
+]
+"""
+
+    generator = None
+    try:
+        quiz_data = await _gemini_cards(quiz_prompt, context)
+    except deadlines.DeadlineExceeded:
+        raise
+    except Exception as e:
+        if not fallback:
+            raise
+        print(f"Gemini failed for topic {topic_number} ({e}); making its flashcards locally")
+        quiz_data = await _local_cards(db, course_id, entry)
+        generator = local_quiz.LOCAL
+
+    # Drop questions that repeat ones already asked elsewhere in the course
+    quiz_data, duplicates = filter_near_duplicates(
+        quiz_data, index, exclude_prefix=f"quiz:{topic_number}:"
+    )
+    if duplicates:
+        print(f"Dropped {len(duplicates)} near-duplicate questions for topic {topic_number}")
+
+    # Keep well-formed flashcards, indexed from 1 to 10
+    cards = Flashcard.parse_many(quiz_data)
+    for card in cards:
+        card.generator = generator
+    quiz_data = [card.to_bson() for card in cards]
+    if not quiz_data:
+        # Not stored: an empty quiz marked current would never be generated again
+        raise ValueError(f"No usable flashcards left ({len(duplicates)} near duplicates dropped)")
+
+    now = datetime.utcnow()
+    update = {"$set": {
+        "topic": topic,
+        "quiz": quiz_data,
+        "topic_revision": entry["revision"],
+        "created_at": now,
+        "updated_at": now,
+    }}
+    if generator:
+        update["$set"]["generator"] = generator
+    else:
+        update["$unset"] = {"generator": ""}
+    quiz = await db.quizzes.find_one_and_update(
+        {"course_id": course_id, "topic_number": topic_number},
+        update,
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    # The previous quiz of this topic is replaced, in the index as in the collection
+    index.remove_prefix(f"quiz:{topic_number}:")
+    index.add_many(pre_quiz_items(quiz["_id"], topic_number, quiz_data))
+    # A local quiz is recorded without its revision, so it does not count as current
+    await roadmap_topics.mark_quiz(db, course_id, topic_number, entry["revision"], quiz["_id"],
+                                   current=generator is None)
+
+    result = {
+        "topic_number": topic_number,
+        "quiz": quiz_data,
+        "duplicates_removed": len(duplicates),
+        "regenerated": True,
+    }
+    if generator:
+        result["generator"] = generator
+    return result
+
+
+async def _gemini_cards(quiz_prompt: str, context: Optional[syllabus_context.SyllabusContext]) -> List[Any]:
+    if context is not None:
+        response = await asyncio.to_thread(syllabus_context.generate, context, quiz_prompt)
+    else:
+        response = await asyncio.to_thread(llm.generate_content, quiz_prompt)
+    stripped = llm.response_text(response).strip()
+
+    if stripped.startswith("```"):
+        stripped = re.sub(r"^```[a-zA-Z]*\n", "", stripped)
+        stripped = re.sub(r"```$", "", stripped)
+        stripped = stripped.strip()
+
+    return json.loads(stripped)
+
+
+async def _local_cards(db, course_id: ObjectId, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flashcards made without Gemini from the topic's roadmap text and its most recent notes."""
+    texts = [entry.get("topic"), entry.get("preQuizPrompt"), entry.get("assignment")]
+    cursor = db.notes.find(
+        {"course_id": course_id, "topic_number": entry["topic_number"]}, {"content": 1, "structure": 1}
+    ).sort("created_at", -1).limit(3)
+    async for note in cursor:
+        texts.append(document_model.excerpt(note.get("content", ""), note.get("structure"), LOCAL_NOTES_CHARS))
+
+    cards = await asyncio.to_thread(local_quiz.flashcards, [text for text in texts if isinstance(text, str)])
+    if not cards:
+        raise ValueError("Gemini failed and the topic has too little text for local flashcards")
+    return [card.to_bson() for card in cards]
+
+
+async def _save_parked_topic(work: asyncio.Future, course_id: ObjectId, index):
+    await work
+    await save_course_index(course_id, index)
+
+
+# ---------------------------------------------------------------------------
+# Off-peak prefetch
+# ---------------------------------------------------------------------------
+
+def _off_peak_hours(spec: Optional[str] = None) -> Optional[range]:
+    spec = PREFETCH_HOURS if spec is None else spec
+    if not spec.strip():
+        return None
+    start, end = (int(part) % 24 for part in spec.split("-"))
+    # "22-5" wraps midnight: 22, 23, 0, ..., 4
+    return range(start, end) if start < end else range(start, end + 24)
+
+
+def is_off_peak(now: Optional[datetime] = None) -> bool:
+    hours = _off_peak_hours()
+    if hours is None:
+        return False
+    hour = (now or datetime.utcnow()).hour
+    return hour in hours or hour + 24 in hours
+
+
+async def prefetch_upcoming(db, days: int = PREFETCH_DAYS, limit: int = PREFETCH_MAX_TOPICS,
+                            max_seconds: float = PREFETCH_MAX_RUN_SECONDS) -> int:
+    """
+    Generate missing or outdated quizzes of topics starting in the next ``days``,
+    for ``max_seconds`` at most. Returns how many.
+    """
+    deadline = time.monotonic() + max_seconds
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    cursor = db.roadmap_topics.find(
+        {"starts_on": {"$gte": today, "$lt": today + timedelta(days=days)}},
+        {"course_id": 1, "topic_number": 1, "revision": 1, "quiz_id": 1, "quiz_revision": 1},
+    ).sort("starts_on", ASCENDING)
+
+    due: Dict[ObjectId, List[int]] = {}
+    count = 0
+    async for entry in cursor:
+        if count >= limit:
+            break
+        if not roadmap_topics.quiz_is_current(entry):
+            due.setdefault(entry["course_id"], []).append(entry["topic_number"])
+            count += 1
+
+    generated = 0
+    for course_id, topic_numbers in due.items():
+        if time.monotonic() > deadline:
+            print(f"Prefetch stopped after {max_seconds:g}s; the remaining courses wait for the next run")
+            break
+        # The same claim the route takes, so a user's request and the prefetch never overlap
+        async with shared_state.in_flight(f"pre_quiz:{course_id}") as leader:
+            if not leader:
+                continue
+            entries = await select_topics(db, course_id, topic_numbers)
+            results = await generate(db, course_id, entries, fallback=False)
+            generated += sum(1 for result in results if result.get("regenerated"))
+    return generated
+
+
+async def run_prefetch_scheduler(get_db):
+    """
+    Background loop: during off-peak hours, fill in the quizzes of upcoming topics.
+
+    Args:
+        get_db: Callable returning the current database handle
+    """
+    if _off_peak_hours() is None:
+        return
+    while True:
+        await asyncio.sleep(PREFETCH_INTERVAL_SECONDS)
+        if not is_off_peak():
+            continue
+        try:
+            # One worker prefetches at a time; the others wait for it and skip this round
+            async with shared_state.in_flight("pre_quiz:prefetch") as leader:
+                if not leader:
+                    continue
+                started = datetime.utcnow()
+                count = await prefetch_upcoming(get_db())
+                if count:
+                    print(f"Prefetched {count} pre-lecture quizzes in {(datetime.utcnow() - started).total_seconds():.1f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Pre-quiz prefetch failed: {e}")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""
+Prewarm - Background worker that generates quizzes before students ask for them.
+
+This module provides functionality to:
+1. Watch `roadmap_topics` and `notes` for new or changed roadmaps and new notes
+2. Queue pre-quiz and notes-quiz generation in a priority queue ordered by
+   roadmap date: upcoming topics soonest first, then undated, then past topics
+3. Throttle itself to its own share of the shared Gemini budget (PREWARM_RPM),
+   on top of the global GEMINI_RPM limit every worker observes
+4. Replace quizzes made locally while Gemini was failing (local_quiz.py) with
+   Gemini's once its circuit breaker is no longer open
+5. Run as a separate process, so interactive requests keep their latency:
+
+  python -m prewarm            # keep watching
+  python -m prewarm --once     # queue what is pending, drain it and exit
+
+Workers claim the same in-flight keys as the API routes (shared_state.py), so
+a topic a student is generating right now is skipped rather than done twice.
+"""
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+import circuit_breaker
+import llm
+import local_quiz
+import notes_quiz
+import pre_quiz
+import roadmap_topics
+import shared_state
+
+# Gemini requests per minute the prewarmer may use; defaults to a share of GEMINI_RPM
+PREWARM_SHARE = float(os.getenv("PREWARM_SHARE", "0.3"))
+PREWARM_RPM = float(os.getenv("PREWARM_RPM", "0")) or (llm.GEMINI_RPM * PREWARM_SHARE if llm.GEMINI_RPM else 30.0)
+
+# How often to look for new roadmaps and notes
+PREWARM_POLL_SECONDS = float(os.getenv("PREWARM_POLL_SECONDS", "10"))
+
+# How far back the first scan looks after the worker starts
+PREWARM_LOOKBACK_HOURS = float(os.getenv("PREWARM_LOOKBACK_HOURS", "24"))
+
+# Generation jobs run at once
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "2"))
+
+# Scans overlap by this much so writes committed slightly out of order are not missed
+_SCAN_OVERLAP = timedelta(seconds=5)
+
+PRE_QUIZ = "pre_quiz"
+NOTES_QUIZ = "notes_quiz"
+
+
+def priority(starts_on: Optional[datetime], topic_number: int, today: datetime) -> Tuple:
+    """Sort key of a topic: upcoming soonest first, then undated, then past (most recent first)."""
+    if starts_on is None:
+        return (1, 0.0, topic_number)
+    if starts_on >= today:
+        return (0, starts_on.timestamp(), topic_number)
+    return (2, -starts_on.timestamp(), topic_number)
+
+
+@dataclass(slots=True, order=True)
+class Job:
+    """One topic to generate a quiz for. Ordered by priority, then arrival."""
+
+    sort_key: Tuple
+    seq: int
+    kind: str = field(compare=False)
+    course_id: ObjectId = field(compare=False)
+    topic_number: int = field(compare=False)
+
+    @property
+    def key(self) -> Tuple[str, ObjectId, int]:
+        return self.kind, self.course_id, self.topic_number
+
+
+class PrewarmQueue:
+    """Priority queue of jobs; a topic already waiting is not queued twice."""
+
+    def __init__(self):
+        self._heap = []
+        self._queued: Set[Tuple[str, ObjectId, int]] = set()
+        self._seq = itertools.count()
+        self._available = asyncio.Event()
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, kind: str, course_id: ObjectId, topic_number: int, sort_key: Tuple) -> bool:
+        if (kind, course_id, topic_number) in self._queued:
+            return False
+        job = Job(sort_key, next(self._seq), kind, course_id, topic_number)
+        heapq.heappush(self._heap, job)
+        self._queued.add(job.key)
+        self._unfinished += 1
+        self._finished.clear()
+        self._available.set()
+        return True
+
+    async def pop(self) -> Job:
+        while not self._heap:
+            self._available.clear()
+            await self._available.wait()
+        job = heapq.heappop(self._heap)
+        self._queued.discard(job.key)
+        return job
+
+    def task_done(self):
+        """Mark a popped job as handled (as asyncio.Queue.task_done)."""
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._finished.set()
+
+    async def join(self):
+        """Wait until every queued job has been popped and handled."""
+        await self._finished.wait()
+
+
+async def ensure_indexes(db):
+    # Scans below look for recently changed topics and recently uploaded notes
+    await db.roadmap_topics.create_index([("updated_at", ASCENDING)])
+    await db.notes.create_index([("created_at", ASCENDING)])
+    # ... and for quizzes made locally, to be upgraded
+    await db.quizzes.create_index([("generator", ASCENDING)], sparse=True)
+    await db.notes_quizzes.create_index([("generator", ASCENDING)], sparse=True)
+
+
+async def _starts_on(db, course_id: ObjectId, topic_number: int) -> Optional[datetime]:
+    topic = await db.roadmap_topics.find_one({"course_id": course_id, "topic_number": topic_number}, {"starts_on": 1})
+    return topic.get("starts_on") if topic else None
+
+
+async def scan(db, queue: PrewarmQueue, since: datetime) -> int:
+    """Queue the topics changed and notes uploaded after ``since``. Returns how many jobs were added."""
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    added = 0
+
+    async for topic in db.roadmap_topics.find(
+        {"updated_at": {"$gt": since}},
+        {"course_id": 1, "topic_number": 1, "starts_on": 1, "preQuizPrompt": 1,
+         "revision": 1, "quiz_id": 1, "quiz_revision": 1},
+    ):
+        if topic.get("preQuizPrompt") and not roadmap_topics.quiz_is_current(topic):
+            added += queue.push(PRE_QUIZ, topic["course_id"], topic["topic_number"],
+                                priority(topic.get("starts_on"), topic["topic_number"], today))
+
+    async for note in db.notes.find({"created_at": {"$gt": since}}, {"course_id": 1, "topic_number": 1}):
+        course_id, topic_number = note.get("course_id"), note.get("topic_number")
+        if not isinstance(course_id, ObjectId) or topic_number is None:
+            continue
+        added += queue.push(NOTES_QUIZ, course_id, topic_number,
+                            priority(await _starts_on(db, course_id, topic_number), topic_number, today))
+
+    # Quizzes made locally while Gemini was failing, whatever their age; not while it still is
+    if llm.breaker.state != circuit_breaker.OPEN:
+        for kind, collection in ((PRE_QUIZ, db.quizzes), (NOTES_QUIZ, db.notes_quizzes)):
+            async for quiz in collection.find({"generator": local_quiz.LOCAL}, {"course_id": 1, "topic_number": 1}):
+                course_id, topic_number = quiz.get("course_id"), quiz.get("topic_number")
+                if isinstance(course_id, ObjectId) and topic_number is not None:
+                    added += queue.push(kind, course_id, topic_number,
+                                        priority(await _starts_on(db, course_id, topic_number), topic_number, today))
+    return added
+
+
+async def _pending(db, job: Job):
+    """The topic document for a pre-quiz job, True for a notes-quiz job, or None if nothing is left to do."""
+    if job.kind == PRE_QUIZ:
+        entries = await pre_quiz.select_topics(db, job.course_id, [job.topic_number])
+        return entries[0] if entries and not roadmap_topics.quiz_is_current(entries[0]) else None
+    return None if await notes_quiz.is_current(db, job.course_id, job.topic_number) else True
+
+
+async def run_job(db, fs, job: Job) -> bool:
+    """Generate one queued quiz unless it has become current meanwhile. True if Gemini was used."""
+    if job.kind == PRE_QUIZ:
+        key = f"pre_quiz:{job.course_id}"  # per course, as the route claims it
+    else:
+        key = f"notes_quiz:{job.course_id}:{job.topic_number}"
+
+    pending = await _pending(db, job)
+    if pending is None:
+        return False
+
+    # Stay within the prewarmer's share of the Gemini budget
+    await asyncio.to_thread(shared_state.wait_for_token, "gemini:prewarm", PREWARM_RPM, 1, 3600)
+
+    while pending is not None:
+        async with shared_state.in_flight(key) as leader:
+            if leader:
+                if job.kind == PRE_QUIZ:
+                    results = await pre_quiz.generate(db, job.course_id, [pending], fallback=False)
+                    errors = [result["error"] for result in results if "error" in result]
+                    if errors:
+                        raise RuntimeError(errors[0])
+                else:
+                    await notes_quiz.generate_for_topic(db, fs, job.course_id, job.topic_number, fallback=False)
+                return True
+        # Someone else held the claim (a student's request or another job of the
+        # same course); it may or may not have covered this topic
+        pending = await _pending(db, job)
+    return False
+
+
+async def run(db, fs, once: bool = False, poll: float = PREWARM_POLL_SECONDS,
+              concurrency: int = PREWARM_CONCURRENCY) -> int:
+    """
+    Scan and generate until cancelled (or, with ``once``, until the queue is empty).
+
+    Returns how many quizzes were generated.
+    """
+    await ensure_indexes(db)
+    queue = PrewarmQueue()
+    generated = 0
+    since = datetime.utcnow() - timedelta(hours=PREWARM_LOOKBACK_HOURS)
+
+    async def scanner():
+        nonlocal since
+        while True:
+            started = datetime.utcnow()
+            added = await scan(db, queue, since)
+            since = started - _SCAN_OVERLAP
+            if added:
+                print(f"Prewarm queued {added} quiz(zes); {len(queue)} waiting")
+            if once:
+                return
+            await asyncio.sleep(poll)
+
+    async def worker():
+        nonlocal generated
+        while True:
+            job = await queue.pop()
+            try:
+                if await run_job(db, fs, job):
+                    generated += 1
+                    print(f"Prewarmed {job.kind} for course {job.course_id}, topic {job.topic_number}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Prewarm of {job.kind} for course {job.course_id}, topic {job.topic_number} failed: {e}")
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await scanner()  # returns after one scan with ``once``
+        await queue.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="Drain what is pending and exit")
+    parser.add_argument("--poll", type=float, default=PREWARM_POLL_SECONDS, help="Seconds between scans")
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    args = parser.parse_args()
+
+    from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        raise SystemExit("Set MONGO_URI environment variable")
+
+    async def start():
+        client = AsyncIOMotorClient(uri, tlsAllowInvalidCertificates=True)
+        db = client["deep_learner"]
+        try:
+            print(f"Prewarm worker started ({PREWARM_RPM:g} Gemini requests/min, concurrency {args.concurrency})")
+            generated = await run(db, AsyncIOMotorGridFSBucket(db), once=args.once,
+                                  poll=args.poll, concurrency=args.concurrency)
+            print(f"Prewarmed {generated} quiz(zes)")
+        finally:
+            client.close()
+
+    try:
+        asyncio.run(start())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Quiz Events - Tell connected clients when a quiz of their course is ready, instead of being polled.
+
+This module provides functionality to:
+1. Watch `quizzes` and `notes_quizzes` with one MongoDB change stream per
+   process (on the database, filtered to those two collections), resuming
+   from the last event after a dropped connection
+2. Without a replica set (change streams unsupported), poll instead: one
+   query per collection every QUIZ_EVENTS_POLL_SECONDS for all courses with
+   subscribers together, however many clients are connected
+3. Fan each change out through an in-process hub to the subscribers of its
+   course; a subscriber that stops reading loses its oldest events, not the
+   others' (QUIZ_EVENTS_QUEUE)
+4. Serve subscribers as server-sent events, with keep-alive comments on idle
+   connections
+
+Events (`GET /courses/{id}/quiz-events`, optionally `?topic_number=n`):
+  event: pre_quiz | notes_quiz
+  data: {"type": ..., "course_id": "...", "topic_number": n, "quiz_id": "...", "generator"?: "local"}
+
+A client subscribes first and then fetches the quiz once, so a quiz finished
+in between is not missed; after that it fetches again on each event.
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Where changes come from: "stream" (change streams, needs a replica set),
+# "poll", or "auto" (change streams, polling where they are unsupported)
+QUIZ_EVENTS_SOURCE = os.getenv("QUIZ_EVENTS_SOURCE", "auto")
+
+# Seconds between polls when polling
+QUIZ_EVENTS_POLL_SECONDS = float(os.getenv("QUIZ_EVENTS_POLL_SECONDS", "2"))
+
+# Events held for a subscriber that is not reading; older ones are dropped
+QUIZ_EVENTS_QUEUE = int(os.getenv("QUIZ_EVENTS_QUEUE", "100"))
+
+# Seconds between keep-alive comments on an idle connection
+QUIZ_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("QUIZ_EVENTS_KEEPALIVE_SECONDS", "15"))
+
+PRE_QUIZ = "pre_quiz"
+NOTES_QUIZ = "notes_quiz"
+
+# Watched collections, the event type of each and the field that changes on every write
+_COLLECTIONS = {"quizzes": (PRE_QUIZ, "updated_at"), "notes_quizzes": (NOTES_QUIZ, "created_at")}
+
+# Polls read back this far, so writes committed out of order are not missed
+_POLL_OVERLAP = timedelta(seconds=5)
+
+# Server error codes meaning change streams are not available on this deployment
+_NO_CHANGE_STREAMS = {40573, 40324, 115}
+
+_RETRY_SECONDS = 5
+
+
+async def ensure_indexes(db):
+    # The polling fallback reads notes quizzes by course and time (pre-lecture quizzes: see delta_sync.py)
+    await db.notes_quizzes.create_index([("course_id", ASCENDING), ("created_at", ASCENDING)])
+
+
+def _event(collection: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    kind = _COLLECTIONS[collection][0]
+    event = {
+        "type": kind,
+        "course_id": str(doc.get("course_id")),
+        "topic_number": doc.get("topic_number"),
+        "quiz_id": str(doc["_id"]),
+    }
+    if doc.get("generator"):
+        event["generator"] = doc["generator"]
+    return event
+
+
+def _unsupported(err: Exception) -> bool:
+    if isinstance(err, NotImplementedError):
+        return True
+    return isinstance(err, OperationFailure) and (
+        err.code in _NO_CHANGE_STREAMS or "replica set" in str(err).lower()
+    )
+
+
+class Hub:
+    """One source of quiz changes per process, fanned out to the subscribers of each course."""
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.source: Optional[str] = None  # "stream" or "poll" once running
+        self.published = 0
+
+    def subscribe(self, course_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=QUIZ_EVENTS_QUEUE)
+        self.subscribers.setdefault(course_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, course_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(course_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[course_id]
+
+    def publish(self, event: Dict[str, Any]):
+        for queue in self.subscribers.get(event["course_id"], ()):
+            if queue.full():
+                queue.get_nowait()  # the oldest event goes; the client refetches anyway
+            queue.put_nowait(event)
+        self.published += 1
+
+    async def run(self, get_db):
+        """
+        Background loop feeding the hub until cancelled.
+
+        Args:
+            get_db: Callable returning the current database handle
+        """
+        if QUIZ_EVENTS_SOURCE != "poll":
+            try:
+                await self._stream(get_db)
+                return
+            except Exception as err:
+                if QUIZ_EVENTS_SOURCE == "stream" or not _unsupported(err):
+                    raise
+                print(f"Change streams unavailable ({err}); polling for quiz changes every "
+                      f"{QUIZ_EVENTS_POLL_SECONDS}s")
+        await self._poll(get_db)
+
+    async def _stream(self, get_db):
+        pipeline = [
+            {"$match": {"ns.coll": {"$in": list(_COLLECTIONS)},
+                        "operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$project": {"ns.coll": 1, "fullDocument._id": 1, "fullDocument.course_id": 1,
+                          "fullDocument.topic_number": 1, "fullDocument.generator": 1}},
+        ]
+        resume_token = None
+        while True:
+            try:
+                async with get_db().watch(pipeline, full_document="updateLookup",
+                                          resume_after=resume_token) as stream:
+                    self.source = "stream"
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        if change.get("fullDocument"):
+                            self.publish(_event(change["ns"]["coll"], change["fullDocument"]))
+            except PyMongoError as err:
+                if _unsupported(err) and self.source is None:
+                    raise
+                print(f"Quiz change stream interrupted, resuming in {_RETRY_SECONDS}s: {err}")
+                await asyncio.sleep(_RETRY_SECONDS)
+
+    async def _poll(self, get_db):
+        self.source = "poll"
+        since = datetime.utcnow()
+        seen: Dict[Tuple[str, Any], datetime] = {}  # (collection, _id) -> the write already published
+        while True:
+            await asyncio.sleep(QUIZ_EVENTS_POLL_SECONDS)
+            if not self.subscribers:
+                since = datetime.utcnow()
+                seen.clear()
+                continue
+            started = datetime.utcnow()
+            course_ids = [ObjectId(course_id) for course_id in self.subscribers]
+            try:
+                for collection, (_, stamp) in _COLLECTIONS.items():
+                    cursor = get_db()[collection].find(
+                        {"course_id": {"$in": course_ids}, stamp: {"$gt": since - _POLL_OVERLAP}},
+                        {"course_id": 1, "topic_number": 1, "generator": 1, stamp: 1},
+                    )
+                    async for doc in cursor:
+                        if seen.get((collection, doc["_id"])) == doc[stamp]:
+                            continue
+                        seen[(collection, doc["_id"])] = doc[stamp]
+                        self.publish(_event(collection, doc))
+            except PyMongoError as err:
+                print(f"Polling for quiz changes failed: {err}")
+                continue
+            since = started
+            horizon = since - _POLL_OVERLAP
+            seen = {key: at for key, at in seen.items() if at > horizon}
+
+
+hub = Hub()
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream(course_id: str, topic_number: Optional[int] = None) -> AsyncIterator[str]:
+    """Server-sent events of the course's quizzes (one topic's, if given) until the client leaves."""
+    queue = hub.subscribe(course_id)
+    try:
+        yield f"retry: {_RETRY_SECONDS * 1000}\n: subscribed\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), QUIZ_EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if topic_number is None or event["topic_number"] == topic_number:
+                yield _sse(event)
+    finally:
+        hub.unsubscribe(course_id, queue)
+
+
+def metrics() -> Dict[str, Any]:
+    """Where changes come from, who is subscribed and how many events went out."""
+    return {
+        "source": hub.source,
+        "courses": len(hub.subscribers),
+        "subscribers": sum(len(queues) for queues in hub.subscribers.values()),
+        "published": hub.published,
+    }
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Quiz Quality - Check a batch of generated multiple-choice questions before it is stored.
+
+This module provides functionality to:
+1. Repair what can be repaired: "A) " style prefixes on options, a correctAnswer
+   given as a letter or differing from its option only in case or spacing, and
+   distractors that near-duplicate another option (dropped while 3 options remain)
+2. Reject the rest, with the reason:
+     invalid            - fields missing, or correctAnswer not one of the options
+     duplicate_options  - the correct answer has a near twin, or < 3 options left
+     answer_in_question - the question text gives the correct answer away
+     duplicate_question - near-identical to an earlier question of the batch
+                          (or to one it must not repeat)
+3. Score the whole batch at once with rapidfuzz: every option against every
+   option (one cdist, masked to each question's own options), every answer
+   against its question (cpdist) and every question against the others (cdist)
+4. Keep running counts per model and prompt version in `quiz_quality`, so a
+   prompt change that makes worse quizzes shows up as a lower acceptance rate
+
+Stored counts:
+  {"_id": "<model>:<prompt version>", "model": ..., "prompt_version": ...,
+   "batches": n, "generated": n, "accepted": n, "repaired": n, "rejected": n,
+   "replacement_calls": n, "reasons": {"<reason>": n, ...}, "updated_at": ...}
+
+Used by notes_quiz_generator.py, which asks Gemini for replacements of the
+rejected slots only.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from models import MultipleChoiceQuestion
+
+# Options of one question at least this similar (0-100) count as the same option
+QUIZ_OPTION_SIMILARITY = float(os.getenv("QUIZ_OPTION_SIMILARITY", "90"))
+
+# Questions of one batch at least this similar (0-100) count as the same question
+QUIZ_QUESTION_SIMILARITY = float(os.getenv("QUIZ_QUESTION_SIMILARITY", "90"))
+
+# Rounds of replacement requests for rejected questions (0 to only drop them)
+QUIZ_REPLACEMENT_ROUNDS = int(os.getenv("QUIZ_REPLACEMENT_ROUNDS", "1"))
+
+INVALID = "invalid"
+DUPLICATE_OPTIONS = "duplicate_options"
+ANSWER_IN_QUESTION = "answer_in_question"
+DUPLICATE_QUESTION = "duplicate_question"
+
+_MIN_OPTIONS = 3
+
+# An answer this much contained in its question (partial ratio) gives it away ...
+_LEAK_SIMILARITY = 95
+# ... if it is long enough to mean something
+_LEAK_MIN_CHARS = 4
+
+_PREFIX = re.compile(r"^\s*(?:\(?[A-Da-d][.):]|[A-Da-d]\s*-)\s+")
+_LETTER = re.compile(r"^\s*\(?([A-Da-d])[.)]?\s*$")
+
+
+@dataclass(slots=True)
+class Report:
+    """The outcome of validating one batch: what was kept, repaired and rejected."""
+
+    kept: List[MultipleChoiceQuestion] = field(default_factory=list)
+    rejected: List[Tuple[Any, str]] = field(default_factory=list)  # (item, reason)
+    repaired: int = 0
+
+    @property
+    def generated(self) -> int:
+        return len(self.kept) + len(self.rejected)
+
+    def reasons(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for _, reason in self.rejected:
+            counts[reason] = counts.get(reason, 0) + 1
+        return counts
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text).lower()).split())
+
+
+def _repair(item: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """The item with option prefixes stripped and correctAnswer pointing at its option."""
+    options = item.get("options")
+    answer = item.get("correctAnswer")
+    if not isinstance(options, list) or not options or answer is None:
+        return item, False
+
+    cleaned = [_PREFIX.sub("", str(option)).strip() for option in options]
+    fixed_answer = answer
+    if answer not in cleaned:
+        letter = _LETTER.match(str(answer))
+        stripped = _PREFIX.sub("", str(answer)).strip()
+        by_text = [option for option in cleaned if _normalize(option) == _normalize(stripped)]
+        if letter and "abcd".index(letter.group(1).lower()) < len(cleaned):
+            fixed_answer = cleaned["abcd".index(letter.group(1).lower())]
+        elif len(by_text) == 1:
+            fixed_answer = by_text[0]
+        else:
+            fixed_answer = stripped
+
+    changed = cleaned != options or fixed_answer != answer
+    return ({**item, "options": cleaned, "correctAnswer": fixed_answer} if changed else item), changed
+
+
+def validate(items: Iterable[Any], avoid: Iterable[str] = ()) -> Report:
+    """
+    Repair, check and split a batch of questions as parsed from Gemini's JSON.
+
+    ``avoid`` are questions the batch must not repeat (e.g. the ones kept
+    before asking for replacements). Kept questions are renumbered from 1
+    after ``avoid``.
+    """
+    from rapidfuzz import fuzz, process
+
+    report = Report()
+    parsed: List[MultipleChoiceQuestion] = []
+    repaired: List[bool] = []
+    for item in items:
+        if isinstance(item, dict):
+            item, changed = _repair(item)
+        else:
+            changed = False
+        try:
+            parsed.append(MultipleChoiceQuestion.parse(item))
+            repaired.append(changed)
+        except ValueError:
+            report.rejected.append((item, INVALID))
+    if not parsed:
+        return report
+
+    # Options: one matrix over all options of the batch, only pairs within a question count
+    owners = np.array([i for i, q in enumerate(parsed) for _ in q.options])
+    options = [_normalize(option) for q in parsed for option in q.options]
+    same_question = owners[:, None] == owners[None, :]
+    option_similarity = process.cdist(options, options, scorer=fuzz.ratio, dtype=np.uint8) >= QUIZ_OPTION_SIMILARITY
+    option_similarity &= same_question
+    np.fill_diagonal(option_similarity, False)
+
+    # Answers given away by their question
+    questions = [_normalize(q.question) for q in parsed]
+    answers = [_normalize(q.correct_answer) for q in parsed]
+    leaks = np.asarray(process.cpdist(answers, questions, scorer=fuzz.partial_ratio)) >= _LEAK_SIMILARITY
+
+    # Questions against each other and the ones to avoid
+    avoid = [_normalize(text) for text in avoid]
+    question_similarity = process.cdist(questions, questions + avoid, scorer=fuzz.token_sort_ratio,
+                                        dtype=np.uint8) >= QUIZ_QUESTION_SIMILARITY
+
+    offset = 0
+    kept_rows: List[int] = []
+    for i, question in enumerate(parsed):
+        rows = range(offset, offset + len(question.options))
+        offset += len(question.options)
+        fixed = repaired[i]
+
+        answer_row = next(row for row in rows if question.options[row - rows.start] == question.correct_answer)
+        if option_similarity[answer_row].any():
+            report.rejected.append((question.to_bson(), DUPLICATE_OPTIONS))
+            continue
+        keep = []
+        for row in rows:
+            if any(option_similarity[row, other] for other in keep):
+                continue  # a near twin of a distractor kept already
+            keep.append(row)
+        if len(keep) < len(question.options):
+            if len(keep) < _MIN_OPTIONS:
+                report.rejected.append((question.to_bson(), DUPLICATE_OPTIONS))
+                continue
+            question.options = [question.options[row - rows.start] for row in keep]
+            fixed = True
+
+        if leaks[i] and len(answers[i]) >= _LEAK_MIN_CHARS:
+            report.rejected.append((question.to_bson(), ANSWER_IN_QUESTION))
+            continue
+
+        if question_similarity[i, kept_rows].any() or question_similarity[i, len(parsed):].any():
+            report.rejected.append((question.to_bson(), DUPLICATE_QUESTION))
+            continue
+
+        kept_rows.append(i)
+        report.kept.append(question)
+        report.repaired += fixed
+
+    for number, question in enumerate(report.kept, start=len(avoid) + 1):
+        question.id = number
+    return report
+
+
+def merge(first: Report, second: Report) -> Report:
+    """One report of a batch and its replacements."""
+    return Report(first.kept + second.kept, first.rejected + second.rejected, first.repaired + second.repaired)
+
+
+def summary(report: Report, model: str, prompt_version: str, replacement_calls: int = 0) -> Dict[str, Any]:
+    """The counts of a report, as stored with the quiz and added to `quiz_quality`."""
+    return {
+        "model": model,
+        "prompt_version": prompt_version,
+        "generated": report.generated,
+        "accepted": len(report.kept),
+        "repaired": report.repaired,
+        "rejected": len(report.rejected),
+        "replacement_calls": replacement_calls,
+        "reasons": report.reasons(),
+    }
+
+
+async def record(db, quality: Optional[Dict[str, Any]]):
+    """Add the counts of one generated quiz (``summary``) to its model and prompt version."""
+    if not quality:
+        return
+    increments = {key: quality[key] for key in ("generated", "accepted", "repaired", "rejected", "replacement_calls")}
+    increments["batches"] = 1
+    for reason, count in quality["reasons"].items():
+        increments[f"reasons.{reason}"] = count
+    await db.quiz_quality.update_one(
+        {"_id": f"{quality['model']}:{quality['prompt_version']}"},
+        {"$inc": increments,
+         "$set": {"model": quality["model"], "prompt_version": quality["prompt_version"],
+                  "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+async def metrics(db) -> List[Dict[str, Any]]:
+    """Counts per model and prompt version with their acceptance rate, best first."""
+    rows = await db.quiz_quality.find({}).to_list(length=None)
+    for row in rows:
+        row["acceptance_rate"] = round(row.get("accepted", 0) / row["generated"], 3) if row.get("generated") else None
+    return sorted(rows, key=lambda row: -(row["acceptance_rate"] or 0))
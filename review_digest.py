@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+Review Digest - Precomputed per-user daily review queues.
+
+This module provides functionality to:
+1. Materialize each user's due-today queue into a single `review_digests` document
+2. Keep that document current incrementally on every attempt and rating update
+   (several attempts of a user at once after batched writes)
+3. Rebuild the digests of all active users at UTC day rollover from a background scheduler
+4. Record when each card last changed today and which cards left the queue,
+   so clients can sync only those (see delta_sync.py)
+5. Write each digest only if it is still the version that was read (retrying
+   on conflict), so concurrent attempts, ratings and flushes of one user do
+   not overwrite each other's changes
+6. Count the user's cards coming due on each of the next days (`upcoming`),
+   which scheduling uses to spread new due dates over lightly loaded days
+
+A digest holds at most DIGEST_MAX_CARDS cards (the most overdue), keeping it
+far below MongoDB's document size limit; `total` and `counts` still cover
+every due card. Such a digest is rebuilt rather than merged into, since it
+does not hold the cards that would move up.
+
+`GET /users/{user_id}/schedule` then becomes a single keyed read.
+"""
+
+import asyncio
+import os
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+
+import shared_state
+from models import Attempt, ReviewItem
+from spaced_repetition import MAX_INTERVAL
+
+# Users with an attempt in this many days get their digest rebuilt at rollover
+ACTIVE_USER_DAYS = 30
+
+# How many digests are rebuilt at once during rollover
+REBUILD_CONCURRENCY = 8
+
+# Cards kept in a digest, most overdue first
+DIGEST_MAX_CARDS = int(os.getenv("DIGEST_MAX_CARDS", "1000"))
+
+# Times a digest write is retried after another writer changed the digest first
+_WRITE_ATTEMPTS = 5
+
+
+def _today() -> str:
+    return str(datetime.utcnow().date())
+
+
+def card_id(attempt_id, question_number) -> str:
+    """Stable id of a card in the digest."""
+    return f"{attempt_id}:{question_number}"
+
+
+def _due_cards(attempt: Attempt, today: str, course_id: Optional[str]) -> List[ReviewItem]:
+    return [
+        ReviewItem(
+            card_id=card_id(attempt.id, response.question_number),
+            attempt_id=str(attempt.id),
+            quiz_id=str(attempt.quiz_id),
+            course_id=course_id,
+            topic_number=attempt.topic_number,
+            question_number=response.question_number,
+            question=response.question,
+            answer=response.answer,
+            due_date=response.next_due_date,
+        )
+        for response in attempt.responses
+        if response.is_due(today)
+    ]
+
+
+def _upcoming(attempts: Iterable[Attempt], today: str) -> Counter:
+    """Cards of ``attempts`` coming due after today (as far ahead as intervals reach), by due date."""
+    horizon = str(date.fromisoformat(today) + timedelta(days=int(MAX_INTERVAL)))
+    return Counter(
+        response.next_due_date
+        for attempt in attempts
+        for response in attempt.responses
+        if response.next_due_date and today < response.next_due_date <= horizon
+    )
+
+
+def load_of(digest: Optional[Dict[str, Any]], today: Optional[date] = None) -> Optional[np.ndarray]:
+    """
+    A digest's upcoming due counts indexed by day offset from today, as
+    spaced_repetition.fuzz_intervals takes them; None without a digest.
+    """
+    if not digest or "upcoming" not in digest:
+        return None
+    today = today or datetime.utcnow().date()
+    load = np.zeros(int(MAX_INTERVAL) + 1)
+    for due, count in digest["upcoming"].items():
+        offset = (date.fromisoformat(due) - today).days
+        if 0 < offset < load.shape[0]:
+            load[offset] = count
+    return load
+
+
+async def due_loads(db, user_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+    """Upcoming due counts (see load_of) of several users, in one read of their digests."""
+    cursor = db.review_digests.find({"_id": {"$in": list(set(user_ids))}}, {"upcoming": 1})
+    loads = {}
+    async for digest in cursor:
+        load = load_of(digest)
+        if load is not None:
+            loads[digest["_id"]] = load
+    return loads
+
+
+def _card_changes(previous: Optional[Dict[str, Any]], cards: List[Dict[str, Any]],
+                  now: datetime) -> Tuple[Dict[str, datetime], Dict[str, datetime]]:
+    """
+    When each card last changed, and when cards that left the queue today left it.
+
+    Cards identical to their copy in ``previous`` (the same day's digest) keep
+    its time; everything else changed ``now``.
+    """
+    if not previous:
+        return {c["card_id"]: now for c in cards}, {}
+    before = {c["card_id"]: c for c in previous["cards"]}
+    stamps = previous.get("changed_at", {})
+    changed = {}
+    for card in cards:
+        key = card["card_id"]
+        changed[key] = stamps[key] if key in stamps and before.get(key) == card else now
+    removed = {key: at for key, at in previous.get("removed", {}).items() if key not in changed}
+    removed.update({key: now for key in before if key not in changed})
+    if len(removed) > DIGEST_MAX_CARDS:
+        removed = dict(sorted(removed.items(), key=lambda item: item[1])[-DIGEST_MAX_CARDS:])
+    return changed, removed
+
+
+def _digest(user_id: str, today: str, cards: List[ReviewItem], upcoming: Counter,
+            previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Order the cards (most overdue first) and compute counts by course and topic.
+    ``previous`` is the digest being replaced, whose change times carry over if it is from today.
+    """
+    cards.sort(key=ReviewItem.sort_key)
+    by_course: Dict[str, int] = {}
+    by_topic: Dict[str, int] = {}
+    for c in cards:
+        course = c.course_id or "unknown"
+        by_course[course] = by_course.get(course, 0) + 1
+        topic_key = f"{course}:{c.topic_number}"
+        by_topic[topic_key] = by_topic.get(topic_key, 0) + 1
+
+    now = datetime.utcnow()
+    stored = [c.to_bson() for c in cards[:DIGEST_MAX_CARDS]]
+    changed, removed = _card_changes(previous if previous and previous.get("day") == today else None, stored, now)
+    return {
+        "_id": user_id,
+        "day": today,
+        "total": len(cards),
+        "counts": {"by_course": by_course, "by_topic": by_topic},
+        "cards": stored,
+        "truncated": len(cards) > len(stored),
+        "changed_at": changed,
+        "removed": removed,
+        "upcoming": {due: count for due, count in sorted(upcoming.items()) if count > 0 and due > today},
+        "updated_at": now,
+    }
+
+
+async def _store(db, digest: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> bool:
+    """Write ``digest`` over ``previous`` (None: there was none). False if another writer got there first."""
+    digest["version"] = (previous or {}).get("version", 0) + 1
+    if previous is None:
+        try:
+            await db.review_digests.insert_one(digest)
+            return True
+        except DuplicateKeyError:
+            return False
+    result = await db.review_digests.replace_one({"_id": digest["_id"], "version": previous.get("version")}, digest)
+    return result.matched_count == 1
+
+
+async def _course_ids_for(db, attempts: List[Attempt]) -> Dict[Any, Optional[str]]:
+    """Resolve course ids for attempts stored before attempts carried `course_id`."""
+    missing = {a.quiz_id for a in attempts if not a.course_id}
+    resolved = {}
+    if missing:
+        async for quiz in db.quizzes.find({"_id": {"$in": list(missing)}}, {"course_id": 1}):
+            resolved[quiz["_id"]] = str(quiz["course_id"])
+    return {
+        a.id: str(a.course_id) if a.course_id else resolved.get(a.quiz_id)
+        for a in attempts
+    }
+
+
+async def rebuild_digest(db, user_id: str) -> Dict[str, Any]:
+    """Recompute a user's digest from their attempts and store it."""
+    for _ in range(_WRITE_ATTEMPTS):
+        today = _today()
+        previous = await db.review_digests.find_one({"_id": user_id})
+        # Decode each document as it arrives; only the compact models are kept
+        attempts = [
+            Attempt.from_bson(doc)
+            async for doc in db.attempts.find(
+                {"user_id": user_id},
+                {"quiz_id": 1, "course_id": 1, "topic_number": 1, "responses": 1}
+            )
+        ]
+        courses = await _course_ids_for(db, attempts)
+
+        cards = []
+        for attempt in attempts:
+            cards.extend(_due_cards(attempt, today, courses[attempt.id]))
+
+        digest = _digest(user_id, today, cards, _upcoming(attempts, today), previous)
+        if await _store(db, digest, previous):
+            return digest
+    print(f"Review digest of user {user_id} kept changing during {_WRITE_ATTEMPTS} rebuilds; left as is")
+    return await db.review_digests.find_one({"_id": user_id}) or digest
+
+
+async def get_digest(db, user_id: str) -> Dict[str, Any]:
+    """Return today's digest, rebuilding it only if it is missing or from an earlier day."""
+    digest = await db.review_digests.find_one({"_id": user_id})
+    if digest and digest.get("day") == _today():
+        return digest
+    print(f"Review digest for user {user_id} is missing or stale, rebuilding")
+    return await rebuild_digest(db, user_id)
+
+
+async def refresh_for_attempt(db, attempt, before: Optional[Attempt] = None):
+    """
+    Merge the due cards of a new or changed attempt (model or document) into the
+    owner's digest; ``before`` is a changed attempt as it was.
+    """
+    if not isinstance(attempt, Attempt):
+        attempt = Attempt.from_bson(attempt)
+    await refresh_for_attempts(db, attempt.user_id, [attempt], [before] if before else None)
+
+
+async def refresh_for_attempts(db, user_id: str, attempts: List[Attempt],
+                               before: Optional[List[Attempt]] = None):
+    """
+    Merge the due cards of several attempts of one user into their digest in a
+    single write, re-reading and merging again if another writer came first.
+    ``before`` holds changed attempts as they were, whose upcoming due dates no
+    longer count; new attempts have none.
+    """
+    courses = await _course_ids_for(db, attempts)
+    prefixes = tuple(f"{attempt.id}:" for attempt in attempts)
+    for _ in range(_WRITE_ATTEMPTS):
+        digest = await db.review_digests.find_one({"_id": user_id})
+        today = _today()
+        if not digest or digest.get("day") != today or digest.get("truncated") or "upcoming" not in digest:
+            await rebuild_digest(db, user_id)
+            return
+
+        cards = [ReviewItem.from_bson(c) for c in digest["cards"] if not c["card_id"].startswith(prefixes)]
+        for attempt in attempts:
+            cards.extend(_due_cards(attempt, today, courses[attempt.id]))
+        upcoming = Counter(digest["upcoming"])
+        upcoming.update(_upcoming(attempts, today))
+        upcoming.subtract(_upcoming(before or [], today))
+        if await _store(db, _digest(user_id, today, cards, upcoming, digest), digest):
+            return
+    print(f"Review digest of user {user_id} kept changing while merging {len(attempts)} attempts, rebuilding")
+    await rebuild_digest(db, user_id)
+
+
+async def ensure_indexes(db):
+    """Indexes used by digest rebuilds."""
+    await db.attempts.create_index([("user_id", 1), ("taken_at", -1)])
+    await db.attempts.create_index("taken_at")
+
+
+async def active_user_ids(db) -> List[str]:
+    """Users with at least one attempt in the last ACTIVE_USER_DAYS days."""
+    since = datetime.utcnow() - timedelta(days=ACTIVE_USER_DAYS)
+    return await db.attempts.distinct("user_id", {"taken_at": {"$gte": since}})
+
+
+async def rebuild_active_digests(db) -> int:
+    """Rebuild every active user's digest with bounded concurrency."""
+    user_ids = await active_user_ids(db)
+    semaphore = asyncio.Semaphore(REBUILD_CONCURRENCY)
+
+    async def rebuild(user_id):
+        async with semaphore:
+            try:
+                await rebuild_digest(db, user_id)
+            except Exception as e:
+                print(f"Failed to rebuild review digest for user {user_id}: {e}")
+
+    await asyncio.gather(*(rebuild(u) for u in user_ids))
+    return len(user_ids)
+
+
+def seconds_until_rollover(now: Optional[datetime] = None) -> float:
+    """Seconds until the next UTC midnight."""
+    now = now or datetime.utcnow()
+    tomorrow = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    return (tomorrow - now).total_seconds()
+
+
+async def run_digest_scheduler(get_db):
+    """
+    Background loop: rebuild active users' digests right after each UTC midnight,
+    in one worker across all workers and hosts.
+
+    Args:
+        get_db: Callable returning the current database handle
+    """
+    while True:
+        await asyncio.sleep(seconds_until_rollover() + 1)
+        key = f"review_digest:rollover:{datetime.utcnow().date()}"
+        try:
+            # One worker (on any host) rebuilds per day; the others wait for it and skip,
+            # and a worker waking up after it finished sees the day marked done
+            async with shared_state.in_flight(key) as leader:
+                if not leader or await asyncio.to_thread(shared_state.current_version, key):
+                    continue
+                started = datetime.utcnow()
+                count = await rebuild_active_digests(get_db())
+                await asyncio.to_thread(shared_state.invalidate, key)
+                print(f"Rebuilt {count} review digests in {(datetime.utcnow() - started).total_seconds():.1f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Review digest rollover failed: {e}")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+Review Session - Review due cards over one WebSocket instead of a request per card.
+
+This module provides functionality to:
+1. Stream a user's due cards in priority order (most overdue first, as in the
+   review digest), REVIEW_PREFETCH cards ahead of the one being reviewed, so
+   the next card is always on the client already
+2. Take ratings as a stream and acknowledge them at once
+3. Coalesce ratings into batches (REVIEW_SYNC_BATCH ratings or
+   REVIEW_SYNC_SECONDS after the first pending one, whichever comes first):
+   one read of the rated attempts, one vectorized reschedule (spread over the
+   user's lightly loaded days, from the digest), one bulk_write
+   with an atomic update per attempt, one digest write
+4. Flush pending ratings when the client ends the session or disconnects
+
+Protocol (JSON messages on `/users/{user_id}/review`):
+  server -> {"type": "session", "total": n, "counts": {...}, "day": "..."}
+  server -> {"type": "card", "card": {card_id, question, answer, due_date, ...}}
+  client -> {"type": "rate", "card_id": "...", "rating": "easy|medium|hard|dont_know"}
+  server -> {"type": "ack", "card_id": "..."}
+  server -> {"type": "saved", "cards": [{"card_id", "next_due"}], "failed": [...]}
+            ("unconfirmed": [...] instead of "cards" if an attempt changed meanwhile)
+  client -> {"type": "sync"}   (save pending ratings now)
+  client -> {"type": "end"}    (save pending ratings and close)
+  server -> {"type": "done", "reviewed": n}   (no cards left, all saved)
+  server -> {"type": "error", "detail": "..."}
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from bson import ObjectId
+from fastapi import WebSocket, WebSocketDisconnect
+from pymongo import UpdateOne
+
+import review_digest
+from models import Attempt
+from spaced_repetition import RATING_CODES, schedule_reviews
+
+# Cards sent ahead of the one being reviewed
+REVIEW_PREFETCH = int(os.getenv("REVIEW_PREFETCH", "2"))
+
+# Ratings saved together, and the longest a rating waits to be saved
+REVIEW_SYNC_BATCH = int(os.getenv("REVIEW_SYNC_BATCH", "20"))
+REVIEW_SYNC_SECONDS = float(os.getenv("REVIEW_SYNC_SECONDS", "2"))
+
+# Card fields a saved rating requires unchanged since they were read; rescheduling moves them
+_GUARD_FIELDS = ("repetitions", "last_reviewed")
+
+
+@dataclass(slots=True)
+class Rating:
+    """A rating received in a session, not yet saved."""
+
+    card_id: str
+    attempt_id: ObjectId
+    question_number: int
+    rating: str
+
+
+def parse_rating(message: Dict[str, Any]) -> Rating:
+    """The rating in a "rate" message. Raises ValueError saying what is wrong."""
+    card_id = message.get("card_id")
+    rating = message.get("rating")
+    if rating not in RATING_CODES:
+        raise ValueError(f"rating must be one of {sorted(RATING_CODES)}")
+    try:
+        attempt_id, question_number = str(card_id).rsplit(":", 1)
+        return Rating(card_id, ObjectId(attempt_id), int(question_number), rating)
+    except Exception:
+        raise ValueError(f"Invalid card id: {card_id!r}")
+
+
+async def save_ratings(db, user_id: str, ratings: List[Rating]) -> Dict[str, Any]:
+    """
+    Reschedule and store a batch of ratings of one user's cards.
+
+    A card rated twice in the batch keeps its last rating. Every attempt gets
+    one atomic update of just its rated responses (by array index, guarded by
+    the question number, repetitions and last review found there, so a card
+    rescheduled meanwhile by another session is not overwritten), all in one
+    unordered bulk_write.
+
+    Returns:
+        {"cards": [{"card_id", "next_due"}], "failed": [card ids not saved]}, or with
+        "unconfirmed" card ids instead of "cards" when an attempt changed meanwhile
+    """
+    latest: Dict[str, Rating] = {}
+    for rating in ratings:
+        latest.pop(rating.card_id, None)
+        latest[rating.card_id] = rating
+
+    attempt_ids = list({rating.attempt_id for rating in latest.values()})
+    docs = {doc["_id"]: doc async for doc in db.attempts.find({"_id": {"$in": attempt_ids}, "user_id": user_id})}
+    attempts = {attempt_id: Attempt.from_bson(doc) for attempt_id, doc in docs.items()}
+
+    targets = []  # (rating, attempt, response index)
+    failed = []
+    for rating in latest.values():
+        attempt = attempts.get(rating.attempt_id)
+        index = next((i for i, response in enumerate(attempt.responses)
+                      if response.question_number == rating.question_number), None) if attempt else None
+        if index is None:
+            failed.append(rating.card_id)
+            continue
+        targets.append((rating, attempt, index))
+    if not targets:
+        return {"cards": [], "failed": failed}
+
+    # One vectorized reschedule for the whole batch, spread over the user's lightly loaded days
+    digest = await db.review_digests.find_one({"_id": user_id}, {"upcoming": 1})
+    scheduled = schedule_reviews([attempt.responses[index].state() for _, attempt, index in targets],
+                                 [rating.rating for rating, _, _ in targets],
+                                 load=review_digest.load_of(digest))
+
+    updates: Dict[ObjectId, Dict[str, Any]] = {}
+    guards: Dict[ObjectId, Dict[str, Any]] = {}
+    for (rating, attempt, index), card in zip(targets, scheduled):
+        response = attempt.responses[index]
+        for name, value in card.items():
+            setattr(response, name, value)
+        response.user_rating = rating.rating
+        fields = updates.setdefault(attempt.id, {})
+        fields.update({f"responses.{index}.{name}": value for name, value in card.items()})
+        fields[f"responses.{index}.user_rating"] = rating.rating
+        # The card as read; stored values, since missing fields only match None
+        stored = docs[attempt.id]["responses"][index]
+        guard = guards.setdefault(attempt.id, {"_id": attempt.id})
+        guard[f"responses.{index}.question_number"] = rating.question_number
+        for name in _GUARD_FIELDS:
+            guard[f"responses.{index}.{name}"] = stored.get(name)
+
+    result = await db.attempts.bulk_write(
+        [UpdateOne(guards[attempt_id], {"$set": fields}) for attempt_id, fields in updates.items()],
+        ordered=False,
+    )
+    changed = [attempts[attempt_id] for attempt_id in updates]
+    if result.matched_count < len(updates):
+        # An attempt's responses changed under us; which of its cards were saved is unknown
+        print(f"{len(updates) - result.matched_count} attempts of user {user_id} changed while saving ratings")
+        await review_digest.rebuild_digest(db, user_id)
+        return {"cards": [], "failed": failed, "unconfirmed": [rating.card_id for rating, _, _ in targets]}
+
+    await review_digest.refresh_for_attempts(db, user_id, changed,
+                                             [Attempt.from_bson(docs[attempt_id]) for attempt_id in updates])
+    return {
+        "cards": [{"card_id": rating.card_id, "next_due": attempt.responses[index].next_due_date}
+                  for rating, attempt, index in targets],
+        "failed": failed,
+    }
+
+
+class ReviewSession:
+    """One user's review session on an accepted WebSocket."""
+
+    def __init__(self, db, websocket: WebSocket, user_id: str):
+        self.db = db
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: Deque[Dict[str, Any]] = deque()
+        self.outstanding: Set[str] = set()  # sent, not rated yet
+        self.pending: List[Rating] = []
+        self.first_pending_at: Optional[float] = None
+        self.reviewed = 0
+
+    async def run(self):
+        await self.websocket.accept()
+        try:
+            digest = await review_digest.get_digest(self.db, self.user_id)
+            self.queue.extend(digest["cards"])
+            await self.websocket.send_json({"type": "session", "total": digest["total"],
+                                            "counts": digest["counts"], "day": digest["day"]})
+            await self._top_up()
+            await self._loop()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if self.pending:
+                # The client is gone; its ratings are still saved
+                try:
+                    await self._sync(notify=False)
+                except Exception as e:
+                    print(f"Failed to save {len(self.pending)} ratings of user {self.user_id}: {e}")
+
+    async def _loop(self):
+        while True:
+            if not self.queue and not self.outstanding and not self.pending:
+                await self.websocket.send_json({"type": "done", "reviewed": self.reviewed})
+                await self.websocket.close()
+                return
+
+            timeout = None
+            if self.pending:
+                timeout = max(self.first_pending_at + REVIEW_SYNC_SECONDS - time.monotonic(), 0)
+            try:
+                message = await asyncio.wait_for(self.websocket.receive_json(), timeout)
+            except asyncio.TimeoutError:
+                await self._sync()
+                continue
+            except ValueError:
+                await self._error("Messages must be JSON objects")
+                continue
+
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "rate":
+                await self._rate(message)
+            elif kind == "sync":
+                await self._sync()
+            elif kind == "end":
+                await self._sync()
+                await self.websocket.close()
+                return
+            else:
+                await self._error(f"Unknown message type: {kind!r}")
+
+    async def _rate(self, message: Dict[str, Any]):
+        try:
+            rating = parse_rating(message)
+        except ValueError as err:
+            await self._error(str(err))
+            return
+        self.outstanding.discard(rating.card_id)
+        if not self.pending:
+            self.first_pending_at = time.monotonic()
+        self.pending.append(rating)
+        self.reviewed += 1
+        await self.websocket.send_json({"type": "ack", "card_id": rating.card_id})
+        await self._top_up()
+        if len(self.pending) >= REVIEW_SYNC_BATCH:
+            await self._sync()
+
+    async def _top_up(self):
+        """Send cards until REVIEW_PREFETCH + 1 are on the client unrated."""
+        while self.queue and len(self.outstanding) < REVIEW_PREFETCH + 1:
+            card = self.queue.popleft()
+            self.outstanding.add(card["card_id"])
+            await self.websocket.send_json({"type": "card", "card": card})
+
+    async def _sync(self, notify: bool = True):
+        if not self.pending:
+            return
+        batch, self.pending, self.first_pending_at = self.pending, [], None
+        try:
+            saved = await save_ratings(self.db, self.user_id, batch)
+        except Exception as e:
+            print(f"Failed to save ratings of user {self.user_id}: {e}")
+            saved = {"cards": [], "failed": [rating.card_id for rating in batch], "detail": str(e)}
+        if notify:
+            await self.websocket.send_json({"type": "saved", **saved})
+
+    async def _error(self, detail: str):
+        await self.websocket.send_json({"type": "error", "detail": detail})
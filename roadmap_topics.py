@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Roadmap Topics - Course roadmaps stored as one document per topic.
+
+This module provides functionality to:
+1. Store roadmap entries in `roadmap_topics`, keyed by (course_id, topic_number),
+   instead of as an array embedded in each `courses` document
+2. Fetch a course's topics, or only those in a date window ("this week's topics"),
+   through the (course_id, starts_on) index
+3. Patch a single topic; a change to its topic or preQuizPrompt bumps its
+   `revision`, which marks its pre-lecture quiz as out of date
+4. Migrate courses that still embed their roadmap, lazily on first read or all
+   at once with `python roadmap_topics.py migrate`
+
+Topic documents:
+  {course_id, topic_number (1-based roadmap position), date, topic, preQuizPrompt,
+   assignment, starts_on (parsed date, None for e.g. "Week 3"), revision,
+   quiz_id, quiz_revision, updated_at}
+
+The migration copies embedded roadmaps and leaves them in place, so servers
+still running the previous version keep working; `--drop-embedded` removes
+them once every server reads from `roadmap_topics`.
+"""
+
+import argparse
+import asyncio
+import os
+import re
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+# Fields of a roadmap entry as returned by the API (see RoadmapEntry in main.py)
+ENTRY_FIELDS = ("date", "topic", "preQuizPrompt", "assignment")
+
+# Changing these changes what the pre-lecture quiz should ask
+QUIZ_FIELDS = ("topic", "preQuizPrompt")
+
+_ISO_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+
+
+async def ensure_indexes(db):
+    await db.roadmap_topics.create_index([("course_id", ASCENDING), ("topic_number", ASCENDING)], unique=True)
+    await db.roadmap_topics.create_index([("course_id", ASCENDING), ("starts_on", ASCENDING)])
+    # Upcoming topics across all courses (pre-quiz prefetch)
+    await db.roadmap_topics.create_index([("starts_on", ASCENDING)])
+
+
+def parse_start(value: Any) -> Optional[datetime]:
+    """The date an entry starts on, if its `date` is an ISO date; None for week numbers etc."""
+    match = _ISO_DATE.match(str(value or "").strip())
+    if not match:
+        return None
+    try:
+        return datetime(*map(int, match.groups()))
+    except ValueError:
+        return None
+
+
+def topic_documents(course_id: ObjectId, entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Topic documents for a roadmap as generate_roadmap returns it."""
+    now = datetime.utcnow()
+    docs = []
+    for number, entry in enumerate(entries, start=1):
+        entry = entry if isinstance(entry, dict) else {}
+        doc = {field: entry.get(field) for field in ENTRY_FIELDS}
+        doc.update({
+            "course_id": course_id,
+            "topic_number": number,
+            "topic": doc["topic"] or f"Topic {number}",
+            "starts_on": parse_start(doc["date"]),
+            "revision": 1,
+            "quiz_id": None,
+            "quiz_revision": None,
+            "updated_at": now,
+        })
+        docs.append(doc)
+    return docs
+
+
+def entry(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """A topic document in the shape of the API's RoadmapEntry."""
+    return {"topic_number": doc["topic_number"], **{field: doc.get(field) for field in ENTRY_FIELDS}}
+
+
+def quiz_is_current(doc: Dict[str, Any]) -> bool:
+    """Whether the topic's stored pre-lecture quiz was generated from its current text."""
+    return doc.get("quiz_id") is not None and doc.get("quiz_revision") == doc.get("revision")
+
+
+async def store(db, course_id: ObjectId, entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert a course's topics. Topics that already exist (e.g. a resumed import) are kept."""
+    return await store_many(db, [(course_id, entries)])
+
+
+async def store_many(db, roadmaps: Iterable[Tuple[ObjectId, Iterable[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    """The topics of several courses in one insert_many, as :func:`store`."""
+    docs = [doc for course_id, entries in roadmaps for doc in topic_documents(course_id, entries)]
+    if docs:
+        try:
+            await db.roadmap_topics.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+    return docs
+
+
+async def _migrate_embedded(db, course_id: ObjectId) -> bool:
+    """Copy a course's embedded roadmap into roadmap_topics. False if there was none to copy."""
+    course = await db.courses.find_one(
+        {"_id": course_id, "roadmap.0": {"$exists": True}, "roadmap_migrated_at": {"$exists": False}},
+        {"roadmap": 1},
+    )
+    if not course:
+        return False
+    docs = await store(db, course_id, course["roadmap"])
+    await db.courses.update_one(
+        {"_id": course_id},
+        {"$set": {"roadmap_migrated_at": datetime.utcnow(), "topic_count": len(docs)}},
+    )
+    print(f"Migrated roadmap of course {course_id} ({len(docs)} topics)")
+    return True
+
+
+async def load(
+    db,
+    course_id: ObjectId,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    A course's topic documents in roadmap order.
+
+    Args:
+        start, end: Only topics starting within these dates (both inclusive).
+            Topics without a parseable date are left out of a window.
+        projection: Fields to return (topic_number is always included)
+    """
+    query: Dict[str, Any] = {"course_id": course_id}
+    if start or end:
+        query["starts_on"] = {"$ne": None}
+        if start:
+            query["starts_on"]["$gte"] = datetime(start.year, start.month, start.day)
+        if end:
+            query["starts_on"]["$lte"] = datetime(end.year, end.month, end.day)
+    if projection is not None:
+        projection = {**projection, "topic_number": 1}
+
+    async def find():
+        return await db.roadmap_topics.find(query, projection).sort("topic_number", ASCENDING).to_list(length=None)
+
+    docs = await find()
+    if not docs and await _migrate_embedded(db, course_id):
+        docs = await find()
+    return docs
+
+
+async def patch(db, course_id: ObjectId, topic_number: int, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Update some fields of one topic. Returns the updated document, or None if
+    the course has no such topic.
+    """
+    changes = {field: value for field, value in changes.items() if field in ENTRY_FIELDS}
+    query = {"course_id": course_id, "topic_number": topic_number}
+    projection = {field: 1 for field in QUIZ_FIELDS}
+    current = await db.roadmap_topics.find_one(query, projection)
+    if current is None and await _migrate_embedded(db, course_id):
+        current = await db.roadmap_topics.find_one(query, projection)
+    if current is None:
+        return None
+
+    update: Dict[str, Any] = {"$set": {**changes, "updated_at": datetime.utcnow()}}
+    if "date" in changes:
+        update["$set"]["starts_on"] = parse_start(changes["date"])
+    if any(field in changes and changes[field] != current.get(field) for field in QUIZ_FIELDS):
+        update["$inc"] = {"revision": 1}
+
+    return await db.roadmap_topics.find_one_and_update(
+        {"_id": current["_id"]}, update, return_document=ReturnDocument.AFTER
+    )
+
+
+async def mark_quiz(db, course_id: ObjectId, topic_number: int, revision: int, quiz_id: ObjectId,
+                    current: bool = True):
+    """
+    Record the quiz generated from ``revision`` of a topic, unless the topic changed meanwhile.
+
+    A quiz that is not ``current`` (made locally, see local_quiz.py) is recorded
+    without a revision, so quiz_is_current stays False until it is replaced.
+    """
+    await db.roadmap_topics.update_one(
+        {"course_id": course_id, "topic_number": topic_number, "revision": revision},
+        {"$set": {"quiz_id": quiz_id, "quiz_revision": revision if current else None}},
+    )
+
+
+async def delete_course(db, course_id: ObjectId):
+    await db.roadmap_topics.delete_many({"course_id": course_id})
+
+
+async def migrate_all(db, drop_embedded: bool = False) -> int:
+    """Migrate every course that still embeds its roadmap. Returns how many were migrated."""
+    await ensure_indexes(db)
+    migrated = 0
+    async for course in db.courses.find({"roadmap.0": {"$exists": True}}, {"_id": 1}):
+        if await _migrate_embedded(db, course["_id"]):
+            migrated += 1
+        if drop_embedded:
+            await db.courses.update_one(
+                {"_id": course["_id"], "roadmap_migrated_at": {"$exists": True}}, {"$unset": {"roadmap": ""}}
+            )
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--drop-embedded", action="store_true",
+                        help="Remove the embedded roadmap arrays after copying them")
+    args = parser.parse_args()
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        raise SystemExit("Set MONGO_URI environment variable")
+
+    async def run():
+        client = AsyncIOMotorClient(uri, tlsAllowInvalidCertificates=True)
+        try:
+            migrated = await migrate_all(client["deep_learner"], drop_embedded=args.drop_embedded)
+            print(f"Migrated {migrated} course roadmaps")
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
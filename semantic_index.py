@@ -0,0 +1,584 @@
+#!/usr/bin/env python
+"""
+Semantic Index - Local vector search and question de-duplication for a course.
+
+This module provides functionality to:
+1. Embed notes and quiz questions on the CPU using hashed word / character n-gram vectors
+2. Keep an in-process NumPy index per course with incremental add and remove
+3. Persist each index in a memory-mapped on-disk format (vectors.npy + meta.json),
+   or in GridFS when workers span hosts (SHARED_STATE_BACKEND=mongo), one
+   worker at a time, replaying each worker's changes onto what the others saved
+4. Filter near-duplicate questions before they are stored
+
+To be integrated with the main FastAPI application.
+"""
+
+import asyncio
+import io
+import json
+import os
+import re
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+import document_model
+import shared_state
+
+# Size of the hashed feature space. 512 float32 dims = 2 KB per item.
+EMBEDDING_DIM = int(os.getenv("SEMANTIC_INDEX_DIM", "512"))
+
+# Cosine similarity above which two questions are considered the same question
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.82"))
+
+# Search hits scoring below this cosine similarity are not returned
+SEARCH_MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", "0.1"))
+
+# Where per-course indexes are stored on disk (with the local shared state backend)
+INDEX_DIR = os.getenv("SEMANTIC_INDEX_DIR", "indexes")
+
+# GridFS bucket holding per-course indexes with the mongo shared state backend, and how
+# many revisions of each are kept (older ones may still be downloading elsewhere)
+INDEX_BUCKET = "semantic_indexes"
+_KEPT_REVISIONS = 2
+
+# Notes are embedded in windows of roughly this many characters
+NOTE_CHUNK_CHARS = 600
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "the", "of", "to", "in", "on", "for", "and", "or", "is", "are",
+    "was", "were", "be", "by", "with", "as", "at", "it", "its", "this", "that",
+    "what", "which", "who", "whom", "how", "why", "when", "where", "does", "do",
+    "did", "from", "into", "can", "could", "would", "should",
+}
+
+
+# ---------------------------------------------------------------------------
+# Embeddings
+# ---------------------------------------------------------------------------
+
+def _features(text: str) -> List[Tuple[str, float]]:
+    """Return weighted string features for a piece of text."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    content = [t for t in tokens if t not in _STOPWORDS] or tokens
+
+    features = [("w:" + t, 1.0) for t in content]
+    features += [("b:" + a + "_" + b, 0.7) for a, b in zip(content, content[1:])]
+    # Character 4-grams make the vectors tolerant to inflection ("cells" / "cell")
+    for t in content:
+        padded = f"#{t}#"
+        features += [("c:" + padded[i:i + 4], 0.3) for i in range(max(1, len(padded) - 3))]
+    return features
+
+
+def embed_text(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Embed a single string into an L2-normalised float32 vector.
+
+    Features are hashed with CRC32 (stable across processes, unlike ``hash()``)
+    and the top hash bit decides the sign, which keeps collisions unbiased.
+    """
+    features = _features(text or "")
+    vector = np.zeros(dim, dtype=np.float32)
+    if not features:
+        return vector
+
+    hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f, _ in features), dtype=np.uint32, count=len(features))
+    weights = np.fromiter((w for _, w in features), dtype=np.float32, count=len(features))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, (hashes % dim).astype(np.intp), weights * signs)
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def embed_texts(texts: List[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Embed a batch of strings into an ``(n, dim)`` matrix."""
+    if not texts:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.vstack([embed_text(t, dim) for t in texts])
+
+
+def chunk_note(content: str, structure: Optional[Dict[str, Any]] = None, chunk_chars: int = NOTE_CHUNK_CHARS) -> List[str]:
+    """Chunks of a note that never straddle two of its sections (see document_model.py)."""
+    return [
+        chunk
+        for section in document_model.section_texts(content, structure)
+        for chunk in chunk_note_text(section, chunk_chars)
+    ]
+
+
+def chunk_note_text(text: str, chunk_chars: int = NOTE_CHUNK_CHARS) -> List[str]:
+    """Split note text into roughly ``chunk_chars`` sized windows on sentence boundaries."""
+    sentences = re.split(r"(?<=[.!?])\s+|\n{2,}", text or "")
+    chunks, current = [], ""
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if current and len(current) + len(sentence) > chunk_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# ---------------------------------------------------------------------------
+# Vector index
+# ---------------------------------------------------------------------------
+
+class VectorIndex:
+    """
+    In-process cosine-similarity index backed by a single NumPy matrix.
+
+    Rows are never compacted on removal; freed rows are zeroed and reused by the
+    next ``add``. A loaded index starts out memory-mapped read-only and is only
+    copied into RAM on the first mutation. Changes since the last save or load
+    are kept, so they can be replayed onto a newer copy (see save_course_index).
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, capacity: int = 64):
+        self.dim = dim
+        self.version = 0  # shared version of the saved index this copy is based on
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._ids: List[Optional[str]] = [None] * capacity
+        self._rows: Dict[str, int] = {}
+        self._metadata: Dict[str, Dict[str, Any]] = {}
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+        self._mmapped = False
+        # item_id -> (vector, metadata) added, or None removed, since the last save or load
+        self._changes: Dict[str, Optional[Tuple[np.ndarray, Dict[str, Any]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._rows
+
+    def _ensure_writable(self):
+        if self._mmapped:
+            self._vectors = np.array(self._vectors, dtype=np.float32)
+            self._mmapped = False
+
+    def _grow(self):
+        old_capacity = len(self._ids)
+        new_capacity = max(64, old_capacity * 2)
+        vectors = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        vectors[:old_capacity] = self._vectors
+        self._vectors = vectors
+        self._ids.extend([None] * (new_capacity - old_capacity))
+        self._free.extend(range(new_capacity - 1, old_capacity - 1, -1))
+
+    def add(self, item_id: str, text: str, metadata: Optional[Dict[str, Any]] = None):
+        """Add or replace a single item."""
+        self.add_many([(item_id, text, metadata or {})])
+
+    def add_many(self, items: List[Tuple[str, str, Dict[str, Any]]]):
+        """Add or replace several ``(item_id, text, metadata)`` items at once."""
+        if not items:
+            return
+        self._ensure_writable()
+        vectors = embed_texts([text for _, text, _ in items], self.dim)
+        for (item_id, text, metadata), vector in zip(items, vectors):
+            self._put(item_id, vector, {**metadata, "text": text})
+
+    def _put(self, item_id: str, vector: np.ndarray, metadata: Dict[str, Any]):
+        row = self._rows.get(item_id)
+        if row is None:
+            if not self._free:
+                self._grow()
+            row = self._free.pop()
+            self._rows[item_id] = row
+            self._ids[row] = item_id
+        self._vectors[row] = vector
+        self._metadata[item_id] = metadata
+        self._changes[item_id] = (vector, metadata)
+
+    def remove(self, item_id: str) -> bool:
+        """Remove a single item. Returns False if it was not indexed."""
+        row = self._rows.pop(item_id, None)
+        if row is None:
+            return False
+        self._ensure_writable()
+        self._vectors[row] = 0.0
+        self._ids[row] = None
+        self._metadata.pop(item_id, None)
+        self._free.append(row)
+        self._changes[item_id] = None
+        return True
+
+    def replay(self, other: "VectorIndex"):
+        """Apply the changes ``other`` made since its last save or load to this index."""
+        if not other._changes:
+            return
+        self._ensure_writable()
+        for item_id, change in other._changes.items():
+            if change is None:
+                self.remove(item_id)
+            else:
+                self._put(item_id, *change)
+
+    def remove_prefix(self, prefix: str) -> int:
+        """Remove every item whose id starts with ``prefix``."""
+        doomed = [item_id for item_id in self._rows if item_id.startswith(prefix)]
+        for item_id in doomed:
+            self.remove(item_id)
+        return len(doomed)
+
+    def _scores(self, vectors: np.ndarray, kinds: Optional[List[str]] = None,
+                exclude_prefix: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(rows, scores)`` of live rows matching the filters against ``vectors``."""
+        rows = np.fromiter(
+            (
+                row for item_id, row in self._rows.items()
+                if (kinds is None or self._metadata[item_id].get("kind") in kinds)
+                and not (exclude_prefix and item_id.startswith(exclude_prefix))
+            ),
+            dtype=np.intp,
+        )
+        if rows.size == 0:
+            return rows, np.zeros((len(vectors), 0), dtype=np.float32)
+        return rows, vectors @ self._vectors[rows].T
+
+    def search(self, query: str, k: int = 10, kinds: Optional[List[str]] = None,
+               min_score: float = SEARCH_MIN_SCORE) -> List[Dict[str, Any]]:
+        """Return the ``k`` most similar items to ``query`` that score at least ``min_score``."""
+        rows, scores = self._scores(embed_text(query, self.dim)[None, :], kinds)
+        if rows.size == 0:
+            return []
+        scores = scores[0]
+        k = min(k, rows.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for position in top:
+            if scores[position] < min_score:
+                break  # best first, so the rest score lower still
+            item_id = self._ids[rows[position]]
+            results.append({"id": item_id, "score": float(scores[position]), **self._metadata[item_id]})
+        return results
+
+    def near_duplicates(self, texts: List[str], threshold: float = DEDUP_THRESHOLD,
+                        kinds: Optional[List[str]] = None,
+                        exclude_prefix: Optional[str] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        For each text, return the best indexed match scoring at least ``threshold``
+        (or None). All texts are scored against the index in one matrix product.
+        """
+        if not texts:
+            return []
+        rows, scores = self._scores(embed_texts(texts, self.dim), kinds, exclude_prefix)
+        if rows.size == 0:
+            return [None] * len(texts)
+
+        best = scores.argmax(axis=1)
+        matches = []
+        for i, position in enumerate(best):
+            score = float(scores[i, position])
+            if score < threshold:
+                matches.append(None)
+                continue
+            item_id = self._ids[rows[position]]
+            matches.append({"id": item_id, "score": score, **self._metadata[item_id]})
+        return matches
+
+    # -- persistence ---------------------------------------------------------
+
+    def _live(self) -> Tuple[List[str], np.ndarray]:
+        item_ids = list(self._rows)
+        vectors = self._vectors[[self._rows[i] for i in item_ids]] if item_ids else np.zeros((0, self.dim), np.float32)
+        return item_ids, vectors
+
+    def save(self, directory: str):
+        """Write the index as ``vectors.npy`` (live rows only) plus ``meta.json``."""
+        os.makedirs(directory, exist_ok=True)
+        item_ids, vectors = self._live()
+
+        # Write to temporary files first so a concurrent reader never sees a torn index
+        vectors_tmp = os.path.join(directory, "vectors.tmp.npy")
+        meta_tmp = os.path.join(directory, "meta.tmp.json")
+        np.save(vectors_tmp, vectors)
+        with open(meta_tmp, "w", encoding="utf-8") as meta_file:
+            json.dump({"dim": self.dim, "ids": item_ids, "metadata": [self._metadata[i] for i in item_ids]}, meta_file)
+        os.replace(vectors_tmp, os.path.join(directory, "vectors.npy"))
+        os.replace(meta_tmp, os.path.join(directory, "meta.json"))
+        self._changes.clear()
+
+    def dumps(self) -> bytes:
+        """The live rows and metadata as one ``.npz`` blob (for GridFS); see :meth:`loads`."""
+        item_ids, vectors = self._live()
+        meta = json.dumps({"dim": self.dim, "ids": item_ids, "metadata": [self._metadata[i] for i in item_ids]})
+        buffer = io.BytesIO()
+        np.savez(buffer, vectors=vectors, meta=np.frombuffer(meta.encode("utf-8"), dtype=np.uint8))
+        return buffer.getvalue()
+
+    @classmethod
+    def load(cls, directory: str) -> "VectorIndex":
+        """Load an index saved by :meth:`save`, memory-mapping the vectors."""
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        return cls._from_saved(meta, vectors, mmapped=True)
+
+    @classmethod
+    def loads(cls, data: bytes) -> "VectorIndex":
+        """Load an index from a blob made by :meth:`dumps` (into RAM)."""
+        with np.load(io.BytesIO(data)) as saved:
+            meta = json.loads(saved["meta"].tobytes().decode("utf-8"))
+            vectors = saved["vectors"]
+        return cls._from_saved(meta, vectors, mmapped=False)
+
+    @classmethod
+    def _from_saved(cls, meta: Dict[str, Any], vectors: np.ndarray, mmapped: bool) -> "VectorIndex":
+        index = cls(dim=meta["dim"], capacity=1)
+        count = len(meta["ids"])
+        index._vectors = vectors
+        index._mmapped = mmapped
+        index._ids = list(meta["ids"])
+        index._rows = {item_id: row for row, item_id in enumerate(meta["ids"])}
+        index._metadata = dict(zip(meta["ids"], meta["metadata"]))
+        index._free = []
+        if count == 0:
+            index._vectors = np.zeros((1, index.dim), dtype=np.float32)
+            index._ids = [None]
+            index._free = [0]
+            index._mmapped = False
+        return index
+
+
+# ---------------------------------------------------------------------------
+# Per-course registry
+# ---------------------------------------------------------------------------
+
+# course_id -> index, valid while its version is the course's shared version
+_course_indexes: Dict[str, VectorIndex] = {}
+
+# course_id -> lock held by this worker's request saving the course
+_save_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _course_dir(course_id: str) -> str:
+    return os.path.join(INDEX_DIR, str(course_id))
+
+
+def _version_key(course_id: str) -> str:
+    return f"semantic_index:{course_id}"
+
+
+def _bucket():
+    """The GridFS bucket of saved indexes when workers span hosts, or None to use INDEX_DIR."""
+    if shared_state.BACKEND != "mongo":
+        return None
+    import gridfs
+    return gridfs.GridFSBucket(shared_state.get_store().database, bucket_name=INDEX_BUCKET)
+
+
+def _read_saved(key: str) -> Optional[VectorIndex]:
+    """The last saved index of a course, or None if it was never saved."""
+    bucket = _bucket()
+    if bucket is None:
+        directory = _course_dir(key)
+        return VectorIndex.load(directory) if os.path.exists(os.path.join(directory, "meta.json")) else None
+
+    from gridfs.errors import NoFile
+    try:
+        with bucket.open_download_stream_by_name(key) as stream:  # the newest revision
+            return VectorIndex.loads(stream.read())
+    except NoFile:
+        return None
+
+
+def _write_saved(key: str, index: VectorIndex):
+    """Save a course index where every worker reads it (see _read_saved)."""
+    bucket = _bucket()
+    if bucket is None:
+        index.save(_course_dir(key))
+        return
+
+    bucket.upload_from_stream(key, index.dumps())
+    index._changes.clear()
+    for old in bucket.find({"filename": key}, sort=[("uploadDate", -1)], skip=_KEPT_REVISIONS):
+        bucket.delete(old._id)
+
+
+async def build_course_index(db, course_id) -> VectorIndex:
+    """Build a course index from the notes, quizzes and notes_quizzes collections."""
+    index = VectorIndex()
+    items = []
+
+    async for note in db.notes.find({"course_id": course_id}, {"content": 1, "structure": 1, "title": 1, "topic_number": 1}):
+        for n, chunk in enumerate(chunk_note(note.get("content", ""), note.get("structure"))):
+            items.append((f"note:{note['_id']}:{n}", chunk, {
+                "kind": "note", "topic_number": note.get("topic_number"), "title": note.get("title"),
+            }))
+
+    async for quiz in db.quizzes.find({"course_id": course_id}, {"quiz": 1, "topic_number": 1}):
+        items.extend(pre_quiz_items(quiz["_id"], quiz.get("topic_number"), quiz.get("quiz", [])))
+
+    async for quiz in db.notes_quizzes.find({"course_id": course_id}, {"questions": 1, "topic_number": 1}):
+        items.extend(notes_quiz_items(quiz["_id"], quiz.get("topic_number"), quiz.get("questions", [])))
+
+    index.add_many(items)
+    return index
+
+
+async def get_course_index(db, course_id) -> VectorIndex:
+    """
+    Return the cached index for a course, loading the saved one or building it on first use.
+
+    Another worker saving the course index bumps its shared version, which
+    makes this process reload its copy.
+    """
+    key = str(course_id)
+    version = await asyncio.to_thread(shared_state.current_version, _version_key(key))
+    cached = _course_indexes.get(key)
+    if cached is not None and cached.version == version:
+        return cached
+
+    try:
+        index = await asyncio.to_thread(_read_saved, key)
+    except Exception as e:
+        print(f"Failed to load semantic index for course {key}, rebuilding: {e}")
+        index = None
+
+    if index is None:
+        print(f"Building semantic index for course {key}")
+        index = await build_course_index(db, course_id)
+        await asyncio.to_thread(_write_saved, key, index)
+
+    index.version = version
+    _course_indexes[key] = index
+    return index
+
+
+async def save_course_index(course_id, index: VectorIndex):
+    """
+    Persist a course index after it has been mutated and tell the other workers.
+
+    Workers save a course one at a time (a shared claim). If another worker
+    saved it since ``index`` was loaded, ``index``'s changes are replayed onto
+    that newer copy rather than overwriting it.
+    """
+    key = str(course_id)
+    try:
+        # Requests of this worker queue here, and most find their changes saved by the one before
+        async with _save_locks.setdefault(key, asyncio.Lock()):
+            while index._changes:
+                # Saves take milliseconds, so waiters poll often
+                async with shared_state.in_flight(f"semantic_index_save:{key}", poll=0.02) as leader:
+                    if leader:
+                        await asyncio.to_thread(_merge_and_save, key, index)
+    except Exception as e:
+        print(f"Failed to save semantic index for course {course_id}: {e}")
+
+
+def _merge_and_save(key: str, index: VectorIndex):
+    """Save ``index`` (or, if another worker saved since it was loaded, the newer copy plus its changes)."""
+    saved = index
+    if shared_state.current_version(_version_key(key)) != index.version:
+        newer = _read_saved(key)
+        if newer is not None:
+            saved = newer
+            saved.replay(index)
+            print(f"Merged {len(index._changes)} changes into the semantic index of course {key} saved meanwhile")
+    # Saved before the version changes, so workers told to reload find it
+    _write_saved(key, saved)
+    index._changes.clear()
+    saved.version = shared_state.invalidate(_version_key(key))
+    _course_indexes[key] = saved
+
+
+def drop_course_index(course_id):
+    """Forget a course index in memory and where it is saved."""
+    key = str(course_id)
+    _course_indexes.pop(key, None)
+    _save_locks.pop(key, None)
+    shared_state.invalidate(_version_key(key))
+    bucket = _bucket()
+    if bucket is not None:
+        for saved in bucket.find({"filename": key}):
+            bucket.delete(saved._id)
+        return
+    directory = _course_dir(key)
+    for name in ("vectors.npy", "meta.json"):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def pre_quiz_items(quiz_id, topic_number, questions: List[Dict[str, Any]]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Index items for the flashcards of a pre-lecture quiz."""
+    return [
+        (f"quiz:{topic_number}:{quiz_id}:{q.get('index', n + 1)}", q.get("question", ""), {
+            "kind": "pre_quiz", "topic_number": topic_number, "quiz_id": str(quiz_id), "answer": q.get("answer"),
+        })
+        for n, q in enumerate(questions) if q.get("question")
+    ]
+
+
+def notes_quiz_items(quiz_id, topic_number, questions: List[Dict[str, Any]]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """Index items for the questions of a notes quiz."""
+    return [
+        (f"notes_quiz:{topic_number}:{quiz_id}:{q.get('id', n + 1)}", q.get("question", ""), {
+            "kind": "notes_quiz", "topic_number": topic_number, "quiz_id": str(quiz_id),
+            "answer": q.get("correctAnswer"),
+        })
+        for n, q in enumerate(questions) if q.get("question")
+    ]
+
+
+QUESTION_KINDS = ["pre_quiz", "notes_quiz"]
+
+
+def filter_near_duplicates(
+    questions: List[Dict[str, Any]],
+    index: Optional[VectorIndex] = None,
+    threshold: float = DEDUP_THRESHOLD,
+    exclude_prefix: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Split ``questions`` into ``(kept, dropped)``.
+
+    A question is dropped when it is a near duplicate of an indexed question
+    (excluding ids starting with ``exclude_prefix``) or of a question kept
+    earlier in the same batch.
+
+    Args:
+        questions: Question dicts with a ``question`` field
+        index: Course index to compare against, if any
+        threshold: Cosine similarity at or above which questions are duplicates
+        exclude_prefix: Index id prefix to ignore, e.g. the quiz being replaced
+
+    Returns:
+        The kept questions and the dropped ones (annotated with ``duplicate_of``)
+    """
+    texts = [q.get("question", "") for q in questions]
+    indexed = (index.near_duplicates(texts, threshold, QUESTION_KINDS, exclude_prefix)
+               if index is not None and len(index) else [None] * len(texts))
+
+    vectors = embed_texts(texts)
+    kept, dropped, kept_rows = [], [], []
+    for i, question in enumerate(questions):
+        if indexed[i] is not None:
+            dropped.append({**question, "duplicate_of": indexed[i]["id"], "similarity": indexed[i]["score"]})
+            continue
+        if kept_rows:
+            similarities = vectors[kept_rows] @ vectors[i]
+            best = int(similarities.argmax())
+            if similarities[best] >= threshold:
+                dropped.append({**question, "duplicate_of": f"batch:{kept_rows[best]}",
+                                "similarity": float(similarities[best])})
+                continue
+        kept.append(question)
+        kept_rows.append(i)
+
+    return kept, dropped
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Serialization - Fast JSON and MessagePack responses for large payloads.
+
+This module provides functionality to:
+1. Encode responses with orjson instead of FastAPI's jsonable_encoder + json
+2. Convert ObjectId and datetime values inside the encoder, so routes can return
+   MongoDB documents as they come without per-document conversion loops
+3. Negotiate MessagePack (Accept: application/msgpack) for clients that want
+   smaller, faster-to-encode payloads
+
+Both encodings produce the same structure: ObjectIds become strings and
+datetimes become ISO 8601 strings, exactly as the JSON responses always had.
+"""
+
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+import msgpack
+import orjson
+from bson import ObjectId
+from fastapi import Request
+from fastapi.responses import Response
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _json_default(obj: Any) -> Any:
+    # orjson handles datetime, date, UUID and dataclasses itself
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not MessagePack serializable")
+
+
+def dumps_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_json_default, option=_JSON_OPTIONS)
+
+
+def dumps_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, default=_msgpack_default, use_bin_type=True, datetime=False)
+
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+class MsgPackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_msgpack(content)
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True if the Accept header ranks a MessagePack type above JSON."""
+    accept = request.headers.get("accept", "")
+    if "msgpack" not in accept:
+        return False
+    best_msgpack, best_json = 0.0, 0.0
+    for item in accept.split(","):
+        media_type, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.strip().lower()
+        if media_type in MSGPACK_MEDIA_TYPES:
+            best_msgpack = max(best_msgpack, quality)
+        elif media_type in ("application/json", "application/*", "*/*"):
+            best_json = max(best_json, quality)
+    return best_msgpack > 0 and best_msgpack >= best_json
+
+
+def negotiated_response(request: Request, content: Any, status_code: int = 200,
+                        headers: Optional[Dict[str, str]] = None) -> Response:
+    """Encode ``content`` as MessagePack or JSON depending on the request's Accept header."""
+    response_class = MsgPackResponse if wants_msgpack(request) else ORJSONResponse
+    response = response_class(content, status_code=status_code, headers=headers)
+    response.headers["Vary"] = "Accept"
+    return response
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Serve - Run the backend with one or more worker processes.
+
+This launcher:
+1. Picks a worker count from --workers, WEB_CONCURRENCY or the number of CPUs
+2. Points every worker at the same shared state (see shared_state.py), so the
+   Gemini rate limit, in-flight de-duplication and cache invalidation hold
+   across workers instead of per process
+3. Starts uvicorn with that many workers; each worker creates its own Mongo,
+   GridFS and Gemini clients in its own startup, never inherited from a parent
+
+With several hosts, use the MongoDB backend (--shared-state mongo) so all of
+them share one rate limit, and semantic indexes are kept in GridFS instead of
+on each host's disk. GEMINI_RPM sets that limit in requests per minute.
+
+Usage:
+  python serve.py --workers 4 --port 8000
+  GEMINI_RPM=1000 python serve.py --shared-state mongo
+"""
+
+import argparse
+import os
+
+
+def default_workers() -> int:
+    """WEB_CONCURRENCY if set, else one worker per CPU (the app is async; LLM calls run in threads)."""
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    return max(1, cpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--shared-state", choices=["local", "mongo"],
+                        default=os.getenv("SHARED_STATE_BACKEND", "local"),
+                        help="Where workers keep rate limits, in-flight claims and cache versions")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # Set before any worker imports the app; workers inherit the environment
+    os.environ["SHARED_STATE_BACKEND"] = args.shared_state
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+
+    import uvicorn
+
+    print(f"Starting {args.workers} worker(s) on {args.host}:{args.port} (shared state: {args.shared_state})")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+Shared State - Coordination state shared by every worker process.
+
+This module provides functionality to:
+1. Rate-limit Gemini calls with one token bucket for all workers
+2. De-duplicate in-flight work (one worker generates, the others wait for it)
+3. Invalidate per-process caches through version counters
+
+Two backends implement the same small interface:
+- "local": a SQLite file on tmpfs (/dev/shm when available) shared by the
+  workers of one host. This is the default.
+- "mongo": the `shared_state` collection in MongoDB, for workers spread over
+  several hosts. It uses a synchronous pymongo client of its own.
+
+Select one with SHARED_STATE_BACKEND. Both are synchronous and fast; async
+code calls them through `asyncio.to_thread`. The store is created per process
+and recreated after a fork, so a forking server never shares connections.
+"""
+
+import asyncio
+import contextlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+BACKEND = os.getenv("SHARED_STATE_BACKEND", "local")
+
+# SQLite file used by the local backend; every worker must see the same path
+_default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+LOCAL_PATH = os.getenv("SHARED_STATE_PATH", os.path.join(_default_dir, "deepify-shared-state.sqlite3"))
+
+# Claims not renewed for this long are considered abandoned (e.g. the worker died);
+# a held claim is renewed every third of it
+CLAIM_TTL_SECONDS = float(os.getenv("SHARED_STATE_CLAIM_TTL", "600"))
+
+
+class LocalSharedState:
+    """SQLite-backed store for the worker processes of a single host."""
+
+    def __init__(self, path: str = LOCAL_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not cross threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def take_token(self, name: str, rate: float, capacity: float) -> float:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens, wait = _refill(row, now, rate, capacity)
+            conn.execute(
+                "INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (name, tokens, now),
+            )
+        return wait
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires FROM claims WHERE key = ?", (key,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT INTO claims (key, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires",
+                (key, owner, now + ttl),
+            )
+        return True
+
+    def release(self, key: str, owner: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, owner))
+
+    def bump_version(self, key: str) -> int:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO versions (key, version) VALUES (?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET version = version + 1",
+                (key,),
+            )
+            return conn.execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()[0]
+
+    def get_version(self, key: str) -> int:
+        row = self._connection().execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+
+class MongoSharedState:
+    """MongoDB-backed store for workers on several hosts (`shared_state` collection)."""
+
+    def __init__(self, uri: Optional[str] = None):
+        from pymongo import MongoClient
+
+        uri = uri or os.getenv("MONGO_URI")
+        if not uri:
+            raise RuntimeError("Set MONGO_URI environment variable")
+        self._client = MongoClient(uri, serverSelectionTimeoutMS=5000, tlsAllowInvalidCertificates=True)
+        # Also used by modules keeping other cross-host state synchronously (e.g. semantic_index.py)
+        self.database = self._client["deep_learner"]
+        self._collection = self.database["shared_state"]
+
+    def take_token(self, name: str, rate: float, capacity: float) -> float:
+        from pymongo.errors import DuplicateKeyError
+
+        _id = f"bucket:{name}"
+        while True:
+            now = time.time()
+            doc = self._collection.find_one({"_id": _id})
+            tokens, wait = _refill((doc["tokens"], doc["updated"]) if doc else None, now, rate, capacity)
+            if doc is None:
+                try:
+                    self._collection.insert_one({"_id": _id, "tokens": tokens, "updated": now, "rev": 0})
+                    return wait
+                except DuplicateKeyError:
+                    continue
+            # Optimistic concurrency: only write if nobody else took a token meanwhile
+            result = self._collection.update_one(
+                {"_id": _id, "rev": doc["rev"]},
+                {"$set": {"tokens": tokens, "updated": now}, "$inc": {"rev": 1}},
+            )
+            if result.modified_count:
+                return wait
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        from pymongo.errors import DuplicateKeyError
+
+        now = time.time()
+        try:
+            self._collection.update_one(
+                {"_id": f"claim:{key}", "$or": [{"owner": owner}, {"expires": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires": now + ttl}},
+                upsert=True,
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def release(self, key: str, owner: str):
+        self._collection.delete_one({"_id": f"claim:{key}", "owner": owner})
+
+    def bump_version(self, key: str) -> int:
+        from pymongo import ReturnDocument
+
+        doc = self._collection.find_one_and_update(
+            {"_id": f"version:{key}"}, {"$inc": {"version": 1}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        return doc["version"]
+
+    def get_version(self, key: str) -> int:
+        doc = self._collection.find_one({"_id": f"version:{key}"}, {"version": 1})
+        return doc["version"] if doc else 0
+
+
+def _refill(row: Optional[Tuple[float, float]], now: float, rate: float, capacity: float) -> Tuple[float, float]:
+    """
+    Token bucket step shared by both backends.
+
+    Returns:
+        (tokens left to store, seconds to wait before retrying; 0 when a token was taken)
+    """
+    tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+# ---------------------------------------------------------------------------
+# Per-process store
+# ---------------------------------------------------------------------------
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return this process's store, creating it on first use (and again after a fork)."""
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():
+        with _store_lock:
+            if _store is None or _store_pid != os.getpid():
+                _store = MongoSharedState() if BACKEND == "mongo" else LocalSharedState()
+                _store_pid = os.getpid()
+    return _store
+
+
+def _reset_after_fork():
+    global _store, _store_pid, _store_lock
+    _store, _store_pid, _store_lock = None, None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ---------------------------------------------------------------------------
+# Rate limiting
+# ---------------------------------------------------------------------------
+
+def wait_for_token(name: str, per_minute: float, burst: Optional[float] = None, timeout: float = 60.0):
+    """
+    Block until the shared bucket ``name`` grants a token.
+
+    Args:
+        name: Bucket name, shared by every worker
+        per_minute: Sustained rate across all workers
+        burst: Bucket capacity (defaults to one second's worth, at least 1)
+        timeout: Give up with RuntimeError after this many seconds
+    """
+    rate = per_minute / 60
+    capacity = burst or max(1.0, rate)
+    deadline = time.monotonic() + timeout
+    while True:
+        wait = get_store().take_token(name, rate, capacity)
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RuntimeError(f"Rate limit for {name} exceeded; gave up after {timeout:.0f}s")
+        time.sleep(wait)
+
+
+# ---------------------------------------------------------------------------
+# In-flight de-duplication
+# ---------------------------------------------------------------------------
+
+@contextlib.asynccontextmanager
+async def in_flight(key: str, ttl: float = CLAIM_TTL_SECONDS, poll: float = 0.25) -> AsyncIterator[bool]:
+    """
+    Run a piece of work at most once at a time across all workers.
+
+    Yields True to the caller that should do the work. Every other caller
+    waits until that work finishes and gets False, meaning "read the result
+    the other worker stored".
+    """
+    owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    store = get_store()
+    if await asyncio.to_thread(store.claim, key, owner, ttl):
+        # Work that outlasts the TTL keeps its claim; a worker that dies stops renewing it
+        renewal = asyncio.create_task(_renew(store, key, owner, ttl))
+        try:
+            yield True
+        finally:
+            renewal.cancel()
+            await asyncio.to_thread(store.release, key, owner)
+        return
+
+    # Someone else is on it; wait until their claim is released or expires
+    while not await asyncio.to_thread(store.claim, key, owner, ttl):
+        await asyncio.sleep(poll)
+    await asyncio.to_thread(store.release, key, owner)
+    yield False
+
+
+async def _renew(store, key: str, owner: str, ttl: float):
+    """Extend a held claim every third of its TTL until cancelled."""
+    while True:
+        await asyncio.sleep(ttl / 3)
+        try:
+            if not await asyncio.to_thread(store.claim, key, owner, ttl):
+                print(f"Claim {key} expired and was taken over by another worker")
+                return
+        except Exception as e:
+            print(f"Error renewing claim {key}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Cache invalidation
+# ---------------------------------------------------------------------------
+
+def invalidate(key: str) -> int:
+    """Mark every worker's cached copy of ``key`` stale. Returns the new version."""
+    return get_store().bump_version(key)
+
+
+def current_version(key: str) -> int:
+    return get_store().get_version(key)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Spaced Repetition - SM-2 style scheduling engine with per-card memory.
+
+This module provides functionality to:
+1. Keep per-card memory state (ease, interval, stability, repetitions, lapses)
+2. Update that state from a self-rating (easy / medium / hard / dont_know)
+3. Reschedule whole decks at once with NumPy-vectorized arithmetic
+4. Fuzz and load-balance due dates so cards rated together do not all come due together
+
+New cards keep the old fixed first intervals (easy 7, medium 3, hard 1,
+dont_know 1 days). After that the interval grows with the card's ease factor.
+`stability` is the number of days until recall probability drops to
+TARGET_RETENTION under exponential forgetting, R(t) = TARGET_RETENTION ** (t / S).
+"""
+
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# Ratings in the order used by the rating codes below
+RATINGS = ["dont_know", "hard", "medium", "easy"]
+RATING_CODES = {rating: code for code, rating in enumerate(RATINGS)}
+
+# SM-2 response quality per rating (0-5 scale)
+QUALITY = np.array([1.0, 3.0, 4.0, 5.0])
+
+# First interval in days for a card that has never been recalled
+FIRST_INTERVAL = np.array([1.0, 1.0, 3.0, 7.0])
+
+# Interval multiplier applied on top of the ease factor for later reviews
+INTERVAL_MODIFIER = np.array([0.0, 0.6, 1.0, 1.3])
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+MAX_INTERVAL = 365.0
+TARGET_RETENTION = 0.9
+
+# Fields stored on every attempt response alongside `next_due_date`
+CARD_FIELDS = ["ease", "interval", "stability", "repetitions", "lapses", "last_reviewed"]
+
+
+def new_card_state() -> Dict[str, Any]:
+    """State for a card that has never been reviewed."""
+    return {
+        "ease": DEFAULT_EASE,
+        "interval": 0,
+        "stability": 0.0,
+        "repetitions": 0,
+        "lapses": 0,
+        "last_reviewed": None,
+    }
+
+
+def _fuzz_range(intervals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Inclusive ``(low, high)`` day bounds a fuzzed interval may land on."""
+    spread = np.where(
+        intervals < 3, 0.0,
+        np.where(intervals < 7, 1.0, np.where(intervals < 30, np.maximum(2.0, intervals * 0.15), intervals * 0.05)),
+    )
+    low = np.maximum(1.0, np.round(intervals - spread))
+    high = np.minimum(MAX_INTERVAL, np.round(intervals + spread))
+    return low.astype(np.int64), np.maximum(low, high).astype(np.int64)
+
+
+def fuzz_intervals(
+    intervals: np.ndarray,
+    rng: Optional[np.random.Generator] = None,
+    load: Optional[np.ndarray] = None,
+    chunks: int = 8,
+) -> np.ndarray:
+    """
+    Spread intervals over their fuzz range.
+
+    Without ``load`` each interval moves to a uniformly random day in its range.
+    With ``load`` (due counts indexed by day offset from today) each card goes to
+    the least loaded day in its range, with random jitter to break ties. Cards are
+    placed in ``chunks`` vectorized passes, updating a copy of ``load`` between
+    passes so later cards see where earlier ones landed.
+    """
+    rng = rng or np.random.default_rng()
+    low, high = _fuzz_range(np.asarray(intervals, dtype=np.float64))
+    width = high - low + 1
+
+    if load is None:
+        return low + (rng.random(low.shape) * width).astype(np.int64)
+
+    max_width = int(width.max()) if width.size else 1
+    needed = int(high.max()) + 1 if high.size else 1
+    load = np.array(load, dtype=np.float64)
+    if load.shape[0] < needed:
+        load = np.concatenate([load, np.zeros(needed - load.shape[0])])
+
+    result = np.empty_like(low)
+    offsets = np.arange(max_width)
+    for part in np.array_split(np.arange(low.size), max(1, chunks)):
+        if part.size == 0:
+            continue
+        candidates = low[part, None] + offsets[None, :]
+        valid = offsets[None, :] < width[part, None]
+        cost = np.where(valid, load[np.minimum(candidates, load.shape[0] - 1)], np.inf)
+        cost = cost + rng.random(cost.shape) * 0.5
+        chosen = candidates[np.arange(part.size), cost.argmin(axis=1)]
+        result[part] = chosen
+        np.add.at(load, chosen, 1)
+    return result
+
+
+def batch_reschedule(
+    ease: np.ndarray,
+    interval: np.ndarray,
+    repetitions: np.ndarray,
+    lapses: np.ndarray,
+    ratings: np.ndarray,
+    rng: Optional[np.random.Generator] = None,
+    load: Optional[np.ndarray] = None,
+    fuzz: bool = True,
+) -> Dict[str, np.ndarray]:
+    """
+    Apply one review to every card in a deck at once.
+
+    Args:
+        ease: Current ease factors
+        interval: Current scheduled intervals in days (0 for new cards)
+        repetitions: Consecutive successful reviews
+        lapses: Total number of failed reviews
+        ratings: Rating codes (see RATING_CODES)
+        rng: Random generator used for fuzzing
+        load: Optional due counts by day offset, used to load-balance due dates
+        fuzz: Whether to fuzz the resulting intervals
+
+    Returns:
+        Dict of new ``ease``, ``stability``, ``interval`` (days until due),
+        ``repetitions`` and ``lapses`` arrays
+    """
+    ratings = np.asarray(ratings, dtype=np.int64)
+    ease = np.asarray(ease, dtype=np.float64)
+    interval = np.asarray(interval, dtype=np.float64)
+    repetitions = np.asarray(repetitions, dtype=np.int64)
+    lapses = np.asarray(lapses, dtype=np.int64)
+
+    quality = QUALITY[ratings]
+    failed = quality < 3
+
+    # SM-2 ease update, clamped at MIN_EASE
+    miss = 5.0 - quality
+    new_ease = np.maximum(MIN_EASE, ease + (0.1 - miss * (0.08 + miss * 0.02)))
+
+    grown = np.maximum(interval + 1.0, interval * new_ease * INTERVAL_MODIFIER[ratings])
+    stability = np.where(repetitions == 0, FIRST_INTERVAL[ratings], grown)
+    stability = np.where(failed, 1.0, np.minimum(stability, MAX_INTERVAL))
+
+    days = fuzz_intervals(stability, rng, load) if fuzz else np.round(stability).astype(np.int64)
+
+    return {
+        "ease": np.round(new_ease, 3),
+        "stability": np.round(stability, 2),
+        "interval": days,
+        "repetitions": np.where(failed, 0, repetitions + 1),
+        "lapses": lapses + failed.astype(np.int64),
+    }
+
+
+def schedule_reviews(
+    states: List[Optional[Dict[str, Any]]],
+    ratings: List[str],
+    today: Optional[date] = None,
+    rng: Optional[np.random.Generator] = None,
+    load: Optional[np.ndarray] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Reschedule a list of stored card states (as found on attempt responses).
+
+    Missing states are treated as new cards and unknown ratings as ``dont_know``.
+    Returns one dict per card holding the CARD_FIELDS plus ``next_due_date``.
+    """
+    today = today or datetime.utcnow().date()
+    states = [{**new_card_state(), **(state or {})} for state in states]
+    codes = [RATING_CODES.get(getattr(r, "value", r), 0) for r in ratings]
+
+    result = batch_reschedule(
+        ease=np.array([s["ease"] for s in states], dtype=np.float64),
+        interval=np.array([s["interval"] for s in states], dtype=np.float64),
+        repetitions=np.array([s["repetitions"] for s in states], dtype=np.int64),
+        lapses=np.array([s["lapses"] for s in states], dtype=np.int64),
+        ratings=np.array(codes, dtype=np.int64),
+        rng=rng,
+        load=load,
+    )
+
+    scheduled = []
+    for i in range(len(states)):
+        days = int(result["interval"][i])
+        scheduled.append({
+            "ease": float(result["ease"][i]),
+            "interval": days,
+            "stability": float(result["stability"][i]),
+            "repetitions": int(result["repetitions"][i]),
+            "lapses": int(result["lapses"][i]),
+            "last_reviewed": str(today),
+            "next_due_date": str(today + timedelta(days=days)),
+        })
+    return scheduled
+
+
+def schedule_review(state: Optional[Dict[str, Any]], rating: str, today: Optional[date] = None) -> Dict[str, Any]:
+    """Reschedule a single card. See :func:`schedule_reviews`."""
+    return schedule_reviews([state], [rating], today)[0]
+
+
+def card_state(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Pull the stored memory state out of an attempt response."""
+    return {field: response[field] for field in CARD_FIELDS if field in response}
+
+
+def retrievability(elapsed_days: np.ndarray, stability: np.ndarray) -> np.ndarray:
+    """Probability of recall after ``elapsed_days`` for cards with the given stability."""
+    stability = np.maximum(np.asarray(stability, dtype=np.float64), 0.1)
+    return TARGET_RETENTION ** (np.asarray(elapsed_days, dtype=np.float64) / stability)
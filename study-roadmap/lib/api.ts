@@ -81,6 +81,60 @@ export interface NotesQuiz {
 }
 
 // API functions
+export interface ReviewCard {
+  card_id: string;
+  attempt_id: string;
+  quiz_id: string;
+  course_id: string | null;
+  topic_number: number | null;
+  question_number: number | null;
+  question: string | null;
+  answer: string | null;
+  due_date: string;
+}
+
+// Messages of the review session WebSocket (see review_session.py)
+export type ReviewSessionMessage =
+  | { type: "session"; total: number; counts: Record<string, Record<string, number>>; day: string }
+  | { type: "card"; card: ReviewCard }
+  | { type: "ack"; card_id: string }
+  | { type: "saved"; cards: { card_id: string; next_due: string }[]; failed: string[]; unconfirmed?: string[] }
+  | { type: "done"; reviewed: number }
+  | { type: "error"; detail: string };
+
+export interface ReviewSession {
+  rate(cardId: string, rating: "easy" | "medium" | "hard" | "dont_know"): void;
+  sync(): void;
+  end(): void;
+}
+
+// Notification that a quiz of a course was stored (see quiz_events.py)
+export interface QuizEvent {
+  type: "pre_quiz" | "notes_quiz";
+  course_id: string;
+  topic_number: number;
+  quiz_id: string;
+  generator?: string;
+}
+
+// Per-collection marks of the last sync; send them back unchanged (see delta_sync.py)
+export type SyncMarks = Partial<Record<"courses" | "roadmap" | "quizzes" | "review", string>>;
+
+export interface SyncResponse {
+  marks: SyncMarks;
+  courses: { changed: { _id: string; name: string; created_at: string; topic_count: number }[]; deleted: string[]; reset: boolean };
+  roadmap: { changed: (RoadmapEntry & { course_id: string; topic_number: number })[]; reset: boolean };
+  quizzes: { changed: any[]; deleted: string[]; reset: boolean };
+  review: {
+    changed: ReviewCard[];
+    removed: string[];
+    reset: boolean;
+    day: string;
+    total: number;
+    counts: Record<string, Record<string, number>>;
+  };
+}
+
 export const api = {
   // Upload syllabus and create a course
   async uploadSyllabus(name: string, file: File): Promise<CourseResponse> {
@@ -281,6 +335,33 @@ export const api = {
     return response.json();
   },
 
+  // Get what changed in the user's courses and review queue since the marks of the last sync
+  async sync(userId: string, courseIds: string[], marks: SyncMarks = {}): Promise<SyncResponse> {
+    const response = await fetch(`${API_URL}/users/${userId}/sync`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ course_ids: courseIds, marks }),
+    });
+
+    if (!response.ok) {
+      try {
+        const errorData = await response.json();
+        throw new Error(
+          typeof errorData.detail === "string"
+            ? errorData.detail
+            : JSON.stringify(errorData.detail) || "Failed to sync"
+        );
+      } catch (jsonError) {
+        const errorText = await response.text();
+        throw new Error(errorText || `Server error: ${response.status}`);
+      }
+    }
+
+    return response.json();
+  },
+
   // Update rating for a question
   async updateQuestionRating(
     attemptId: string,
@@ -317,6 +398,43 @@ export const api = {
     return response.json();
   },
 
+  // Review due cards over one WebSocket: cards arrive ahead of time, ratings are saved in batches
+  openReviewSession(
+    userId: string,
+    onMessage: (message: ReviewSessionMessage) => void
+  ): ReviewSession {
+    const socket = new WebSocket(`${API_URL.replace(/^http/, "ws")}/users/${userId}/review`);
+    const queued: string[] = [];
+    const send = (message: object) => {
+      const data = JSON.stringify(message);
+      if (socket.readyState === WebSocket.OPEN) socket.send(data);
+      else queued.push(data);
+    };
+
+    socket.onopen = () => queued.splice(0).forEach((data) => socket.send(data));
+    socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+
+    return {
+      rate: (cardId, rating) => send({ type: "rate", card_id: cardId, rating }),
+      sync: () => send({ type: "sync" }),
+      end: () => send({ type: "end" }),
+    };
+  },
+
+  // Be told when quizzes of a course (or one topic) are stored instead of polling for them; returns a function to stop
+  subscribeQuizEvents(
+    courseId: string,
+    onEvent: (event: QuizEvent) => void,
+    topicNumber?: number
+  ): () => void {
+    const query = topicNumber === undefined ? "" : `?topic_number=${topicNumber}`;
+    const source = new EventSource(`${API_URL}/courses/${courseId}/quiz-events${query}`);
+    const listener = (event: MessageEvent) => onEvent(JSON.parse(event.data));
+    source.addEventListener("pre_quiz", listener);
+    source.addEventListener("notes_quiz", listener);
+    return () => source.close();
+  },
+
   // Update topic progress on the backend
   async updateTopicProgress(
     courseId: string,
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Syllabus Context - Send PDF syllabi to Gemini as documents, uploaded once and cached.
+
+This module provides functionality to:
+1. Choose how syllabi are ingested (SYLLABUS_INGESTION): "extract" reads the
+   text locally (pdfplumber, schedule tables) and puts it in the prompt;
+   "native" sends the PDF itself as a document part, as gemini_test.py does
+2. Upload a PDF once as a Gemini cached context (CachedContent) and reuse it for
+   the roadmap call and every per-topic pre-quiz call of the course
+3. Record caches in `syllabus_contexts` by the PDF's SHA-256, so every worker
+   reuses them until shortly before they expire, and recreate expired ones from
+   the copy of the syllabus kept in GridFS, also between the topics of a
+   long pre-quiz run (`renew`)
+4. Fall back to sending the PDF inline with the roadmap call when Gemini will
+   not cache it (e.g. a document below the minimum cached token count)
+
+Stored context:
+  {"_id": <sha256>, "cache_name": "cachedContents/..." or None, "model": ..., "expires_at": ...}
+
+A cache_name of None records that caching failed; it is not retried before
+expires_at. Courses created in native mode keep their syllabus in GridFS
+(`courses.syllabus`); DOCX syllabi are always extracted.
+"""
+
+import asyncio
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+import llm
+import shared_state
+
+EXTRACT = "extract"
+NATIVE = "native"
+
+# "extract" (text in every prompt) or "native" (PDF as a cached document)
+SYLLABUS_INGESTION = os.getenv("SYLLABUS_INGESTION", EXTRACT).strip().lower()
+
+# Lifetime of a cached syllabus; Gemini bills cached tokens per hour of storage
+SYLLABUS_CONTEXT_TTL_SECONDS = int(os.getenv("SYLLABUS_CONTEXT_TTL_SECONDS", "3600"))
+
+# A cache this close to expiry is replaced rather than used for another call
+_EXPIRY_MARGIN = timedelta(minutes=5)
+
+# After a failed cache creation, the document is sent inline for this long
+_RETRY_AFTER = timedelta(minutes=10)
+
+PDF_MEDIA_TYPE = "application/pdf"
+
+_INSTRUCTION = "The attached PDF is the syllabus of a university course. Answer questions about the course from it."
+
+
+@dataclass(slots=True)
+class SyllabusContext:
+    """The syllabus as Gemini sees it: a cached context, or else the PDF bytes to send inline."""
+
+    sha256: str
+    cache_name: Optional[str] = None
+    model: str = llm.DEFAULT_MODEL
+    data: Optional[bytes] = None
+    expires_at: Optional[datetime] = None
+    file_id: Any = None  # the syllabus in GridFS, to recreate the cache from
+
+    @property
+    def cached(self) -> bool:
+        return self.cache_name is not None
+
+
+def is_native(kind: Optional[str] = None) -> bool:
+    """Whether syllabi (of upload kind ``kind``, if given) are ingested natively."""
+    return SYLLABUS_INGESTION == NATIVE and kind in (None, "pdf")
+
+
+def generate(context: SyllabusContext, prompt: str):
+    """Blocking Gemini call of ``prompt`` about the syllabus of ``context`` (see llm.generate_content)."""
+    genai_types = llm.types()
+    if context.cached:
+        config = genai_types.GenerateContentConfig(cached_content=context.cache_name)
+        return llm.generate_content(prompt, model=context.model, config=config)
+    if context.data is None:
+        raise ValueError(f"Syllabus {context.sha256[:12]} has neither a cached context nor its PDF")
+    document = genai_types.Part.from_bytes(data=context.data, mime_type=PDF_MEDIA_TYPE)
+    return llm.generate_content([document, prompt], model=context.model)
+
+
+def _usable(record: Optional[Dict[str, Any]], now: datetime) -> bool:
+    return bool(record) and record.get("model") == llm.DEFAULT_MODEL and record["expires_at"] > now + _EXPIRY_MARGIN
+
+
+def _create_cache(sha256: str, data: bytes):
+    genai_types = llm.types()
+    contents = [genai_types.Content(role="user", parts=[
+        genai_types.Part.from_bytes(data=data, mime_type=PDF_MEDIA_TYPE),
+    ])]
+    return llm.create_cache(
+        contents,
+        ttl_seconds=SYLLABUS_CONTEXT_TTL_SECONDS,
+        display_name=f"syllabus-{sha256[:16]}",
+        system_instruction=_INSTRUCTION,
+    )
+
+
+async def ensure(db, sha256: str, data: bytes) -> SyllabusContext:
+    """
+    The context of a PDF syllabus, creating its cache if there is no usable one.
+
+    Concurrent callers for the same PDF, on any worker, share one cache creation.
+    The returned context carries ``data`` for the inline fallback.
+    """
+    while True:
+        record = await db.syllabus_contexts.find_one({"_id": sha256})
+        if _usable(record, datetime.utcnow()):
+            return SyllabusContext(sha256, record.get("cache_name"), record["model"], data, record["expires_at"])
+
+        async with shared_state.in_flight(f"syllabus_context:{sha256}") as leader:
+            if not leader:
+                continue  # another worker just created it; read its record
+            try:
+                cache = await asyncio.to_thread(_create_cache, sha256, data)
+                cache_name = cache.name
+                expires_at = datetime.utcnow() + timedelta(seconds=SYLLABUS_CONTEXT_TTL_SECONDS)
+                if cache.expire_time:
+                    expires_at = cache.expire_time.astimezone(timezone.utc).replace(tzinfo=None)
+                print(f"Cached syllabus {sha256[:12]} as {cache_name} until {expires_at:%H:%M} UTC")
+            except Exception as e:
+                print(f"Could not cache syllabus {sha256[:12]}, sending it inline: {e}")
+                cache_name, expires_at = None, datetime.utcnow() + _RETRY_AFTER
+            await db.syllabus_contexts.replace_one(
+                {"_id": sha256},
+                {"cache_name": cache_name, "model": llm.DEFAULT_MODEL, "expires_at": expires_at},
+                upsert=True,
+            )
+            return SyllabusContext(sha256, cache_name, llm.DEFAULT_MODEL, data, expires_at)
+
+
+def read_upload(path: str) -> bytes:
+    """The bytes of a syllabus spooled to a temporary file (uploads.stream_to_tempfile)."""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def store(fs, upload, data: bytes) -> Dict[str, Any]:
+    """Keep a natively ingested syllabus in GridFS; returns the course's `syllabus` field."""
+    file_id = await fs.upload_from_stream(
+        upload.filename, data,
+        metadata={"kind": "syllabus", "content_type": PDF_MEDIA_TYPE, "sha256": upload.sha256},
+    )
+    return {"file_id": file_id, "sha256": upload.sha256, "ingestion": NATIVE}
+
+
+async def for_course(db, fs, course: Dict[str, Any]) -> Optional[SyllabusContext]:
+    """
+    The cached context of a course's syllabus for per-topic quiz calls, or None.
+
+    None in extract mode, for courses whose syllabus was not kept, and when the
+    syllabus cannot be cached: per-topic prompts then go without it rather than
+    re-sending the whole PDF with every topic.
+    """
+    syllabus = course.get("syllabus") or {}
+    if not is_native() or not syllabus.get("file_id"):
+        return None
+    return await _stored_context(db, fs, syllabus["sha256"], syllabus["file_id"])
+
+
+async def renew(db, fs, context: Optional[SyllabusContext]) -> Optional[SyllabusContext]:
+    """
+    The context to use for the next call of a run that started with ``context``:
+    the same one while it is usable, else the syllabus's current cache
+    (recreated if need be), or None if it can no longer be cached.
+    """
+    if context is None or context.file_id is None or \
+            (context.expires_at is not None and context.expires_at > datetime.utcnow() + _EXPIRY_MARGIN):
+        return context
+    print(f"Cached syllabus {context.sha256[:12]} expires soon, renewing it")
+    try:
+        return await _stored_context(db, fs, context.sha256, context.file_id)
+    except Exception as e:
+        print(f"Could not renew cached syllabus {context.sha256[:12]}, continuing without it: {e}")
+        return None
+
+
+async def _stored_context(db, fs, sha256: str, file_id: Any) -> Optional[SyllabusContext]:
+    record = await db.syllabus_contexts.find_one({"_id": sha256})
+    if _usable(record, datetime.utcnow()):
+        context = SyllabusContext(sha256, record.get("cache_name"), record["model"], expires_at=record["expires_at"])
+    else:
+        grid_out = await fs.open_download_stream(file_id)
+        context = await ensure(db, sha256, await grid_out.read())
+        context.data = None  # per-topic calls never send it inline
+    context.file_id = file_id
+    return context if context.cached else None
+
+
+async def delete_course(fs, course: Dict[str, Any]):
+    """Remove the stored syllabus of a course; its cache expires on its own."""
+    file_id = (course.get("syllabus") or {}).get("file_id")
+    if file_id:
+        await fs.delete(file_id)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""
+Syllabus Tables - Roadmaps read straight from a syllabus's schedule table.
+
+This module provides functionality to:
+1. Find the week / date / topic / assignment table of a syllabus (pdfplumber
+   tables for PDF, python-docx tables for DOCX), including its continuation
+   on following pages
+2. Normalize its dates ("T 1/7", "Jan 7", "2025-01-07") to ISO dates, taking the
+   year from the syllabus text ("Winter 2025") and rolling over at New Year
+3. Turn its rows into roadmap entries (the RoadmapEntry shape of main.py)
+4. Ask Gemini only for the preQuizPrompt of each topic, in one batched call
+
+Syllabi without such a table still get their whole roadmap from Gemini
+(generate_roadmap in main.py).
+"""
+
+import asyncio
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import llm
+import page_extraction
+from document_extraction import extract_tables_from_file
+
+# Set to 0 to send every syllabus to Gemini as a whole
+SCHEDULE_TABLES = os.getenv("SCHEDULE_TABLES", "1") != "0"
+
+# Fewest topic rows a table needs to be taken as the course schedule
+SCHEDULE_MIN_ROWS = int(os.getenv("SCHEDULE_MIN_ROWS", "3"))
+
+# Header cell keywords of each column we read
+_COLUMN_KEYWORDS = {
+    "topic": r"topics?|subjects?|themes?|content|lectures?|description|titles?",
+    "date": r"dates?|days?|when",
+    "week": r"weeks?|wk|sessions?|lessons?|#|no\.?",
+    "assignment": r"assign\w*|due|assessments?|homework|hw|exams?|tests?|deliverables?|projects?|quiz\w*",
+    "reading": r"read\w*|chapters?|texts?|materials?|preparation|prep",
+}
+_COLUMN_PATTERNS = {
+    role: re.compile(rf"(?<!\w)(?:{words})(?!\w)", re.IGNORECASE) for role, words in _COLUMN_KEYWORDS.items()
+}
+
+# Header cells are short; longer cells are data that happens to contain a keyword
+_MAX_HEADER_CHARS = 40
+
+# A wrapped cell line that ends like this continues on the next line
+_CONTINUES = re.compile(r"(?:\b(?:and|or|of|the|a|an|to|in|on|for|with|from|by|vs\.?)|[,:&(–—-])$", re.IGNORECASE)
+
+# Each reading in a cell starts like this; other lines are wrapped text
+_READING_ITEM = re.compile(r"^(?:chapters?|ch\.|chs\.|article|video|reading|read|pp?\.|film|podcast|handout)\b", re.IGNORECASE)
+
+_MONTHS = {name: number for number, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1
+)}
+_MONTH = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_DATE_PATTERNS = [
+    ("ymd", re.compile(r"(?<!\d)(\d{4})-(\d{1,2})-(\d{1,2})(?!\d)")),
+    ("mdy", re.compile(r"(?<![\d/])(\d{1,2})/(\d{1,2})(?:/(\d{4}|\d{2}))?(?![\d/])")),
+    ("Mdy", re.compile(rf"\b{_MONTH}\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}}))?", re.IGNORECASE)),
+    ("dMy", re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+{_MONTH}(?:,?\s+(\d{{4}}))?", re.IGNORECASE)),
+]
+_TERM_YEAR = re.compile(
+    r"\b(?:spring|summer|fall|autumn|winter)\s+(?:(?:term|semester|quarter|session)\s+)?((?:19|20)\d{2})\b",
+    re.IGNORECASE,
+)
+_ANY_YEAR = re.compile(r"\b(20\d{2})\b")
+
+PROMPT_BATCH = (
+    "You are an expert academic planner. Below are the numbered topics of a course schedule. "
+    "For each topic write its preQuizPrompt: a detailed 2 sentence description of what the topic is about, "
+    "for a short quiz students take before that class. Return only a JSON array of strings, "
+    "one per topic, in the same order, with no other text."
+)
+
+
+# ---------------------------------------------------------------------------
+# Finding the schedule
+# ---------------------------------------------------------------------------
+
+def _column_roles(row: List[str]) -> Dict[str, int]:
+    """Which column holds what, for a header row; the keyword earliest in a cell decides its role."""
+    roles: Dict[str, int] = {}
+    for index, cell in enumerate(row):
+        cell = (cell or "").strip()
+        if not cell or len(cell) > _MAX_HEADER_CHARS:
+            continue
+        found = sorted(
+            (match.start(), role)
+            for role, pattern in _COLUMN_PATTERNS.items()
+            if (match := pattern.search(cell))
+        )
+        for _, role in found:
+            if role not in roles:
+                roles[role] = index
+                break
+    return roles
+
+
+def _is_schedule_header(roles: Dict[str, int]) -> bool:
+    return "topic" in roles and ("date" in roles or "week" in roles)
+
+
+def is_schedule_page(text: str) -> bool:
+    """Whether a page's text has a line that reads like the header row of a schedule table."""
+    return any(_line_is_header(line) for line in (text or "").splitlines())
+
+
+def _line_is_header(line: str) -> bool:
+    # A header row comes out of the text layer as one line made up mostly of column keywords
+    roles = {role for role, pattern in _COLUMN_PATTERNS.items() if pattern.search(line)}
+    return (
+        "topic" in roles and ("date" in roles or "week" in roles)
+        and len(line.split()) <= 3 * len(roles)
+    )
+
+
+def candidate_pages(pages: Dict[int, str]) -> List[int]:
+    """PDF pages that may hold the schedule table: schedule pages and the page after each."""
+    hits = [number for number, text in pages.items() if is_schedule_page(text)]
+    return sorted(set(hits) | {number + 1 for number in hits})
+
+
+def _schedule_table_rows(tables: List[List[List[str]]]) -> List[Dict[str, str]]:
+    """The body rows of every schedule table (and of its continuations), as {role: cell}."""
+    rows: List[Dict[str, str]] = []
+    roles: Optional[Dict[str, int]] = None
+    width = 0
+    for table in tables:
+        header_at = next(
+            (i for i, row in enumerate(table[:2]) if _is_schedule_header(_column_roles(row))), None
+        )
+        if header_at is not None:
+            roles, width = _column_roles(table[header_at]), len(table[header_at])
+            body = table[header_at + 1:]
+        elif roles is not None and table and len(table[0]) == width:
+            body = table  # the previous schedule table, continued on the next page
+        else:
+            roles = None
+            continue
+        for row in body:
+            rows.append({role: (row[index] if index < len(row) else "") or "" for role, index in roles.items()})
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Cleaning up cells
+# ---------------------------------------------------------------------------
+
+def _join_lines(cell: str, new_item: Optional[re.Pattern] = None) -> str:
+    """
+    The items of a cell on one line, separated by "; ".
+
+    Table cells wrap long text over several lines, so a line only starts a new
+    item if it matches ``new_item`` or, without it, if the previous line does
+    not end mid-phrase and the line does not start in lowercase.
+    """
+    items: List[str] = []
+    for line in (cell or "").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if items and (
+            not new_item.match(line) if new_item is not None
+            else _CONTINUES.search(items[-1]) or line[:1].islower()
+        ):
+            items[-1] += " " + line
+        else:
+            items.append(line)
+    return "; ".join(items)
+
+
+def term_year(text: str) -> Optional[int]:
+    """The year a syllabus's term starts in ("Winter 2025"), or the first year it mentions."""
+    match = _TERM_YEAR.search(text or "") or _ANY_YEAR.search(text or "")
+    return int(match.group(1)) if match else None
+
+
+def parse_date(cell: str) -> Optional[Tuple[Optional[int], int, int]]:
+    """The first date in a cell as (year or None, month, day); "T 1/7\\nTH 1/9" gives (None, 1, 7)."""
+    best = None
+    for kind, pattern in _DATE_PATTERNS:
+        match = pattern.search(cell or "")
+        if match and (best is None or match.start() < best[1].start()):
+            best = (kind, match)
+    if best is None:
+        return None
+
+    kind, match = best
+    if kind == "ymd":
+        year, month, day = (int(group) for group in match.groups())
+    elif kind == "mdy":
+        month, day = int(match.group(1)), int(match.group(2))
+        year = int(match.group(3)) if match.group(3) else None
+        if year is not None and year < 100:
+            year += 2000
+    elif kind == "Mdy":
+        month, day = _MONTHS[match.group(1).lower()], int(match.group(2))
+        year = int(match.group(3)) if match.group(3) else None
+    else:
+        day, month = int(match.group(1)), _MONTHS[match.group(2).lower()]
+        year = int(match.group(3)) if match.group(3) else None
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return year, month, day
+
+
+def normalize_dates(cells: Iterable[str], year: Optional[int] = None) -> List[Optional[str]]:
+    """
+    ISO dates for a column of date cells (None where a cell has no date).
+
+    Dates without a year take ``year`` (default: this year) and move to the
+    next year once the schedule wraps past New Year.
+    """
+    year = year or datetime.utcnow().year
+    previous: Optional[date] = None
+    dates: List[Optional[str]] = []
+    for cell in cells:
+        parsed = parse_date(cell)
+        day = None
+        if parsed is not None:
+            explicit, month, day_of_month = parsed
+            try:
+                day = date(explicit or year, month, day_of_month)
+                if explicit is None and previous is not None and day < previous - timedelta(days=60):
+                    day = date(year + 1, month, day_of_month)
+            except ValueError:
+                day = None
+        if day is not None:
+            year, previous = day.year, day
+        dates.append(day.isoformat() if day else None)
+    return dates
+
+
+def schedule_rows(raw_rows: List[Dict[str, str]], year: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Schedule table rows as {date, topic, assignment, reading}, one per topic."""
+    dates = normalize_dates((row.get("date", "") for row in raw_rows), year)
+    rows: List[Dict[str, Any]] = []
+    for row, iso in zip(raw_rows, dates):
+        topic = _join_lines(row.get("topic", ""))
+        assignment = _join_lines(row.get("assignment", ""))
+        reading = _join_lines(row.get("reading", ""), new_item=_READING_ITEM)
+        if not topic:
+            # A row split by a page break or a notes row: keep what it adds to the topic above
+            if rows and assignment:
+                rows[-1]["assignment"] = "; ".join(filter(None, [rows[-1]["assignment"], assignment]))
+            continue
+
+        when = iso
+        if when is None:
+            week = re.search(r"\d+", row.get("week", ""))
+            if week:
+                when = f"Week {week.group()}"
+            else:
+                when = _join_lines(row.get("date", "")) or None
+        rows.append({"date": when, "topic": topic, "assignment": assignment or None, "reading": reading or None})
+    return rows
+
+
+def schedule_from_tables(tables: List[List[List[str]]], text: str = "") -> Optional[List[Dict[str, Any]]]:
+    """
+    The schedule among a document's tables as rows (see :func:`schedule_rows`),
+    or None if none of them is one.
+
+    Args:
+        tables: As document_extraction.extract_tables_from_file returns them
+        text: The syllabus text, for the year of undated schedules
+    """
+    rows = schedule_rows(_schedule_table_rows(tables), term_year(text))
+    if len(rows) < SCHEDULE_MIN_ROWS:
+        return None
+    # A table of topics without dates or weeks is not a schedule
+    if sum(1 for row in rows if row["date"]) * 2 < len(rows):
+        return None
+    return rows
+
+
+def find_schedule(source, suffix: str, text: str = "", pages: Optional[Iterable[int]] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    The schedule of a syllabus file (PDF or DOCX path or stream), read from the
+    file itself. Blocking; ``pages`` limits the PDF pages laid out (see
+    :func:`candidate_pages`).
+    """
+    return schedule_from_tables(extract_tables_from_file(source, suffix, pages), text)
+
+
+async def detect(
+    db, path: Optional[str], kind: str, doc_hash: str, text: str, executor=None
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    The schedule of an uploaded syllabus, or None.
+
+    Uses the tables stored with its pages when it was extracted with
+    ``tables_on=is_schedule_page`` (page_extraction.py); otherwise lays out
+    again only the PDF pages whose stored text looks like a schedule.
+    """
+    if not SCHEDULE_TABLES or kind not in ("pdf", "docx"):
+        return None
+
+    try:
+        tables = await page_extraction.stored_tables(db, doc_hash)
+        if tables is None:
+            if not path:
+                return None
+            pages = None
+            if kind == "pdf":
+                pages = candidate_pages(await page_extraction.page_texts(db, doc_hash))
+                if not pages:
+                    return None
+            loop = asyncio.get_running_loop()
+            tables = await loop.run_in_executor(executor, extract_tables_from_file, path, f".{kind}", pages)
+        rows = schedule_from_tables(tables, text)
+    except Exception as e:
+        print(f"Could not read the schedule table: {e}")
+        return None
+    if rows:
+        print(f"Found a schedule table with {len(rows)} topics")
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Roadmap
+# ---------------------------------------------------------------------------
+
+def _fallback_prompt(row: Dict[str, Any]) -> str:
+    prompt = f"This class covers {row['topic']}."
+    if row.get("reading"):
+        prompt += f" Prepare with: {row['reading']}."
+    return prompt
+
+
+def _quiz_prompts(rows: List[Dict[str, Any]], syllabus_text: str) -> List[str]:
+    """One preQuizPrompt per row from a single Gemini call; local ones if that fails."""
+    heading = next((line.strip() for line in (syllabus_text or "").splitlines() if line.strip()), "")[:200]
+    topics = "\n".join(
+        f"{number}. {row['topic']}" + (f" (reading: {row['reading']})" if row.get("reading") else "")
+        for number, row in enumerate(rows, start=1)
+    )
+    prompt = f"{PROMPT_BATCH}\n\nCourse: {heading}\n\nTopics:\n{topics}"
+
+    try:
+        response = llm.generate_content(prompt)
+        stripped = llm.response_text(response).strip()
+        if stripped.startswith("```"):
+            stripped = re.sub(r"^```[a-zA-Z]*\n", "", stripped)
+            stripped = re.sub(r"```$", "", stripped).strip()
+        prompts = json.loads(stripped)
+        if not isinstance(prompts, list) or len(prompts) != len(rows):
+            raise ValueError(f"expected {len(rows)} prompts, got {len(prompts) if isinstance(prompts, list) else prompts!r}")
+    except Exception as e:
+        print(f"Batched preQuizPrompt generation failed, using the topics as prompts: {e}")
+        return [_fallback_prompt(row) for row in rows]
+
+    results = []
+    for row, prompt in zip(rows, prompts):
+        if isinstance(prompt, dict):
+            prompt = prompt.get("preQuizPrompt")
+        results.append(prompt.strip() if isinstance(prompt, str) and prompt.strip() else _fallback_prompt(row))
+    return results
+
+
+def roadmap_from_schedule(rows: List[Dict[str, Any]], syllabus_text: str = "") -> List[Dict[str, Any]]:
+    """Roadmap entries ({date, topic, preQuizPrompt, assignment}) for schedule rows. Blocking."""
+    prompts = _quiz_prompts(rows, syllabus_text)
+    return [
+        {"date": row["date"], "topic": row["topic"], "preQuizPrompt": prompt, "assignment": row["assignment"]}
+        for row, prompt in zip(rows, prompts)
+    ]
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Uploads - Bounded-memory handling of uploaded files.
+
+This module provides functionality to:
+1. Identify an upload by its magic bytes (first chunk) instead of trusting the
+   client's Content-Type or filename
+2. Enforce a size cap per file kind while reading, before the file is complete
+3. Stream uploads chunk by chunk into GridFS (or a temporary file) while hashing
+   them incrementally (SHA-256)
+4. Extract text from the stored GridFS file rather than from an in-memory copy
+
+Worker memory stays at roughly one chunk per upload however large the file is.
+Size caps are configured in MB with UPLOAD_MAX_<KIND>_MB (PDF, DOCX, IMAGE, TEXT, ZIP).
+"""
+
+import asyncio
+import codecs
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from document_extraction import extract_text_from_file
+
+# Bytes read per step; also the size of the first chunk that is sniffed
+CHUNK_SIZE = 256 * 1024
+
+MB = 1024 * 1024
+
+MAX_BYTES = {
+    "pdf": int(float(os.getenv("UPLOAD_MAX_PDF_MB", "25")) * MB),
+    "docx": int(float(os.getenv("UPLOAD_MAX_DOCX_MB", "15")) * MB),
+    "image": int(float(os.getenv("UPLOAD_MAX_IMAGE_MB", "10")) * MB),
+    "text": int(float(os.getenv("UPLOAD_MAX_TEXT_MB", "2")) * MB),
+    "zip": int(float(os.getenv("UPLOAD_MAX_ZIP_MB", "200")) * MB),
+}
+
+# Whole request bodies above this are refused before multipart parsing (see main.py)
+MAX_REQUEST_BYTES = int(float(os.getenv("UPLOAD_MAX_REQUEST_MB", "40")) * MB)
+
+# The same for bulk imports (POST /courses/bulk), which carry a whole department's syllabi
+MAX_BULK_REQUEST_BYTES = int(float(os.getenv("UPLOAD_MAX_BULK_REQUEST_MB", "1000")) * MB)
+
+DOCUMENT_KINDS = {"pdf", "docx", "text"}
+SYLLABUS_KINDS = {"pdf", "docx"}
+IMAGE_KINDS = {"image"}
+ARCHIVE_KINDS = {"zip"}
+
+# Extraction suffix per kind, as document_extraction expects it
+SUFFIXES = {"pdf": ".pdf", "docx": ".docx", "text": ".txt", "zip": ".zip"}
+
+_IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+ZIP_MEDIA_TYPES = {"application/zip", "application/x-zip-compressed"}
+
+
+class UploadRejected(ValueError):
+    """An upload failed validation. ``status_code`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass(slots=True)
+class StoredUpload:
+    """Where an upload ended up and what it turned out to be."""
+
+    kind: str
+    media_type: str
+    filename: str
+    size: int
+    sha256: str
+    file_id: Any = None
+    path: Optional[str] = None
+
+
+def sniff(first_chunk: bytes, filename: str = "", declared_type: str = "") -> Optional[Tuple[str, str]]:
+    """
+    Identify a file from its first bytes.
+
+    Returns:
+        ``(kind, media_type)`` with kind one of pdf / docx / image / text / zip, or None
+    """
+    if first_chunk.startswith(b"%PDF-"):
+        return "pdf", "application/pdf"
+    for signature, media_type in _IMAGE_SIGNATURES:
+        if first_chunk.startswith(signature):
+            return "image", media_type
+    if first_chunk[:4] == b"RIFF" and first_chunk[8:12] == b"WEBP":
+        return "image", "image/webp"
+    if first_chunk[4:8] == b"ftyp" and first_chunk[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image", "image/heic"
+    if first_chunk.startswith(b"PK\x03\x04"):
+        # A zip archive is only taken for one when it says so (it may hold DOCX files)
+        if filename.lower().endswith(".zip") or declared_type in ZIP_MEDIA_TYPES:
+            return "zip", "application/zip"
+        # DOCX is a zip; its first entry is normally [Content_Types].xml or a word/ part
+        head = first_chunk[:CHUNK_SIZE]
+        if b"word/" in head or filename.lower().endswith(".docx") or declared_type == DOCX_MEDIA_TYPE:
+            return "docx", DOCX_MEDIA_TYPE
+        return None
+    if first_chunk.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        # Legacy .doc (OLE); python-docx cannot read it
+        return None
+    if _looks_like_text(first_chunk):
+        return "text", "text/plain"
+    return None
+
+
+def _looks_like_text(chunk: bytes) -> bool:
+    if not chunk or b"\x00" in chunk:
+        return False
+    try:
+        chunk.decode("utf-8")
+        return True
+    except UnicodeDecodeError as e:
+        # A multi-byte character may be cut at the chunk boundary
+        return e.start >= len(chunk) - 3
+
+
+class LocalFile:
+    """
+    A file on disk with the ``read`` / ``filename`` / ``content_type`` of an
+    UploadFile, so files that did not arrive as uploads (e.g. members of an
+    uploaded zip) go through the same checks.
+    """
+
+    def __init__(self, path: str, filename: str, content_type: str = ""):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self._file = open(path, "rb")
+
+    async def read(self, size: int = -1) -> bytes:
+        return await asyncio.to_thread(self._file.read, size)
+
+    def close(self):
+        self._file.close()
+
+
+async def _chunks(upload, allowed: Iterable[str]):
+    """Yield ``(kind, media_type)`` first, then the upload's chunks, enforcing type and size."""
+    first = await upload.read(CHUNK_SIZE)
+    if not first:
+        raise UploadRejected(f"{upload.filename or 'Upload'} is empty")
+
+    identified = sniff(first, upload.filename or "", upload.content_type or "")
+    allowed = set(allowed)
+    if identified is None or identified[0] not in allowed:
+        found = identified[1] if identified else "unrecognized content"
+        raise UploadRejected(
+            f"Unsupported file {upload.filename!r} ({found}). Allowed: {', '.join(sorted(allowed))}",
+            status_code=415,
+        )
+    yield identified
+
+    limit = MAX_BYTES[identified[0]]
+    size = 0
+    chunk = first
+    while chunk:
+        size += len(chunk)
+        if size > limit:
+            raise UploadRejected(
+                f"{upload.filename or 'Upload'} is larger than the {limit / MB:g} MB limit for {identified[0]} files",
+                status_code=413,
+            )
+        yield chunk
+        chunk = await upload.read(CHUNK_SIZE)
+
+
+async def stream_to_gridfs(fs, upload, allowed: Iterable[str], metadata: Optional[Dict[str, Any]] = None) -> StoredUpload:
+    """
+    Validate ``upload`` and copy it into GridFS one chunk at a time.
+
+    The sniffed media type, size and SHA-256 are stored in the file's metadata.
+    Raises UploadRejected; a partially written file is aborted.
+    """
+    chunks = _chunks(upload, allowed)
+    kind, media_type = await chunks.__anext__()
+    filename = upload.filename or f"upload{SUFFIXES.get(kind, '')}"
+
+    hasher = hashlib.sha256()
+    size = 0
+    grid_in = fs.open_upload_stream(filename, metadata={**(metadata or {}), "content_type": media_type, "kind": kind})
+    try:
+        async for chunk in chunks:
+            hasher.update(chunk)
+            size += len(chunk)
+            await grid_in.write(chunk)
+        await grid_in.set("metadata", {
+            **(metadata or {}), "content_type": media_type, "kind": kind,
+            "filename": filename, "size": size, "sha256": hasher.hexdigest(),
+        })
+        await grid_in.close()
+    except BaseException:
+        await grid_in.abort()
+        raise
+
+    return StoredUpload(kind, media_type, filename, size, hasher.hexdigest(), file_id=grid_in._id)
+
+
+async def stream_to_tempfile(upload, allowed: Iterable[str]) -> StoredUpload:
+    """Validate ``upload`` and copy it to a temporary file. The caller removes ``path``."""
+    chunks = _chunks(upload, allowed)
+    kind, media_type = await chunks.__anext__()
+
+    hasher = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=SUFFIXES.get(kind, "")) as tmp:
+        try:
+            async for chunk in chunks:
+                hasher.update(chunk)
+                size += len(chunk)
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+
+    return StoredUpload(kind, media_type, upload.filename or os.path.basename(tmp.name), size,
+                        hasher.hexdigest(), path=tmp.name)
+
+
+async def read_limited(upload, allowed: Iterable[str]) -> Tuple[bytes, str]:
+    """
+    Validate ``upload`` and return ``(data, media_type)``.
+
+    For uploads that have to be in memory anyway (e.g. images sent inline to
+    Gemini); the size cap still applies before the whole file is buffered.
+    """
+    chunks = _chunks(upload, allowed)
+    _, media_type = await chunks.__anext__()
+    return b"".join([chunk async for chunk in chunks]), media_type
+
+
+async def gridfs_to_tempfile(fs, file_id, suffix: str) -> str:
+    """Spool a stored GridFS file to a temporary file, chunk by chunk. The caller removes it."""
+    grid_out = await fs.open_download_stream(file_id)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        try:
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name
+
+
+async def extract_stored_text(fs, stored: StoredUpload) -> str:
+    """Extract the text of an upload stored by :func:`stream_to_gridfs`."""
+    if stored.kind == "text":
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        grid_out = await fs.open_download_stream(stored.file_id)
+        parts = []
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b"", final=True))
+        return "".join(parts)
+
+    path = await gridfs_to_tempfile(fs, stored.file_id, SUFFIXES[stored.kind])
+    try:
+        return await asyncio.to_thread(extract_text_from_file, path, SUFFIXES[stored.kind])
+    finally:
+        os.remove(path)